@@ -0,0 +1,588 @@
+"""
+    Description
+    -----------
+    Asyncio API for DRTP, for applications that embed transfers instead of
+    running application.py. One event loop drives any number of
+    connections: the Sender (client.py) and Session (server.py) state
+    machines do the protocol work, this module feeds them the datagrams of
+    asyncio datagram endpoints and runs their timers with loop.call_at()
+    instead of socket timeouts.
+
+    DRTP carries data one way, from the client to the server. connect()
+    returns a DRTPConnection that sends; start_server() returns a DRTPServer
+    that hands the data of every client to a callback as a DRTPStream, an
+    async iterator of bytes:
+
+        async def handle(stream):
+            async for chunk in stream:
+                pipeline.feed(chunk)
+
+        server = await start_server(handle, '127.0.0.1', 8088)
+        async with await connect('127.0.0.1', 8088, window=32) as conn:
+            await conn.send(b'header')
+            with open('photo.jpg', 'rb') as f:
+                await conn.send(f)
+
+    Connection messages are printed as by the command line tools unless
+    logging is turned off with drtp.trace.configure(LOG_OFF).
+"""
+import asyncio
+from collections import deque
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF
+from drtp import *
+from client import Sender
+from congestion import Pacer, make_controller
+from compression import Compressor
+from fec import FecEncoder
+from metrics import TransferMetrics
+from server import Session, fit_window, RCVBUF_SIZE, SESSION_IDLE_TIMEOUT, ACK_EVERY, ACK_DELAY
+
+# Bytes a DRTPStream holds for its reader before the server stops taking the client's packets
+STREAM_LIMIT = 4 * 1024 * 1024
+
+"""
+    Description
+    -----------
+    The sending end of a DRTP connection, made by connect(). Every send()
+    runs a Sender over the data and returns once all of it has been ACKed;
+    several sends follow each other in one stream, with the RTT estimate
+    and congestion window carried over. close() ends the connection with
+    the FIN / FIN-ACK exchange. Used as an async context manager, the
+    connection is closed on exit, or dropped without a FIN after an error.
+
+    Parameters
+    ----------
+    server_addr : (ip, port) tuple of the server.
+    window, mode, cc, mss, pace, pace_rate, compress, fec, fec_group : See
+        connect().
+    max_retry : SYN and FIN retransmissions before giving up.
+    metrics_interval : Seconds between periodic samples in the metrics.
+
+    Attributes
+    ----------
+    metrics : TransferMetrics of the connection, payload_bytes counts the
+        bytes of all sends.
+    features : Feature flags agreed in the handshake.
+"""
+class DRTPConnection(asyncio.DatagramProtocol):
+
+    def __init__(self, server_addr: tuple, window: int=15, mode: str='gbn', cc: str='none', mss: int=DATA_LEN, pace: bool=False, pace_rate: float=None, compress: bool=False, fec: bool=False, fec_group: int=None, max_retry: int=5, metrics_interval: float=0.0):
+        self.server_addr = server_addr
+        self.window = window
+        self.offer = FLAG_EXT | FLAG_MSS | (FLAG_SR if mode == 'sr' else 0) | (FLAG_COMPRESS if compress else 0) | (FLAG_FEC if fec else 0)
+        self.cc_name = cc
+        self.mss = mss
+        self.pacer = Pacer(pace_rate / 8 if pace_rate else None) if pace else None
+        self.fec_group = fec_group
+        self.max_retry = max_retry
+        self.rtt = RttEstimator() # Shared by the handshake, every send and the teardown
+        self.metrics = TransferMetrics('client', server_addr, metrics_interval)
+        self.features = 0
+        self.cc = None
+        self.fec = None
+        self.loop = None
+        self.transport = None
+        self.waiter = None # Future for the next datagram during the handshake and the teardown
+        self.sender = None # Sender of the running send()
+        self.sent = None # Future of the running send(), done once all of its data is ACKed
+        self.timer = None # Loop timer for the sender's next deadline
+        self.next_seq = 1 # Sequence number of the first packet of the next send()
+        self.closed = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+
+    def datagram_received(self, data, addr):
+        if addr != self.server_addr:
+            return
+        if self.sender is not None:
+            self.drive(self.sender.handle, data)
+        elif self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(data)
+
+    def connection_lost(self, exc):
+        for future in (self.waiter, self.sent):
+            if future is not None and not future.done():
+                future.set_exception(RuntimeError('Connection closed'))
+
+    # Run a Sender method with the current time, then finish the send or set the timer for the sender's next deadline
+    def drive(self, method, *args):
+        try:
+            method(*args, self.loop.time())
+        except Exception as e: # Reading the data failed
+            if not self.sent.done():
+                self.sent.set_exception(e)
+            return
+        sender = self.sender
+        if sender.done:
+            if not self.sent.done():
+                self.sent.set_result(None)
+            return
+        when = sender.next_deadline()
+        if when is None or (self.timer is not None and self.timer.when() <= when):
+            return # Nothing to wait for, or the timer fires first and expire() sets the next one
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = self.loop.call_at(when, self.expire)
+
+    # Loop timer: let the sender handle its expired timers
+    def expire(self):
+        self.timer = None
+        self.drive(self.sender.poll)
+
+    """
+        Description
+        -----------
+        Send `pkt` until `accept` returns something other than None for a
+        datagram that arrives, waiting one RTO per attempt.
+
+        Returns
+        -------
+        reply : What accept returned, None after max_retry attempts.
+    """
+    async def exchange(self, pkt, accept, sample: bool=False):
+        for retries in range(self.max_retry):
+            self.transport.sendto(pkt, self.server_addr)
+            sent_at = self.loop.time()
+            deadline = sent_at + self.rtt.rto
+            while True:
+                self.waiter = self.loop.create_future()
+                try:
+                    data = await asyncio.wait_for(self.waiter, deadline - self.loop.time())
+                except asyncio.TimeoutError:
+                    break
+                reply = accept(data)
+                if reply is not None:
+                    if sample and retries == 0: # Karn's rule: a resent packet gives an ambiguous sample
+                        self.rtt.sample(self.loop.time() - sent_at)
+                        self.metrics.add_rtt(self.loop.time() - sent_at)
+                    return reply
+            self.rtt.backoff()
+        return None
+
+    # Three-way handshake, see client.handshake_client
+    async def handshake(self):
+        syn_pkt = make_packet(0, 0, FLAG_SYN | self.offer, 0, MSS_OPTION.pack(self.mss) + WINDOW_OPTION.pack(self.window))
+
+        # The SYN-ACK's flags, window and options, None for anything else
+        def synack(data):
+            if len(data) < HEADER_LEN:
+                return None
+            _, s_ack, s_flags, s_window = parse_header(data[:HEADER_LEN])
+            if (s_flags & (FLAG_SYN | FLAG_ACK)) != (FLAG_SYN | FLAG_ACK) or s_ack != 0:
+                return None
+            return s_flags, s_window, read_option(data, s_flags, FLAG_MSS, SYNACK_OPTIONS), read_option(data, s_flags, FLAG_EXT, SYNACK_OPTIONS)
+
+        reply = await self.exchange(syn_pkt, synack, sample=True)
+        if reply is None:
+            raise RuntimeError('Three-way handshake failed')
+        s_flags, s_window, offered, agreed_window = reply
+        self.features = s_flags & self.offer # Features the server echoed back
+        self.window = min(self.window, agreed_window[0] if self.features & FLAG_EXT and agreed_window else s_window)
+        self.mss = offered[0] if self.features & FLAG_MSS and offered else DATA_LEN
+        self.transport.sendto(make_packet(0, 0, FLAG_ACK, min(self.window, max_window(0))), self.server_addr)
+        self.cc = make_controller(self.cc_name, self.window)
+        self.fec = FecEncoder(self.fec_group) if self.features & FLAG_FEC else None
+        info(f'{self.server_addr}: Connection established, window {self.window}, payload size {self.mss}')
+
+    """
+        Description
+        -----------
+        Send `data` and return once the server has ACKed all of it.
+
+        Parameters
+        ----------
+        data : A bytes-like object, or a binary file or other object with
+            read(n) that returns b'' at its end. Files are read in the
+            event loop's thread, a packet at a time.
+
+        Raises
+        ------
+        RuntimeError
+            If another send() is running or the connection is closed.
+    """
+    async def send(self, data):
+        if self.closed or self.sender is not None:
+            raise RuntimeError('Connection is closed' if self.closed else 'Another send() is still running')
+        view = data if hasattr(data, 'read') else memoryview(data).cast('B')
+        source = Compressor(view) if self.features & FLAG_COMPRESS else view
+        m = self.metrics
+        acked = m.payload_bytes # Bytes of the earlier sends
+        self.sender = Sender(self.transport, self.server_addr, self.next_seq, self.window, source, self.features, self.rtt, self.cc, m, self.mss, self.pacer, self.fec)
+        self.sent = self.loop.create_future()
+        try:
+            self.drive(self.sender.start)
+            await self.sent
+            self.next_seq = self.sender.final_seq
+        finally:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if source is not view:
+                source.close()
+            self.sender = None
+        if source is not view: # The ACKed payloads were compressed, count the bytes that were sent
+            m.compressed_bytes += m.payload_bytes - acked
+            m.payload_bytes = acked + source.consumed
+        m.data_finished()
+
+    """
+        Description
+        -----------
+        End the connection with a FIN / FIN-ACK exchange, see
+        client.teardown_client. Does nothing when already closed.
+
+        Raises
+        ------
+        RuntimeError
+            If the FIN is not acknowledged within max_retry attempts.
+    """
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        header = header_for(self.features)
+        seq = self.next_seq % seq_space(self.features)
+
+        # The FIN-ACK for our FIN, None for anything else
+        def fin_ack(data):
+            if len(data) != header.size:
+                return None
+            _, s_ack, s_flags, _ = header.unpack(data)
+            return s_flags if (s_flags & (FLAG_ACK | FLAG_FIN)) == (FLAG_ACK | FLAG_FIN) and s_ack == seq else None
+
+        try:
+            if await self.exchange(header.pack(seq, 0, FLAG_FIN, 0), fin_ack) is None:
+                raise RuntimeError('Teardown failed: FIN not acknowledged')
+            info(f'{self.server_addr}: Connection closes')
+        finally:
+            self.transport.close()
+
+    # Drop the connection without a FIN
+    def abort(self):
+        self.closed = True
+        self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.close()
+        else:
+            self.abort()
+
+"""
+    Description
+    -----------
+    Open a DRTP connection to a server (server.server, server.serve or a
+    DRTPServer) and complete the handshake.
+
+    Parameters
+    ----------
+    host : Server host name or IPv4 address.
+    port : Server UDP port.
+    window : Receive window to offer, the server may lower it.
+    mode : 'gbn' for Go-Back-N or 'sr' to offer Selective Repeat.
+    cc : Name of the congestion controller, see congestion.CONTROLLERS.
+    mss : Largest payload per DATA packet to offer, the server may lower it.
+    pace : Pace the packets with a token bucket, see congestion.Pacer.
+    pace_rate : Fixed pacing rate in bits per second, None to follow cwnd / srtt.
+    compress : Offer compression of the data (see compression.py).
+    fec : Offer forward error correction (see fec.py).
+    fec_group : Fixed FEC group size, None to adapt it to the loss rate.
+    local_addr : Local (ip, port) to bind, any by default.
+
+    Returns
+    -------
+    conn : Connected DRTPConnection.
+
+    Raises
+    ------
+    RuntimeError
+        If the handshake fails.
+"""
+async def connect(host: str, port: int, window: int=15, mode: str='gbn', cc: str='none', mss: int=DATA_LEN, pace: bool=False, pace_rate: float=None, compress: bool=False, fec: bool=False, fec_group: int=None, local_addr: tuple=('0.0.0.0', 0)):
+    loop = asyncio.get_running_loop()
+    server_addr = (await loop.getaddrinfo(host, port, family=AF_INET, type=SOCK_DGRAM))[0][4]
+    _, conn = await loop.create_datagram_endpoint(
+        lambda: DRTPConnection(server_addr, window, mode, cc, mss, pace, pace_rate, compress, fec, fec_group), local_addr=local_addr)
+    try:
+        await conn.handshake()
+    except BaseException:
+        conn.abort()
+        raise
+    return conn
+
+
+"""
+    Description
+    -----------
+    The data of one client of a DRTPServer, in order, as an async iterator
+    of bytes chunks. The iteration ends after the client's FIN, or raises
+    RuntimeError once the chunks received so far are read when the
+    connection was dropped.
+
+    While more than `limit` bytes wait to be read, the server ignores the
+    client's DATA packets, so a slow reader holds the sender back through
+    its retransmission timer instead of buffering without bound.
+
+    Attributes
+    ----------
+    peer : (ip, port) tuple of the client.
+    metrics : TransferMetrics of the connection, see server.Receiver.
+"""
+class DRTPStream:
+
+    def __init__(self, peer: tuple, limit: int=STREAM_LIMIT):
+        self.peer = peer
+        self.limit = limit
+        self.metrics = None
+        self.chunks = deque()
+        self.buffered = 0 # Bytes in chunks
+        self.eof = False
+        self.error = None
+        self.waiter = None # Future of a reader waiting for data
+
+    @property
+    def full(self):
+        return self.buffered >= self.limit
+
+    # Wake up a waiting reader
+    def wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def feed_data(self, data: bytes):
+        self.chunks.append(data)
+        self.buffered += len(data)
+        self.wake()
+
+    def feed_eof(self):
+        self.eof = True
+        self.wake()
+
+    def set_exception(self, exc: Exception):
+        self.error = exc
+        self.wake()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.chunks:
+            if self.error is not None:
+                raise self.error
+            if self.eof:
+                raise StopAsyncIteration
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        chunk = self.chunks.popleft()
+        self.buffered -= len(chunk)
+        return chunk
+
+    # All of the data up to the end of the stream
+    async def read(self):
+        return b''.join([chunk async for chunk in self])
+
+
+"""
+    Description
+    -----------
+    A DRTP server in an event loop, made by start_server(). Like serve(), it
+    demultiplexes the datagrams of many clients by address into Session
+    state machines, but hands every client's data to `handler` as a
+    DRTPStream instead of writing files. Every session has a loop timer of
+    its own for its SYN-ACK resends, delayed ACKs and idle eviction.
+
+    Parameters
+    ----------
+    handler : Called with the DRTPStream of every client once its handshake
+        is complete. A coroutine it returns is run as a task.
+    rcv_window, idle_timeout, mss, ack_every, ack_delay : See serve().
+    features : Feature flags the server is willing to use. Parallel
+        streams, resumable transfers and batches need files, and are not
+        offered.
+    limit : Bytes a DRTPStream holds for its reader, see DRTPStream.
+"""
+class DRTPServer(asyncio.DatagramProtocol):
+
+    def __init__(self, handler, rcv_window: int=15, idle_timeout: float=SESSION_IDLE_TIMEOUT, features: int=FLAG_EXT | FLAG_SR | FLAG_MSS | FLAG_COMPRESS | FLAG_FEC, mss: int=MAX_MSS, ack_every: int=ACK_EVERY, ack_delay: float=ACK_DELAY, limit: int=STREAM_LIMIT):
+        self.handler = handler
+        self.rcv_window = rcv_window
+        self.idle_timeout = idle_timeout
+        self.features = features
+        self.mss = mss
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.limit = limit
+        self.sessions = {} # client address -> Session
+        self.streams = {} # client address -> DRTPStream of its session
+        self.timers = {} # client address -> loop timer of its session
+        self.pending = set() # Addresses whose handshake is not complete yet
+        self.tasks = set() # Handler tasks, kept until they finish
+        self.loop = None
+        self.transport = None
+        self.closed = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+        self.closed = self.loop.create_future()
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    # Address the server is bound to
+    @property
+    def address(self):
+        return self.transport.get_extra_info('sockname')
+
+    def datagram_received(self, data, addr):
+        now = self.loop.time()
+        sess = self.sessions.get(addr)
+        if sess is None or sess.state == Session.CLOSED:
+            # Only a bare SYN may open a new session
+            if len(data) < HEADER_LEN:
+                return
+            _, _, c_flags, _ = parse_header(data[:HEADER_LEN])
+            if not (c_flags & FLAG_SYN) or (c_flags & FLAG_ACK):
+                if sess is not None:
+                    sess.handle(data, now) # Answer a resent FIN
+                return
+            if sess is not None: # The client starts over after a finished transfer
+                self.forget(addr)
+            sess = self.open(data, addr, c_flags, now)
+        elif sess.state == Session.ESTABLISHED and self.streams[addr].full and not self.is_fin(sess, data):
+            sess.last_active = now # The reader is behind: drop the packet, the sender resends it later
+            return
+        else:
+            try:
+                sess.handle(data, now)
+            except Exception as e: # Undecodable data, e.g. a corrupt compressed block
+                self.streams[addr].set_exception(e)
+                self.forget(addr)
+                return
+        stream = self.streams[addr]
+        if addr in self.pending and sess.state != Session.SYN_RCVD: # Handshake complete
+            self.pending.discard(addr)
+            self.accept(stream)
+        if sess.state == Session.CLOSED and not stream.eof:
+            stream.feed_eof()
+        self.schedule(addr, sess)
+
+    # True when `data` is a FIN for the established session `sess`
+    @staticmethod
+    def is_fin(sess: Session, data):
+        header = sess.rx.header
+        return len(data) >= header.size and bool(header.unpack_from(data)[2] & FLAG_FIN)
+
+    # Start a session for the SYN `data` from addr
+    def open(self, data, addr: tuple, c_flags: int, now: float):
+        info(f'{addr}: SYN packet is received')
+        agreed_mss = DATA_LEN
+        offered = read_option(data, c_flags, FLAG_EXT)
+        client_window = offered[0] if c_flags & self.features & FLAG_EXT and offered else None
+        offered = read_option(data, c_flags, FLAG_MSS)
+        if c_flags & self.features & FLAG_MSS and offered:
+            agreed_mss = min(offered[0], self.mss)
+        else:
+            c_flags &= ~FLAG_MSS
+        window = fit_window(self.transport.get_extra_info('socket'), self.rcv_window, EXT_HEADER_LEN + agreed_mss)
+        stream = DRTPStream(addr, self.limit)
+        sess = Session(self.transport, addr, c_flags, window, self.features, 0, None, now, mss=agreed_mss,
+                       ack_every=self.ack_every, ack_delay=self.ack_delay, sink=stream.feed_data, client_window=client_window)
+        stream.metrics = sess.metrics
+        self.sessions[addr] = sess
+        self.streams[addr] = stream
+        self.pending.add(addr)
+        return sess
+
+    # Hand a new client's stream to the handler
+    def accept(self, stream: DRTPStream):
+        result = self.handler(stream)
+        if asyncio.iscoroutine(result):
+            task = self.loop.create_task(result)
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    # Set the session's loop timer for its next deadline
+    def schedule(self, addr: tuple, sess: Session):
+        when = sess.next_deadline(self.idle_timeout)
+        timer = self.timers.get(addr)
+        if timer is not None:
+            if timer.when() <= when:
+                return # It fires first, expire() sets the next one
+            timer.cancel()
+        self.timers[addr] = self.loop.call_at(when, self.expire, addr)
+
+    # Loop timer of the session of addr
+    def expire(self, addr: tuple):
+        del self.timers[addr]
+        sess = self.sessions[addr]
+        if sess.poll(self.loop.time(), self.idle_timeout):
+            self.forget(addr)
+        else:
+            self.schedule(addr, sess)
+
+    # Forget the session of addr, failing its stream if the client's FIN never came
+    def forget(self, addr: tuple):
+        sess = self.sessions.pop(addr)
+        stream = self.streams.pop(addr)
+        timer = self.timers.pop(addr, None)
+        if timer is not None:
+            timer.cancel()
+        self.pending.discard(addr)
+        if not stream.eof:
+            sess.abort()
+            stream.set_exception(RuntimeError(f'Connection from {addr} was dropped'))
+
+    # Stop serving: drop every session and close the socket
+    def close(self):
+        for addr in list(self.sessions):
+            self.forget(addr)
+        self.transport.close()
+
+    async def wait_closed(self):
+        await self.closed
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+        await self.wait_closed()
+
+"""
+    Description
+    -----------
+    Start a DRTPServer on a UDP socket bound to host and port.
+
+    Parameters
+    ----------
+    handler : Called with a DRTPStream for every client, see DRTPServer.
+    host : Local IP address to bind to.
+    port : UDP port, 0 for any (see DRTPServer.address).
+    options : Keyword arguments for DRTPServer (rcv_window, mss, limit, ...).
+
+    Returns
+    -------
+    server : The running DRTPServer.
+"""
+async def start_server(handler, host: str, port: int, **options):
+    loop = asyncio.get_running_loop()
+    sock = socket(AF_INET, SOCK_DGRAM)
+    try:
+        sock.setsockopt(SOL_SOCKET, SO_RCVBUF, RCVBUF_SIZE)
+        sock.bind((host, port))
+        sock.setblocking(False)
+        _, server = await loop.create_datagram_endpoint(lambda: DRTPServer(handler, **options), sock=sock)
+    except BaseException:
+        sock.close()
+        raise
+    return server
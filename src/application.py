@@ -1,6 +1,9 @@
 import argparse
-from server import server
+import os
+from server import server, serve, serve_workers, ACK_EVERY, ACK_DELAY
 from client import client 
+from congestion import CONTROLLERS
+from drtp import LOG_LEVELS, DATA_LEN, MAX_MSS, trace
 
 """
     Description
@@ -27,21 +30,72 @@ def main ():
 
     parser.add_argument("-i", "--ip", required=True, help="IP")
     parser.add_argument("-p", "--port", required=True, type=int, help="Port", default=8080)
-    parser.add_argument("-f", "--file", help="File")
+    parser.add_argument("-f", "--file", nargs="+", help="File, or several files and directories to send as one batch")
     parser.add_argument("-w", "--window", type=int, help="Window", default=3)
     parser.add_argument("-d", "--discard", type=int, help="Discard", default=0)
+    parser.add_argument("-m", "--mode", choices=["gbn", "sr"], help="Mode", default="gbn")
+    parser.add_argument("-C", "--cc", choices=sorted(CONTROLLERS), help="Congestion control", default="none")
+    parser.add_argument("-o", "--output", help="Output file")
+    parser.add_argument("--output-dir", help="Directory for the files of a batch (server only)")
+    parser.add_argument("-n", "--streams", type=int, help="Parallel streams (client only)", default=1)
+    parser.add_argument("--multi", action="store_true", help="Serve many clients concurrently")
+    parser.add_argument("--workers", type=int, help="Worker processes sharing the port (implies --multi)", default=0)
+    parser.add_argument("--log", choices=list(LOG_LEVELS), help="Log level", default="summary")
+    parser.add_argument("--log-file", help="Per-packet event log (JSON lines), - for stdout", default="-")
+    parser.add_argument("--metrics", help="Write transfer metrics as JSON to this file")
+    parser.add_argument("--metrics-interval", type=float, help="Seconds between periodic metric samples", default=0.0)
+    parser.add_argument("--mss", help="Largest payload per packet, or 'auto' to probe the path MTU (client only)")
+    parser.add_argument("--pace", help="Pace packets: 'rtt' spreads the window over the RTT, a number caps the rate in Mbit/s (client only)")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted transfer of the same file (client only)")
+    parser.add_argument("--delta", action="store_true", help="Send only what changed against the server's copy of the file (client only)")
+    parser.add_argument("--compress", action="store_true", help="Compress the data, blocks that do not shrink are sent as they are (client only)")
+    parser.add_argument("--fec", help="Forward error correction: data packets per XOR parity packet, or 'auto' to follow the loss rate (client only)")
+    parser.add_argument("--checkpoint-dir", help="Where checkpoints of resumable transfers are kept (server only)", default=".")
+    parser.add_argument("--ack-every", type=int, help="Go-Back-N: ACK every N in-order packets (server only)", default=ACK_EVERY)
+    parser.add_argument("--ack-delay", type=float, help="Go-Back-N: longest ACK delay in seconds (server only)", default=ACK_DELAY)
 
     args = parser.parse_args()
 
-    if args.port < 1024 or args.port > 65535:
-        raise SystemExit("Invalid port number. Must be between 1024 and 65535")
+    # A server may bind port 0 and report the port the system picked, workers must share a known one
+    if not (args.port == 0 and args.server and not args.workers) and (args.port < 1024 or args.port > 65535):
+        raise SystemExit("Invalid port number. Must be between 1024 and 65535, or 0 for a single server")
+
+    trace.configure(LOG_LEVELS[args.log], args.log_file)
+
+    # Client: payload size to offer (default DATA_LEN), server: largest accepted (default MAX_MSS)
+    probe = args.mss == 'auto'
+    mss = MAX_MSS if probe or (args.mss is None and args.server) else DATA_LEN if args.mss is None else int(args.mss)
+    if not 1 <= mss <= MAX_MSS:
+        raise SystemExit(f"Invalid MSS. Must be between 1 and {MAX_MSS}")
+    pace_rate = None if args.pace in (None, 'rtt') else float(args.pace) * 1e6
+    if pace_rate is not None and pace_rate <= 0:
+        raise SystemExit("Invalid pacing rate. Must be 'rtt' or a positive number of Mbit/s")
+    if args.resume and args.streams > 1:
+        raise SystemExit("--resume works with a single stream only")
+    batch = args.file is not None and (len(args.file) > 1 or os.path.isdir(args.file[0]))
+    if batch and (args.resume or args.streams > 1):
+        raise SystemExit("A batch of files is sent over a single stream and cannot be resumed")
+    if args.delta and (batch or args.resume or args.streams > 1):
+        raise SystemExit("--delta works with a single file over a single stream, without --resume")
+    fec_group = None if args.fec in (None, 'auto') else int(args.fec)
+    if fec_group is not None and not 1 <= fec_group <= 0xFFFF:
+        raise SystemExit("Invalid FEC group. Must be 'auto' or between 1 and 65535 packets")
+    if args.ack_every < 1 or args.ack_delay < 0:
+        raise SystemExit("Invalid ACK policy. --ack-every must be at least 1 and --ack-delay not negative")
 
     if args.client:
         if args.file is None:
             raise SystemExit("Client mode requires --file to be specified")
-        client(args.ip, args.port, args.file, args.window)
+        client(args.ip, args.port, args.file, args.window, args.mode, args.cc, args.streams, args.metrics, args.metrics_interval, mss, probe, args.pace is not None, pace_rate, args.resume, args.compress, args.fec is not None, fec_group, args.delta)
+    elif args.workers > 0:  # One serve() per worker process, all on the same port
+        serve_workers(args.ip, args.port, args.discard, args.output or 'output-{worker}-{n}.jpg', args.workers, args.metrics, mss, args.ack_every, args.ack_delay, args.checkpoint_dir,
+                      args.output_dir or 'received-{worker}-{n}', args.metrics_interval)
+    elif args.multi:  # Long-running server for many clients
+        serve(args.ip, args.port, args.discard, args.output or 'output-{n}.jpg', metrics_path=args.metrics, mss=mss,
+              ack_every=args.ack_every, ack_delay=args.ack_delay, checkpoint_dir=args.checkpoint_dir, outdir=args.output_dir or 'received-{n}',
+              metrics_interval=args.metrics_interval)
     else:  # args.server must be True
-        server(args.ip, args.port, args.discard)
+        server(args.ip, args.port, args.discard, args.output or 'output.jpg', args.metrics, mss, args.ack_every, args.ack_delay, args.checkpoint_dir, args.output_dir or 'received', args.metrics_interval)
     
 if __name__ == "__main__":
     main()
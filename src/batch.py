@@ -0,0 +1,219 @@
+"""
+    Description
+    -----------
+    Batches of files sent over one connection, used when FLAG_BATCH was
+    agreed.
+
+    The data stream is a sequence of entries, one per file: an ENTRY_HEADER
+    (length of the name, size of the file), the file name in UTF-8 and the
+    file bytes. Entries follow each other without gaps, so the packets are
+    filled across file boundaries and a small file costs its entry header
+    rather than a packet, a handshake and a teardown of its own. The stream
+    is split into DATA packets like a single file, and with FLAG_COMPRESS
+    it is compressed like one.
+
+    Names are relative paths with '/' between their parts. The receiver
+    writes every file under its name below its output directory, leaving
+    out parts that could lead outside of it.
+"""
+import os
+from struct import Struct
+from drtp import info
+
+# Entry header: bytes of the name that follows, bytes of the file after the name
+ENTRY_HEADER = Struct('!HQ')
+
+"""
+    Description
+    -----------
+    The files to send as a batch: every file given, and every file below
+    the directories given, in a stable order.
+
+    Parameters
+    ----------
+    paths : Files and directories. A file is named by its base name, a file
+        below a directory by its path from the directory's parent, so that
+        sending 'photos/' reproduces 'photos/...' on the server.
+
+    Returns
+    -------
+    files : List of (path, name) tuples.
+"""
+def list_files(paths):
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append((path, os.path.basename(path)))
+            continue
+        parent = os.path.dirname(os.path.normpath(path))
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                full = os.path.join(root, name)
+                if os.path.isfile(full):
+                    files.append((full, os.path.relpath(full, parent).replace(os.sep, '/')))
+    return files
+
+"""
+    Description
+    -----------
+    Turns a list of files into the entry stream, read sequentially with
+    read(). The Sender reads one packet payload at a time from it, or a
+    compression.Compressor one block at a time. Files are opened one after
+    the other as the stream reaches them.
+
+    Parameters
+    ----------
+    files : List of (path, name) tuples, see list_files().
+
+    Attributes
+    ----------
+    file_bytes : File bytes read so far, without entry headers and names.
+    produced : Entry stream bytes returned by read() so far.
+    sent : Files read completely so far.
+"""
+class BatchReader:
+
+    def __init__(self, files):
+        self.files = iter(files)
+        self.file_bytes = 0
+        self.produced = 0
+        self.sent = 0
+        self.head = b'' # Header and name of the current entry not read yet
+        self.f = None # Current file
+        self.path = None
+        self.remaining = 0 # Bytes of the current file still to read
+
+    # Open the next file and make its entry header, False when there is none
+    def next_entry(self):
+        path, name = next(self.files, (None, None))
+        if path is None:
+            return False
+        self.f = open(path, 'rb')
+        self.path = path
+        self.remaining = os.fstat(self.f.fileno()).st_size # The size the header announces is the size sent
+        encoded = name.encode()
+        self.head = ENTRY_HEADER.pack(len(encoded), self.remaining) + encoded
+        return True
+
+    # Up to n bytes of the entry stream, fewer only at its end
+    def read(self, n: int):
+        pieces, size = [], 0
+        while size < n:
+            if self.head:
+                piece, self.head = self.head[:n - size], self.head[n - size:]
+            elif self.remaining:
+                piece = self.f.read(min(n - size, self.remaining))
+                if not piece:
+                    raise RuntimeError(f'{self.path} shrank while it was sent')
+                self.remaining -= len(piece)
+                self.file_bytes += len(piece)
+            else: # The current file is done
+                if self.f is not None:
+                    self.f.close()
+                    self.f = None
+                    self.sent += 1
+                if not self.next_entry():
+                    break
+                continue
+            pieces.append(piece)
+            size += len(piece)
+        self.produced += size
+        return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+
+    # Close the current file, e.g. when the transfer fails
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+"""
+    Description
+    -----------
+    Turns the entry stream back into files as it arrives in order, in
+    pieces of any size.
+
+    Parameters
+    ----------
+    directory : Where the files go, created if needed. Existing files of
+        the same name are overwritten.
+
+    Attributes
+    ----------
+    file_bytes : File bytes written so far.
+    received : Files written completely so far.
+"""
+class BatchWriter:
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.file_bytes = 0
+        self.received = 0
+        self.head = bytearray() # Entry header and name, possibly split over packets
+        self.name_len = None # Length of the current entry's name once its header is complete
+        self.f = None # Current file, None between entries
+        self.name = None
+        self.remaining = 0 # Bytes of the current file still to come
+
+    # Path below the directory for `name`, without empty, '.' and '..' parts
+    def path_for(self, name: str):
+        parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+        if not parts:
+            parts = [f'file-{self.received + 1}']
+        if parts != name.split('/'):
+            info(f'Batch file {name!r} written as {"/".join(parts)!r}')
+        return os.path.join(self.directory, *parts)
+
+    # Start writing the file of the entry whose header and name are in self.head
+    def open_entry(self):
+        name_len, size = ENTRY_HEADER.unpack_from(self.head)
+        self.name = self.head[ENTRY_HEADER.size:].decode(errors='replace')
+        self.head.clear()
+        self.name_len = None
+        path = self.path_for(self.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.f = open(path, 'wb')
+        self.remaining = size
+
+    # Close the current file once all of its bytes are written
+    def close_entry(self):
+        self.f.close()
+        self.f = None
+        self.received += 1
+
+    def feed(self, data):
+        data = memoryview(data)
+        while len(data):
+            if self.f is None: # Between files: read the next entry header and name
+                if self.name_len is None:
+                    take = ENTRY_HEADER.size - len(self.head)
+                    self.head += data[:take]
+                    data = data[take:]
+                    if len(self.head) < ENTRY_HEADER.size:
+                        return
+                    self.name_len = ENTRY_HEADER.unpack_from(self.head)[0]
+                take = ENTRY_HEADER.size + self.name_len - len(self.head)
+                self.head += data[:take]
+                data = data[take:]
+                if len(self.head) < ENTRY_HEADER.size + self.name_len:
+                    return
+                self.open_entry()
+                if not self.remaining: # An empty file has no bytes to wait for
+                    self.close_entry()
+                continue
+            piece = data[:self.remaining]
+            data = data[len(piece):]
+            self.f.write(piece)
+            self.remaining -= len(piece)
+            self.file_bytes += len(piece)
+            if not self.remaining:
+                self.close_entry()
+
+    # Close the current file, which is incomplete if the stream ends inside it
+    def close(self):
+        if self.f is not None:
+            info(f'Batch ended inside {self.name}, {self.remaining} bytes are missing')
+            self.f.close()
+            self.f = None
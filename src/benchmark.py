@@ -0,0 +1,293 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from queue import Queue, Empty
+from threading import Thread
+from time import monotonic, sleep
+from proxy import ImpairmentProxy, Link
+
+APPLICATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'application.py')
+
+# Seconds to wait for the server to report its port before the run counts as failed
+SERVER_STARTUP = 5.0
+# Start of the line the server prints once it is bound, followed by ip:port
+SERVING = 'Serving on '
+
+# Units accepted in file sizes on the command line
+SIZE_UNITS = {'': 1, 'K': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3}
+
+# Parse a size such as 100K or 2M into bytes
+def parse_size(text: str):
+    text = text.strip().upper()
+    unit = text[-1] if text and text[-1] in SIZE_UNITS else ''
+    return int(float(text[:len(text) - len(unit)]) * SIZE_UNITS[unit])
+
+# Parse a comma separated list with `kind` applied to every item
+def parse_list(kind):
+    return lambda text: [kind(item) for item in text.split(',') if item]
+
+"""
+    Description
+    -----------
+    Wait for a server started with -p 0 to print the port it is serving
+    on. The server binds before it prints the line, so the first SYN sent
+    to that port is not lost. Its output is read to the end by a thread, so
+    that the server never blocks on a full pipe.
+
+    Parameters
+    ----------
+    server : Server process with its stdout piped.
+    timeout : Seconds to wait for the line.
+
+    Returns
+    -------
+    int : The port, None if the server did not report one in time.
+"""
+def wait_serving(server: subprocess.Popen, timeout: float):
+    ports = Queue()
+    def read():
+        for line in server.stdout:
+            if line.startswith(SERVING):
+                ports.put(int(line.rsplit(':', 1)[1]))
+        ports.put(None) # The server exited
+    Thread(target=read, daemon=True).start()
+    try:
+        return ports.get(timeout=timeout)
+    except Empty:
+        return None
+
+# Write `size` random bytes from a seeded generator, the same file for the same seed
+def make_input(path: str, size: int, seed: int):
+    rng = random.Random(seed)
+    with open(path, 'wb') as f:
+        left = size
+        while left:
+            chunk = min(left, 1 << 20)
+            f.write(rng.getrandbits(chunk * 8).to_bytes(chunk, 'little'))
+            left -= chunk
+
+# True when both files have the same contents
+def same_file(a: str, b: str):
+    if not os.path.exists(b) or os.path.getsize(a) != os.path.getsize(b):
+        return False
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        while True:
+            ca, cb = fa.read(1 << 20), fb.read(1 << 20)
+            if ca != cb:
+                return False
+            if not ca:
+                return True
+
+"""
+    Description
+    -----------
+    Runs one transfer through an ImpairmentProxy: starts application.py as a
+    server and as a client on loopback, the client sending to the proxy, and
+    collects the client metrics (see metrics.py) and the proxy counters.
+
+    Parameters
+    ----------
+    workdir : Directory for the output and metrics files.
+    infile : File to send.
+    window : Client window (-w).
+    mode : 'gbn' or 'sr' (-m).
+    cc : Congestion controller (-C).
+    mss : Payload size the client offers (--mss), a number or 'auto'.
+    pace : Client pacing (--pace), 'rtt' or a rate in Mbit/s.
+    link : Link impairments, used for both directions.
+    seed : Seed for the proxy.
+    timeout : Seconds the client may run before the run counts as failed.
+
+    Returns
+    -------
+    result : Dict with ok, seconds, goodput_mbps, rtt_p50_ms, rtt_p99_ms,
+        retransmissions, rto_events and the proxy drops.
+"""
+def run_transfer(workdir: str, infile: str, window: int, mode: str, cc: str, link: Link, seed: int, timeout: float, mss: str=None, pace: str=None):
+    outfile = os.path.join(workdir, 'output.bin')
+    metrics_file = os.path.join(workdir, 'client.json')
+    for path in (outfile, metrics_file):
+        if os.path.exists(path):
+            os.remove(path)
+
+    # The server binds any free port and reports it, -u so that the line is not held in a buffer
+    server = subprocess.Popen([sys.executable, '-u', APPLICATION, '-s', '-i', '127.0.0.1', '-p', '0', '-o', outfile, '--log', 'summary'],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    result = {'ok': False, 'seconds': None, 'goodput_mbps': None, 'rtt_p50_ms': None, 'rtt_p99_ms': None, 'retransmissions': None, 'rto_events': None}
+    try:
+        server_port = wait_serving(server, SERVER_STARTUP)
+        if server_port is None:
+            result['dropped'] = None
+            return result
+        with ImpairmentProxy(('127.0.0.1', server_port), link, seed=seed) as proxy:
+            start = monotonic()
+            try:
+                subprocess.run([sys.executable, APPLICATION, '-c', '-i', '127.0.0.1', '-p', str(proxy.address[1]), '-f', infile,
+                                '-w', str(window), '-m', mode, '-C', cc, '--log', 'off', '--metrics', metrics_file] + (['--mss', mss] if mss else []) + (['--pace', pace] if pace else []),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                pass
+            result['seconds'] = monotonic() - start
+            try:
+                server.wait(5) # The server exits after one transfer, once its output is closed
+            except subprocess.TimeoutExpired:
+                pass
+            stats = proxy.stats()
+    finally:
+        if server.poll() is None:
+            server.kill()
+            server.wait()
+
+    result['dropped'] = stats['dropped'] + stats['reverse_dropped']
+    if os.path.exists(metrics_file):
+        with open(metrics_file) as f:
+            metrics = json.load(f)
+        rtt = metrics['rtt'] or {}
+        result.update(goodput_mbps=metrics['goodput_mbps'], rtt_p50_ms=rtt.get('p50_ms'), rtt_p99_ms=rtt.get('p99_ms'),
+                      retransmissions=metrics['retransmissions'], rto_events=metrics['rto_events'])
+    result['ok'] = same_file(infile, outfile)
+    return result
+
+# Format a table cell, '-' for missing values
+def cell(value, fmt: str='{}'):
+    return '-' if value is None else fmt.format(value)
+
+# Columns of the benchmark table: result key and format
+COLUMNS = [('size', '{}'), ('window', '{}'), ('loss', '{:.3f}'), ('mode', '{}'), ('cc', '{}'), ('ok', '{}'),
+           ('seconds', '{:.2f}'), ('goodput_mbps', '{:.2f}'), ('rtt_p50_ms', '{:.2f}'), ('rtt_p99_ms', '{:.2f}'),
+           ('retransmissions', '{}'), ('rto_events', '{}'), ('dropped', '{}')]
+
+# Print results as a Markdown table
+def print_table(results: list, columns: list=COLUMNS):
+    rows = [[cell(r[name], fmt) for name, fmt in columns] for r in results]
+    widths = [max(len(name), *(len(row[i]) for row in rows)) for i, (name, _) in enumerate(columns)]
+    print('| ' + ' | '.join(name.ljust(w) for (name, _), w in zip(columns, widths)) + ' |')
+    print('|' + '|'.join('-' * (w + 2) for w in widths) + '|')
+    for row in rows:
+        print('| ' + ' | '.join(value.rjust(w) for value, w in zip(row, widths)) + ' |')
+
+# Identifies a matrix point across benchmark runs
+def result_key(r: dict):
+    return (r['size'], r['window'], r['loss'], r['mode'], r['cc'])
+
+"""
+    Description
+    -----------
+    Compare results with a baseline written by an earlier --json run. A point
+    regressed when it no longer transfers the file correctly or its goodput
+    dropped by more than `tolerance` (a fraction) relative to the baseline.
+
+    Returns
+    -------
+    regressions : List of human readable descriptions, empty if none.
+"""
+def compare(results: list, baseline: list, tolerance: float):
+    before = {result_key(r): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = before.get(result_key(r))
+        if old is None:
+            continue
+        name = 'size={} window={} loss={} mode={} cc={}'.format(*result_key(r))
+        if old['ok'] and not r['ok']:
+            regressions.append(f'{name}: transfer failed')
+        elif old['goodput_mbps'] and r['goodput_mbps'] is not None and r['goodput_mbps'] < old['goodput_mbps'] * (1 - tolerance):
+            regressions.append(f'{name}: goodput {r["goodput_mbps"]:.2f} Mbps, was {old["goodput_mbps"]:.2f} Mbps')
+    return regressions
+
+"""
+    Description
+    -----------
+    Benchmark DRTP over loopback through an in-process impairment proxy.
+    Every combination of file size, window, loss rate, mode and congestion
+    controller is transferred `--repeat` times; the run with the median
+    goodput is reported. Results can be saved with --json and later checked
+    against with --baseline, which exits with status 1 on a regression.
+
+    Example
+    -------
+    python3 benchmark.py --sizes 100K,1M --windows 3,15 --loss 0,0.01 --delay 0.005
+
+    With --proxy-only the proxy just relays between --listen and --target
+    until interrupted, to put it in front of a manually started server.
+"""
+def main():
+    parser = argparse.ArgumentParser(description='DRTP benchmark over an impaired loopback link')
+    parser.add_argument('--sizes', type=parse_list(parse_size), help='File sizes, e.g. 100K,1M', default='100K,1M')
+    parser.add_argument('--windows', type=parse_list(int), help='Window sizes (-w)', default='3,15')
+    parser.add_argument('--loss', type=parse_list(float), help='Loss rates (0-1), both directions', default='0,0.01')
+    parser.add_argument('--modes', type=parse_list(str), help='Transfer modes (-m)', default='gbn')
+    parser.add_argument('--cc', type=parse_list(str), help='Congestion controllers (-C)', default='none')
+    parser.add_argument('--delay', type=float, help='One-way delay in seconds', default=0.005)
+    parser.add_argument('--jitter', type=float, help='Delay jitter in seconds', default=0.0)
+    parser.add_argument('--reorder', type=float, help='Probability that a datagram is held back', default=0.0)
+    parser.add_argument('--rate', type=float, help='Link speed in Mbit/s', default=None)
+    parser.add_argument('--queue', type=int, help='Datagrams queued at the link before tail drop', default=None)
+    parser.add_argument('--mss', help="Payload size the client offers, or 'auto'")
+    parser.add_argument('--pace', help="Client pacing, 'rtt' or a rate in Mbit/s")
+    parser.add_argument('--repeat', type=int, help='Runs per matrix point', default=1)
+    parser.add_argument('--seed', type=int, help='Seed for the input files and the proxy', default=1)
+    parser.add_argument('--timeout', type=float, help='Seconds before a transfer counts as failed', default=120)
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--baseline', help='Results of an earlier --json run to compare against')
+    parser.add_argument('--tolerance', type=float, help='Allowed goodput drop against the baseline (fraction)', default=0.15)
+    parser.add_argument('--proxy-only', action='store_true', help='Only run the proxy between --listen and --target')
+    parser.add_argument('--listen', help='ip:port the proxy listens on (--proxy-only)', default='127.0.0.1:8089')
+    parser.add_argument('--target', help='ip:port of the server (--proxy-only)', default='127.0.0.1:8088')
+    args = parser.parse_args()
+
+    rate = args.rate * 1e6 if args.rate else None
+
+    if args.proxy_only:
+        ip, port = args.listen.rsplit(':', 1)
+        tip, tport = args.target.rsplit(':', 1)
+        link = Link(args.delay, args.jitter, args.loss[0], args.reorder, rate=rate, queue=args.queue)
+        with ImpairmentProxy((tip, int(tport)), link, ip=ip, port=int(port), seed=args.seed) as proxy:
+            print(f'Relaying {proxy.address[0]}:{proxy.address[1]} -> {tip}:{tport}, Ctrl-C to stop')
+            try:
+                while True:
+                    sleep(1)
+            except KeyboardInterrupt:
+                print(proxy.stats())
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='drtp-bench-') as workdir:
+        for size, window, loss, mode, cc in itertools.product(args.sizes, args.windows, args.loss, args.modes, args.cc):
+            infile = os.path.join(workdir, f'input-{size}.bin')
+            if not os.path.exists(infile):
+                make_input(infile, size, args.seed)
+            runs = []
+            for i in range(args.repeat):
+                link = Link(args.delay, args.jitter, loss, args.reorder, rate=rate, queue=args.queue)
+                runs.append(run_transfer(workdir, infile, window, mode, cc, link, args.seed + i, args.timeout, args.mss, args.pace))
+            # Report the run with the median goodput, failed runs count as the slowest
+            runs.sort(key=lambda r: (r['ok'], r['goodput_mbps'] or 0))
+            result = dict(size=size, window=window, loss=loss, mode=mode, cc=cc, **runs[len(runs) // 2])
+            if not all(r['ok'] for r in runs):
+                result['ok'] = False
+            results.append(result)
+            print(f'size={size} window={window} loss={loss} mode={mode} cc={cc}: '
+                  f'{"ok" if result["ok"] else "FAILED"}, {cell(result["goodput_mbps"], "{:.2f}")} Mbps', file=sys.stderr)
+
+    print_table(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('Regression:', line)
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
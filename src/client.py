@@ -1,5 +1,37 @@
-from socket import socket, AF_INET, SOCK_DGRAM, timeout as sock_timeout
+import os
+import sys
+from collections import deque
+from contextlib import closing, contextmanager, nullcontext
+from errno import EMSGSIZE
+from mmap import mmap, ACCESS_READ
+from socket import socket, AF_INET, SOCK_DGRAM, IPPROTO_IP, timeout as sock_timeout
+from time import monotonic
+from threading import Thread
 from drtp import *
+from congestion import FixedWindow, Pacer, make_controller
+from metrics import TransferMetrics, write_json
+from resume import file_id, file_digest
+from compression import Compressor
+from fec import FecEncoder
+from batch import BatchReader, list_files
+from delta import Signature, DeltaEncoder
+
+# Link MTUs tried, largest first, when probing the path MTU: loopback, jumbo frames, Ethernet, IPv6 minimum
+PROBE_MTUS = (65535, 9000, 1500, 1280)
+# IPv4 and UDP header bytes in every datagram
+IP_UDP_OVERHEAD = 28
+
+# Linux socket option that sets the Don't Fragment bit, the socket module does not export it
+IP_MTU_DISCOVER = 10
+IP_PMTUDISC_DO = 2
+
+# Longest silence from the server while its block signature is expected (seconds)
+SIGNATURE_TIMEOUT = 10.0
+
+# Payload sizes to probe, largest first, none above `mss`, always ending with the safe DATA_LEN
+def probe_sizes(mss: int):
+    sizes = [mtu - IP_UDP_OVERHEAD - EXT_HEADER_LEN for mtu in PROBE_MTUS]
+    return [size for size in sizes if DATA_LEN < size <= mss] + [min(mss, DATA_LEN)]
 
 """
     Description
@@ -10,64 +42,541 @@ from drtp import *
     and replies with an ACK to establish the connection. If no SYN-ACK is 
     received, it retries up to a specified number of times before failing.
 
+    With FLAG_MSS the SYN offers the largest payload per DATA packet and the
+    SYN-ACK returns the size the server accepts. With probe=True this doubles 
+    as path MTU discovery: every SYN is padded to the size of a full DATA 
+    packet and sent with Don't Fragment set (on Linux), starting at the 
+    loopback MTU and stepping down through PROBE_MTUS. A size the local 
+    interface cannot send is skipped at once, a size the path drops costs
+    one SYN timeout. The size whose SYN got through is the one offered.
+
     Parameters
     ----------
     sock : Bound UDP socket.
     server_addr : (ip, port) tuple of the server.
     rcv_window : Client-advertised receive window (packets).
+    features : Feature flags (FLAG_EXT, FLAG_SR, ...) offered to the server in the SYN.
+    rtt : RTT estimator whose RTO times the SYN retransmissions. The SYN/SYN-ACK
+        exchange gives the first RTT sample when the SYN was not resent.
+    options : Option bytes sent after the SYN header (e.g. RANGE_OPTION).
+        Legacy servers read only the header and ignore them.
     max_retry : Maximum SYN-ACK retransmissions before giving up.
+    mss : Largest payload per DATA packet to offer with FLAG_MSS.
+    probe : Probe the path for the largest payload up to mss.
+    resume_option : Packed RESUME_OPTION to offer with FLAG_RESUME.
 
     Returns
     -------
-    window : Advertised window agreed on.
+    window : Advertised window agreed on. With FLAG_EXT it comes in full
+        from the SYN-ACK's WINDOW_OPTION, otherwise from its 16-bit header field.
+    features : Feature flags both sides agreed on. A legacy server never
+        echoes any, so the transfer falls back to the 8-byte header.
+    mss : Payload bytes per DATA packet, DATA_LEN unless FLAG_MSS was agreed.
+    resume_offset : Byte offset the server asks a resumed transfer to 
+        continue from, 0 unless FLAG_RESUME was agreed.
 """
-def handshake_client(sock: socket, server_addr: tuple, rcv_window: int, max_retry: int=5):
-    print('Connection Establishment Phase:\n')
+def handshake_client(sock: socket, server_addr: tuple, rcv_window: int, features: int=FLAG_EXT, rtt: RttEstimator=None, options: bytes=b'', max_retry: int=5, mss: int=DATA_LEN, probe: bool=False, resume_option: bytes=b''):
+    info('Connection Establishment Phase:\n')
+
+    rtt = rtt or RttEstimator()
+    sizes = probe_sizes(mss) if probe and features & FLAG_MSS else [mss]
+    size = 0 # Index into sizes of the payload size offered
+    pmtu = probe and sys.platform.startswith('linux')
+    if pmtu: # Set Don't Fragment, so an oversized probe is dropped instead of fragmented
+        dont_fragment = sock.getsockopt(IPPROTO_IP, IP_MTU_DISCOVER)
+        sock.setsockopt(IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+
+    try:
+        retries = 0
+        while retries < max_retry: 
+            offer = options + (MSS_OPTION.pack(sizes[size]) if features & FLAG_MSS else b'') + (resume_option if features & FLAG_RESUME else b'')
+            offer += WINDOW_OPTION.pack(rcv_window) if features & FLAG_EXT else b'' # The window in full, past the header's 16 bits
+            syn_pkt = make_packet(0, 0, FLAG_SYN | features, 0, offer) # Makes SYN packet, offering our features
+            if len(sizes) > 1: # Probing: as large as a DATA packet of the offered size
+                syn_pkt = syn_pkt.ljust(EXT_HEADER_LEN + sizes[size], b'\0')
+            try:
+                sock.sendto(syn_pkt, server_addr) # Sends packet
+            except OSError as e:
+                if e.errno != EMSGSIZE or size + 1 == len(sizes):
+                    raise
+                size += 1 # Larger than the local interface allows, try the next size
+                continue
+            sent_at = monotonic()
+            info(f'SYN packet is sent' + (f' ({len(syn_pkt)} bytes)' if len(sizes) > 1 else ''))
+
+            sock.settimeout(rtt.rto)
+            try:
+                data, _ = sock.recvfrom(HEADER_LEN + MSS_OPTION.size + RESUME_OPTION.size + WINDOW_OPTION.size) # receives header and options. Blocks timeout
+            except sock_timeout:                      # Socket_timeout error 
+                retries += 1
+                rtt.backoff()
+                info('Timeout: retransmit SYN')
+                if size + 1 < len(sizes): # Maybe the path dropped a probe too large for it
+                    size += 1
+                continue                              # Go back and resend
+
+            if len(data) < HEADER_LEN: # Checks header lenght
+                info('HEADER has incorrect lenght, skipping')
+                continue # Go back and resend
+
+            _, s_ack, s_flags, s_window = parse_header(data[:HEADER_LEN]) # Parsing header
+            
+            wanted_flags = FLAG_SYN | FLAG_ACK 
+            if (s_flags & wanted_flags) == wanted_flags and s_ack == 0: # Checking if header has SYN-ACK (used AI for this IF-test)
+                    info(f'SYN-ACK packet is received')
+                    if retries == 0: # Karn's rule: a resent SYN gives an ambiguous sample
+                        rtt.sample(monotonic() - sent_at)
+                    window = min(rcv_window, s_window) # Selecting the adveristed window
+                    agreed = s_flags & features # Features the server echoed back
+                    agreed_mss, resume_offset = DATA_LEN, 0
+                    offered = read_option(data, s_flags, FLAG_MSS, SYNACK_OPTIONS) # Options are located by the flags the server sent
+                    if agreed & FLAG_MSS and offered:
+                        agreed_mss, = offered
+                        info(f'Payload size agreed: {agreed_mss} bytes')
+                    resume = read_option(data, s_flags, FLAG_RESUME, SYNACK_OPTIONS)
+                    if agreed & FLAG_RESUME:
+                        if not resume or resume[0] != RESUME_OPTION.unpack(resume_option)[0]:
+                            raise RuntimeError('Server did not confirm which file to resume')
+                        resume_offset = resume[1]
+                    agreed_window = read_option(data, s_flags, FLAG_EXT, SYNACK_OPTIONS)
+                    if agreed & FLAG_EXT and agreed_window: # The server sent the window in full
+                        window = min(rcv_window, agreed_window[0])
+                    ack_pkt = make_packet(0, 0, FLAG_ACK, min(window, max_window(0))) # Making ACK packet
+                    sock.sendto(ack_pkt, server_addr) # Sending ACK packet
+                    info(f'ACK packet is sent') # This packet can be lost, but the server as a timeout set for this. 
+                    info('Connection established')
+
+                    return window, agreed, agreed_mss, resume_offset
+            else:
+                info('HEADER unexpected packet during handshake, ignoring…') 
+    finally:
+        if pmtu: # Large DATA packets may be fragmented again if the path changes
+            sock.setsockopt(IPPROTO_IP, IP_MTU_DISCOVER, dont_fragment)
+    # Raises an RuntimeError if we retry more than max_retry 
+    raise RuntimeError('Three-way handshake failed')
 
-    syn_pkt = make_packet(0, 0, FLAG_SYN, 0) # Makes SYN packet 
+"""
+    Description
+    -----------
+    The sending side of the data phase as a state machine without its own
+    I/O loop or clock, like the server's Session: the caller passes every 
+    datagram that arrives to handle(), calls poll() once next_deadline() has 
+    passed, and tells both the current time. Packets go out with 
+    sock.sendto, so anything with that method can stand in for the socket,
+    e.g. the simulated network in simulator.py.
+
+    Go-Back-N keeps one timer, restarted by every ACK that moves base, and
+    resends the whole window when it expires. DUP_ACK_THRESHOLD duplicate 
+    ACKs resend base alone, since the receiver keeps the packets behind a gap, and further 
+    duplicate ACKs for it are not counted. The window is reduced once per
+    recovery, which lasts until everything sent before it is ACKed, however
+    many gaps it had: an ACK for the resent packet that leaves base short of
+    that (a partial ACK) resends the next gap at once. A packet that was 
+    only late thus costs one resend instead of a window of them.
+    Selective Repeat keeps a timer per packet and resends only the packets 
+    whose timer expired, or the oldest one once DUP_ACK_THRESHOLD later 
+    packets have been ACKed past it.
+
+    With a Pacer, new packets and resends alike leave no faster than its
+    token bucket allows: resends wait in a queue, and next_deadline() 
+    includes the time the next packet may go out.
+
+    With an FecEncoder, every group of new packets is followed by its parity
+    packet (see fec.py), paced like the others. Parity is sent once and
+    never resent.
 
-    retries = 0
-    while retries < max_retry: 
-        sock.sendto(syn_pkt, server_addr) # Sends packet
-        print(f'SYN packet is sent')
+    Parameters
+    ----------
+    sock : Socket (or stand-in) the packets are sent through.
+    server_addr : (ip, port) tuple of the server.
+    start_seq : Sequence number to assign to the first DATA packet.
+    rcv_window : Peer-advertised receive window.
+    view : Bytes to send, anything that supports len() and slicing, or a
+        stream with read(n) such as compression.Compressor or
+        batch.BatchReader, whose number of
+        packets is only known once read() comes back empty.
+    features, rtt, cc, metrics, mss, pacer, fec : See send_data.
 
-        try:
-            data, _ = sock.recvfrom(HEADER_LEN)   # receives header. Blocks timeout
-        except sock_timeout:                      # Socket_timeout error 
-            retries += 1
-            print('Timeout: retransmit SYN')
-            continue                              # Go back and resend
+    Attributes
+    ----------
+    done : True once every packet has been ACKed.
+    final_seq : First sequence number after the last DATA packet, None while
+        a stream has not ended yet.
+"""
+class Sender:
+
+    def __init__(self, sock: socket, server_addr: tuple, start_seq: int, rcv_window: int, view, features: int=0, rtt: RttEstimator=None, cc: FixedWindow=None, metrics: TransferMetrics=None, mss: int=DATA_LEN, pacer: Pacer=None, fec: FecEncoder=None):
+        self.sock = sock
+        self.server_addr = server_addr
+        self.start_seq = start_seq
+        self.rcv_window = rcv_window
+        self.view = view
+        self.rtt = rtt or RttEstimator()
+        self.cc = cc or FixedWindow(rcv_window)
+        self.metrics = metrics or TransferMetrics('client', server_addr)
+        self.pacer = pacer
+        self.fec = fec
+
+        self.mss = mss # Payload bytes per packet
+        self.stream = hasattr(view, 'read') # Read sequentially instead of sliced at seq * mss
+        self.final_seq = None if self.stream else start_seq + -(-len(view) // mss) # Number of packets, rounded up
+        self.header = header_for(features) # 8 or 14 byte header
+        self.space = seq_space(features) # Sequence numbers wrap around at this value
+        self.adv_window = min(rcv_window, max_window(features))
+        self.selective = features & FLAG_SR # Selective Repeat instead of Go-Back-N
+
+        # One reusable packet buffer per window slot. seq % rcv_window is unique
+        # for every packet in flight, so a slot is only reused once its packet is ACKed.
+        self.slots = [bytearray(self.header.size + mss) for _ in range(rcv_window)]
+
+        self.base = start_seq # seq of the earliest un-ACKed packet
+        self.next_pkt = start_seq # seq to be assigned to the next DATA packet
+        self.outstanding = {}
+        self.timer = None # Go-Back-N: time the retransmission timer expires
+        self.deadlines = {} # Selective Repeat: seq -> time its retransmission timer expires
+        self.backoff_until = 0.0 # Selective Repeat: expiries before this time share the last backoff
+        self.sent_at = {} # seq -> time of its only transmission, dropped once it is resent (Karn's rule)
+        self.dup_acks = 0 # ACKs received since base last moved that did not move it
+        self.recover = None # Go-Back-N: last packet sent when loss recovery began, None outside of it
+        self.resent_to = start_seq - 1 # Go-Back-N: last base resent, its duplicate ACKs are no longer counted
+        self.resent_at = 0.0 # Go-Back-N: when it was resent
+        self.resends = deque() # seqs waiting to be resent, in order
+        self.pace_at = None # Pacing: when the pacer lets the next packet out
+        self.parity_buf = bytearray(self.header.size + mss) if fec else None
+        self.parity = None # FEC: parity packet of the last group, waiting for the pacer
+
+    @property
+    def done(self):
+        return self.final_seq is not None and self.base >= self.final_seq
+
+    # Send the first window
+    def start(self, now: float):
+        self.metrics.data_started(now)
+        self.fill(now)
+
+    # Time the next retransmission timer expires or the pacer lets the next packet out, None if there is nothing to do
+    def next_deadline(self):
+        if self.selective:
+            deadline = min(self.deadlines.values()) if self.deadlines else None
+        else:
+            deadline = self.timer
+        if self.pace_at is not None:
+            return self.pace_at if deadline is None else min(deadline, self.pace_at)
+        return deadline
+
+    # (Re)send one packet and count it
+    def transmit(self, seq: int, pkt, resend: bool=False):
+        self.sock.sendto(pkt, self.server_addr)
+        m = self.metrics
+        m.wire_bytes += len(pkt)
+        if resend:
+            m.retransmissions += 1
+            self.sent_at.pop(seq, None)
+        else:
+            m.packets_sent += 1
+        if trace.enabled:
+            trace.event('resend' if resend else 'send', seq, len(self.outstanding)) # Packets in flight
+
+    # Send the pending parity packet unless the pacer holds it back, False if it still waits
+    def send_parity(self, now: float, rate: float=None):
+        pkt = self.parity
+        if pkt is None:
+            return True
+        if self.pacer:
+            wait = self.pacer.delay(len(pkt), now, rate)
+            if wait:
+                self.pace_at = now + wait
+                return False
+        self.sock.sendto(pkt, self.server_addr)
+        self.metrics.wire_bytes += len(pkt)
+        self.metrics.fec_packets += 1
+        self.parity = None
+        return True
+
+    # Close the current FEC group and send its parity packet, False if the pacer holds it back
+    def close_group(self, now: float, rate: float=None):
+        start, count, lengths, payload = self.fec.close()
+        pkt_len = pack_packet_into(self.parity_buf, start % self.space, count, FLAG_FEC, lengths, payload, self.header)
+        self.parity = memoryview(self.parity_buf)[:pkt_len]
+        return self.send_parity(now, rate)
+
+    # Queue packets for resending, fill() sends them before any new packet
+    def resend(self, seqs):
+        queued = set(self.resends) # Only pacing keeps resends waiting, skip those already queued
+        self.resends.extend(seq for seq in seqs if seq not in queued)
+
+    #  Send the queued resends, then fill the sliding window while space remains, the congestion window may be smaller
+    def fill(self, now: float):
+        view, header, rcv_window, mss = self.view, self.header, self.rcv_window, self.mss
+        window = min(self.cc.window, rcv_window)
+        pacer, fec = self.pacer, self.fec
+        rate = None
+        if pacer:
+            rate = pacer.current_rate(self.cc, self.rtt.srtt, window, header.size + mss)
+            self.pace_at = None
+        if not self.send_parity(now, rate): # Parity the pacer held back goes first
+            return
+        outstanding, resends = self.outstanding, self.resends
+        while resends:
+            seq = resends[0]
+            pkt = outstanding.get(seq) # Gone if it was ACKed while it waited
+            if pkt is not None:
+                if pacer:
+                    wait = pacer.delay(len(pkt), now, rate)
+                    if wait:
+                        self.pace_at = now + wait
+                        return
+                self.transmit(seq, pkt, resend=True)
+            resends.popleft()
+        limit = self.base + window if self.final_seq is None else min(self.base + window, self.final_seq)
+        while self.next_pkt < limit:
+            seq = self.next_pkt
+            pos = (seq - self.start_seq) * mss
+            if pacer:
+                wait = pacer.delay(header.size + (mss if self.stream else min(mss, len(view) - pos)), now, rate)
+                if wait:
+                    self.pace_at = now + wait
+                    return
+            if self.stream:
+                payload = view.read(mss)
+                if not len(payload): # The stream has ended, the previous packet was the last one
+                    self.final_seq = seq
+                    if fec and fec.count: # Parity of the last, short group
+                        self.close_group(now, rate)
+                    return
+            else:
+                payload = view[pos:pos + mss]
+            group = 0
+            if fec:
+                if not fec.count: # This packet opens a group, sized for the losses so far
+                    m = self.metrics
+                    fec.begin(seq, m.packets_sent, m.fast_retransmits + m.rto_events, window)
+                group = fec.start % self.space # Every packet names the first one of its group
+            buf = self.slots[seq % rcv_window]
+            pkt_len = pack_packet_into(buf, seq % self.space, group, 0, self.adv_window, payload, header) # Make packet
+            pkt = memoryview(buf)[:pkt_len]
+            self.outstanding[seq] = pkt # Adding pakcet dict for packets 
+            self.transmit(seq, pkt)
+            self.sent_at[seq] = now
+            if self.selective:
+                self.deadlines[seq] = now + self.rtt.rto # Start this packet's own timer
+            elif self.timer is None:
+                self.timer = now + self.rtt.rto
+            self.next_pkt += 1
+            if fec and (fec.add(payload) or self.next_pkt == self.final_seq): # Group full, or the last packet
+                if not self.close_group(now, rate):
+                    return
+
+    # Handle expired retransmission timers
+    def poll(self, now: float):
+        rtt, cc, m = self.rtt, self.cc, self.metrics
+        if self.selective:
+            # Retransmit only the packets whose own timer has expired
+            expired = [pkt_id for pkt_id, deadline in self.deadlines.items() if deadline <= now]
+            # Once per RTO, not once per packet: paced packets expire one after the other
+            if expired and now >= self.backoff_until:
+                rtt.backoff()
+                cc.on_timeout()
+                m.rto_events += 1
+                self.backoff_until = now + rtt.rto
+                log(f'RTO for {len(expired)} packet(s) from seq={expired[0]}, {rtt}, {cc}')
+            self.resend(expired)
+            for pkt_id in expired:
+                self.deadlines[pkt_id] = now + rtt.rto # Restart its timer
+        elif self.timer is not None and self.timer <= now: # Go-Back-N
+            rtt.backoff()
+            cc.on_timeout()
+            m.rto_events += 1
+            log(f'RTO occured, {rtt}, {cc}')
+            self.resend(self.outstanding) # Resend all packets that we have in our sliding window.  
+            self.recover = self.next_pkt - 1 # Everything is resent, later gaps mean it was lost again
+            self.resent_to = self.base
+            self.resent_at = now
+            self.timer = now + rtt.rto
+        self.fill(now)
+        if m.interval:
+            m.tick(now, len(self.outstanding), cc.cwnd)
+
+    # Process one datagram from the server
+    def handle(self, data, now: float):
+        header = self.header
+        if len(data) != header.size: # Ignore stray packets with the wrong header
+            return
 
-        if len(data) != HEADER_LEN: # Checks header lenght
-            print('HEADER has incorrect lenght, skipping')
-            continue # Go back and resend
+        raw_seq, raw_ack, flags, _ = header.unpack(data) # Parse header
+        if not (flags & FLAG_ACK): 
+            return
+        if self.fec: # The seq field of an ACK counts the packets the receiver rebuilt
+            self.fec.repaired = raw_seq
+
+        rtt, cc, m = self.rtt, self.cc, self.metrics
+        outstanding, sent_at = self.outstanding, self.sent_at
+        base = self.base
+        m.acks_received += 1
+        ack = unwrap_seq(raw_ack, base, self.space) # Absolute packet number
+        if ack == base - 1 and not self.selective: # Duplicate ACK, the receiver is still missing base
+            m.dup_acks += 1
+            if base <= self.resent_to or base not in outstanding: # base was resent already, or nothing is missing
+                return
+            self.dup_acks += 1
+            if self.dup_acks == DUP_ACK_THRESHOLD: # Fast retransmit of base alone, the receiver kept what follows it
+                if self.recover is None: # One window reduction per recovery, later gaps of it were lost together
+                    cc.on_loss()
+                    self.recover = self.next_pkt - 1
+                m.fast_retransmits += 1
+                log(f'{self.dup_acks} duplicate ACKs for packet = {ack}, fast retransmit, {cc}')
+                self.resent_to = base
+                self.resent_at = now
+                self.resend((base,))
+                self.fill(now)
+            return
+        if ack not in outstanding: # Stale ACK
+            m.dup_acks += 1
+            return
 
-        _, s_ack, s_flags, s_window = parse_header(data) # Parsing header
-        
-        wanted_flags = FLAG_SYN | FLAG_ACK 
-        if (s_flags & wanted_flags) == wanted_flags and s_ack == 0: # Checking if header has SYN-ACK (used AI for this IF-test)
-                print(f'SYN-ACK packet is received')
-                window = min(rcv_window, s_window) # Selecting the adveristed window
-                ack_pkt = make_packet(0, 0, FLAG_ACK, window) # Making ACK packet
-                sock.sendto(ack_pkt, server_addr) # Sending ACK packet
-                print(f'ACK packet is sent') # This packet can be lost, but the server as a timeout set for this. 
-                print('Connection established')
-
-                return window                 
-        else:
-            print('HEADER unexpected packet during handshake, ignoring…') 
-    # Raises an RuntimeError if we retry more than max_retry 
-    raise RuntimeError('Three-way handshake failed')
+        sample = None
+        if ack in sent_at:
+            sample = now - sent_at[ack]
+            rtt.sample(sample)
+            m.add_rtt(sample)
+
+        if self.selective: # Selective Repeat: ACK covers only this packet
+            m.payload_bytes += len(outstanding.pop(ack)) - header.size
+            del self.deadlines[ack]
+            sent_at.pop(ack, None)
+            cc.on_ack(1, sample)
+            if ack > base: # A later packet got through while base is still missing
+                self.dup_acks += 1
+                if self.dup_acks == DUP_ACK_THRESHOLD: # Fast retransmit of base alone
+                    cc.on_loss()
+                    m.fast_retransmits += 1
+                    self.resend((base,))
+                    self.deadlines[base] = now + rtt.rto
+                    log(f'{self.dup_acks} ACKs past packet = {base}, fast retransmit, {cc}')
+            while base < self.next_pkt and base not in outstanding: # Slide past every ACKed packet
+                base += 1
+                self.dup_acks = 0
+        else: # Go-Back-N: cumulative ACK
+            cc.on_ack(ack - base + 1, sample)
+            while base <= ack:
+                m.payload_bytes += len(outstanding.pop(base)) - header.size # Removing packet from tracking 
+                sent_at.pop(base, None)
+                base +=1
+            self.dup_acks = 0
+            # Restart the timer only when base moves (RFC 6298 5.3), duplicate and stale ACKs leave it running
+            self.timer = now + rtt.rto if outstanding else None
+            if self.recover is not None:
+                if ack >= self.recover: # Everything sent before the loss is in
+                    self.recover = None
+                elif base > self.resent_to and (rtt.srtt is None or now - self.resent_at >= rtt.srtt / 2):
+                    # Partial ACK for the resent packet: base is the next gap. Sooner than that the
+                    # ACK came from the late original instead, and the gap may be packets in flight
+                    self.resent_to = base
+                    self.resent_at = now
+                    self.resend((base,))
+        self.base = base
+        if trace.enabled:
+            trace.event('ack', ack, cc.cwnd)
+        self.fill(now)
+        if m.interval:
+            m.tick(now, len(outstanding), cc.cwnd)
 
 """
     Description
     -----------
-    Send data to server using Go-Back-N over UDP.
+    Receive the block signature of the server's copy of the file when
+    FLAG_DELTA was agreed (see server.send_signature). The server sends it
+    right after the handshake as plain DATA packets closed by a FIN, which
+    a Receiver collects and acknowledges like the server does a file. A 
+    resent SYN-ACK means the handshake ACK was lost, so it is sent again.
+
+    Parameters
+    ----------
+    sock : Bound UDP socket.
+    server_addr : (ip, port) tuple of the server.
+    rcv_window : Window agreed on in the handshake.
+    features : Feature flags agreed on, only FLAG_EXT and FLAG_SR apply.
+    mss : Payload bytes per DATA packet agreed in the handshake.
+
+    Returns
+    -------
+    signature : The parsed delta.Signature.
+
+    Raises
+    ------
+    RuntimeError
+        If the server falls silent for SIGNATURE_TIMEOUT seconds or the
+        signature is malformed.
+"""
+def receive_signature(sock: socket, server_addr: tuple, rcv_window: int, features: int, mss: int=DATA_LEN):
+    from server import Receiver # server.py imports this module for the Sender
+    data = bytearray()
+    rx = Receiver(sock, server_addr, 1, rcv_window, features=features & (FLAG_EXT | FLAG_SR), metrics=TransferMetrics('client', server_addr), mss=mss, sink=data.extend)
+    buf = bytearray(rx.bufsize)
+    view = memoryview(buf)
+    ack_pkt = make_packet(0, 0, FLAG_ACK, rcv_window)
+    while True:
+        deadline = rx.next_deadline()
+        sock.settimeout(SIGNATURE_TIMEOUT if deadline is None else max(0, deadline - monotonic()))
+        try:
+            n, addr = sock.recvfrom_into(buf)
+        except sock_timeout:
+            if deadline is None:
+                raise RuntimeError('Server sent no block signature')
+            rx.poll(monotonic()) # Delayed ACK
+            continue
+        if addr != server_addr:
+            continue
+        if n < rx.header.size: # Shorter than DATA: a SYN-ACK resent because our ACK was lost
+            if n >= HEADER_LEN and parse_header(buf[:HEADER_LEN])[2] & FLAG_SYN:
+                sock.sendto(ack_pkt, server_addr)
+            continue
+        if rx.on_packet(view[:n]):
+            break
+    signature = Signature(data)
+    info(f'Block signature received: {len(signature)} blocks of {signature.block} bytes')
+    return signature
+
+# The bytes of filename from offset on, `length` of them or the rest of the file, memory-mapped
+@contextmanager
+def file_view(filename: str, offset: int=0, length: int=None):
+    # Opens outfile with 'with open' to ensure that the file descriptor closes
+    with open(filename, 'rb') as f: 
+        file_size = os.fstat(f.fileno()).st_size
+        end = file_size if length is None else min(offset + length, file_size)
+        # mmap refuses empty files, so an empty file is sent as zero packets
+        with (mmap(f.fileno(), 0, access=ACCESS_READ) if file_size else nullcontext(b'')) as mm, \
+                memoryview(mm) as whole, whole[offset:end] as view:
+            yield view
+
+"""
+    Description
+    -----------
+    Send data to server using Go-Back-N or Selective Repeat over UDP.
 
     At most rcv_window packets can be unacknowledged (in-flight) at a time.  
-    If a timeout occurs before acknowledgments are received, all unacknowledged 
-    packets in the current window are retransmitted. The function returns the 
-    first unused sequence number after the entire file has been acknowledged.
+    With Go-Back-N, if a timeout occurs before acknowledgments are received, all 
+    unacknowledged packets in the current window are retransmitted. Its one
+    timer restarts only when an ACK moves base, so duplicate ACKs cannot keep
+    it from expiring. With 
+    Selective Repeat (FLAG_SR agreed in the handshake) every packet has its own
+    timer, ACKs are per packet, and only the packets whose timer expires are 
+    retransmitted. 
+
+    Losses are also detected without waiting for a timer (fast retransmit): 
+    DUP_ACK_THRESHOLD duplicate ACKs for the packet before base (Go-Back-N), or
+    as many ACKs for later packets while base is missing (Selective Repeat), 
+    resend base alone right away. The Go-Back-N receiver keeps the packets 
+    behind a gap, so further duplicate ACKs for base are not counted, and the
+    window is reduced once per recovery, which lasts until everything sent 
+    before it is ACKed: an ACK for the resent packet that leaves base short 
+    of that (a partial ACK) resends the next gap at once. The function 
+    returns the first unused sequence number after the entire file has been
+    acknowledged.
+
+    The file is memory-mapped and streamed: only the packets currently in the
+    window are materialised, each in its own preallocated buffer, so memory use 
+    and time to the first packet do not depend on the file size.
 
     Parameters
     ----------
@@ -75,66 +584,92 @@ def handshake_client(sock: socket, server_addr: tuple, rcv_window: int, max_retr
     server_addr : (ip, port)  tuple of the server.
     start_seq : Sequence number to assign to the first DATA packet.
     rcv_window : Peer-advertised receive window.
-    filename : Path to the file whose contents will be transmitted.
+    filename : Path to the file whose contents will be transmitted, or with
+        FLAG_BATCH the list of (path, name) tuples of the batch's files.
+    features : Feature flags agreed on in the handshake. Without FLAG_EXT 
+        sequence numbers wrap around at 16 bits on the wire, with FLAG_SR 
+        Selective Repeat is used instead of Go-Back-N.
+    rtt : RTT estimator driving the retransmission timer. Every ACK for a packet
+        that was sent only once is an RTT sample (Karn's rule), and every 
+        timeout backs the RTO off.
+    cc : Congestion controller (see congestion.py). At most 
+        min(cc.window, rcv_window) packets are in flight. Defaults to a fixed
+        window of rcv_window packets.
+    offset : Byte offset in the file where the data to send starts.
+    length : Number of bytes to send from offset, None for the rest of the file.
+    metrics : TransferMetrics that counts packets, retransmissions, ACKs and
+        RTT samples of this transfer.
+    mss : Payload bytes per DATA packet agreed in the handshake.
+    pacer : Optional Pacer (see congestion.py) that spreads the packets, 
+        resends included, evenly over time instead of sending them in bursts.
+    fec : Optional FecEncoder (see fec.py) when FLAG_FEC was agreed: parity
+        packets let the server rebuild a lost packet without a resend.
+    signature : Signature of the server's copy when FLAG_DELTA was agreed,
+        see receive_signature().
+        
+    With FLAG_COMPRESS in features the bytes are compressed block by block 
+    as the window asks for them (see compression.py), blocks that do not 
+    compress are sent as they are.
+
+    With FLAG_BATCH the files are read one after the other into a single
+    stream of entries (see batch.py), so packets run on across files.
+
+    With FLAG_DELTA the file is sent as instructions to copy the blocks the
+    server already has and the bytes it does not (see delta.py), compressed
+    in turn with FLAG_COMPRESS.
     
     Returns
     -------
     final_seq_no : last byte sent and acknowledged.
 """
-def send_data(sock: socket , server_addr: tuple, start_seq: int, rcv_window: int, filename: str):
+def send_data(sock: socket , server_addr: tuple, start_seq: int, rcv_window: int, filename: str, features: int=0, rtt: RttEstimator=None, cc: FixedWindow=None, offset: int=0, length: int=None, metrics: TransferMetrics=None, mss: int=DATA_LEN, pacer: Pacer=None, fec: FecEncoder=None, signature: Signature=None):
     
-    print('\nData Transfer:\n')
-    payloads = []
-
-    # Opens outfile with 'with open' to ensure that the file descriptor closes
-    with open(filename, 'rb') as f: 
-        while True:
-            chunk = f.read(DATA_LEN) # Breaks the file into correct length
-            if not chunk:
-                break
-            payloads.append(chunk) # Adds them to payloads for use later
-
-    base = start_seq # seq of the earliest un-ACKed packet
-    next_pkt = start_seq # seq to be assigned to the next DATA packet
-    outstanding = {}
-
-    # Helper output to terminal
-    def window_output(): 
-        return "{" + ", ".join(map(str, sorted(outstanding))) + "}"
-    
-    # Main loop until every packet is ACKed
-    while base - start_seq < len(payloads):
-
-        #  Fill the sliding window while space remains 
-        while next_pkt < base + rcv_window and next_pkt - start_seq < len(payloads):
-            pkt_bytes = make_packet(next_pkt, 0, 0, rcv_window, payloads[next_pkt-start_seq]) # Make packet
-            sock.sendto(pkt_bytes, server_addr) # Send packet
-            outstanding[next_pkt] = pkt_bytes # Adding pakcet dict for packets 
-            log(f"packet with seq = {next_pkt} is sent, sliding window = {window_output()}")
-            next_pkt += 1
-
-        try: #  Wait for an ACK 
-            header, _ = sock.recvfrom(HEADER_LEN)
-        except sock_timeout: # The timer has expired. Go-Back-N
-            log('RTO occured')
-            for pkt_id, pkt in outstanding.items(): 
-                sock.sendto(pkt, server_addr) # Resend all packets that we have in our sliding window.  
-                log(f'retransmitting packet with seq={pkt_id} is resent, sliding window = {window_output()}')
-            continue
-
-        _, ack, flags, _ = parse_header(header) # Parse header
-        if not (flags & FLAG_ACK): 
-            continue
-
-        if ack in outstanding: 
-            log(f'ACK for packet = {ack} is recieved')
-            while base <= ack:
-                outstanding.pop(base, None) # Removing packet from tracking 
-                base +=1
-    print("DATA Finished\n\n")
+    info('\nData Transfer:\n')
+
+    rtt = rtt or RttEstimator()
+    cc = cc or FixedWindow(rcv_window)
+    m = metrics or TransferMetrics('client', server_addr)
+
+    # A batch is read file by file, a single file is memory-mapped
+    with (closing(BatchReader(filename)) if features & FLAG_BATCH else file_view(filename, offset, length)) as view, \
+            (closing(DeltaEncoder(view, signature)) if signature else nullcontext(view)) as delta:
+        # With compression the Sender reads the frames of a Compressor, closed also when the transfer fails
+        with (closing(Compressor(delta)) if features & FLAG_COMPRESS else nullcontext(delta)) as source:
+            sender = Sender(sock, server_addr, start_seq, rcv_window, source, features, rtt, cc, m, mss, pacer, fec)
+            sender.start(monotonic())
+            ack_len = sender.header.size
+
+            # Main loop until every packet is ACKed
+            while not sender.done:
+                timeout = sender.next_deadline() - monotonic()
+                if timeout <= 0: # A timer is already due
+                    sender.poll(monotonic())
+                    continue
+                sock.settimeout(timeout) # Sleep until the next timer expires
+                try: #  Wait for an ACK 
+                    data, _ = sock.recvfrom(ack_len)
+                except sock_timeout: # The timer has expired.
+                    sender.poll(monotonic())
+                    continue
+                sender.handle(data, monotonic())
+            final_seq_no = sender.final_seq # first unused seq number
+            if features & FLAG_COMPRESS: # The ACKed payloads were compressed, count file bytes
+                m.compressed_bytes, m.payload_bytes = m.payload_bytes, source.consumed
+            if signature: # The ACKed payloads were instructions, count file bytes
+                m.delta_bytes, m.payload_bytes = m.payload_bytes, delta.consumed
+                info(f'{delta.copied} of {delta.consumed} bytes copied from the server\'s copy, {delta.literal} sent')
+            if features & FLAG_BATCH: # Without the entry headers and names
+                m.payload_bytes = view.file_bytes
+                info(f'{view.sent} files sent')
+    m.data_finished()
+    info("DATA Finished\n\n")
+    info(f'RTT estimate: {rtt}, congestion control: {cc.name}, {cc}' + (f', paced at {pacer}' if pacer else ''))
+    info(f'Goodput {m.goodput_mbps:.2f} Mbps, {m.retransmissions} retransmissions, {m.rto_events} RTOs, {m.fast_retransmits} fast retransmits')
+    if fec:
+        info(f'FEC {fec}: {m.fec_packets} parity packets, {fec.repaired} packets rebuilt by the server')
+    if m.compressed_bytes:
+        info(f'Compressed to {m.compressed_bytes / max(m.payload_bytes, 1):.1%} of {m.payload_bytes} bytes')
 
-    total_pkts   = next_pkt - start_seq          # how many DATA packets
-    final_seq_no = start_seq + total_pkts        # first unused seq number
     return final_seq_no  
 
 """
@@ -152,58 +687,193 @@ def send_data(sock: socket , server_addr: tuple, start_seq: int, rcv_window: int
     sock : Bound UDP socket.
     server_addr : (ip, port) tuple of the server.
     seq : Sequence number to place in the FIN segment.
+    features : Feature flags agreed on in the handshake.
+    rtt : RTT estimator whose RTO times the FIN retransmissions.
     max_retry : Maximum number of FIN retransmissions before aborting.
+    digest : SHA-256 digest of the whole file, sent in the FIN when FLAG_RESUME
+        was agreed so that the server can verify what it wrote.
 
     Raises
     ------
     RuntimeError
-        If no valid FIN-ACK is received within max_retry attempts.
+        If no valid FIN-ACK is received within max_retry attempts, or the
+        server answers with FLAG_RST because the digest did not match.
     
 """
-def teardown_client(sock: socket, server_addr: tuple, seq: int, max_retry: int=5):
+def teardown_client(sock: socket, server_addr: tuple, seq: int, features: int=0, rtt: RttEstimator=None, max_retry: int=5, digest: bytes=b''):
 
-    print('\nConnection Teardown:\n')
+    info('\nConnection Teardown:\n')
 
-    fin_pkt = make_packet(seq, 0, FLAG_FIN, 0) # Client initiated FIN
+    rtt = rtt or RttEstimator()
+
+    header = header_for(features)
+    seq %= seq_space(features) # Sequence number as it appears on the wire
+    fin_pkt = header.pack(seq, 0, FLAG_FIN, 0) + digest # Client initiated FIN
     retries = 0
 
     while retries < max_retry:
         sock.sendto(fin_pkt, server_addr)
-        print(f'FIN packet packet is sent {seq}')
+        info(f'FIN packet packet is sent {seq}')
+        sock.settimeout(rtt.rto)
         try:
-            header, _ = sock.recvfrom(HEADER_LEN) # Waiting on FIN-ACK
+            data, _ = sock.recvfrom(header.size) # Waiting on FIN-ACK
         except sock_timeout: # Timeout - the timer has expired. 
             retries += 1
-            print('Timeout - resend FIN') # Resends FIN packet
+            rtt.backoff()
+            info('Timeout - resend FIN') # Resends FIN packet
             continue
         
-        s_seq, s_ack, s_flags, _ = parse_header(header)
+        if len(data) != header.size: # Ignore stray packets with the wrong header
+            continue
+
+        s_seq, s_ack, s_flags, _ = header.unpack(data)
         wanted = FLAG_ACK | FLAG_FIN  # Expect FIN-ACK
 
         # Accept only a FIN-ACK whose ack matches our FIN’s seq
         if(s_flags & wanted) == wanted and s_ack == seq: # (used AI for this IF-test)
-            print(f'FIN-ACK packet is received seq={s_seq} ack={s_ack}')
-            print('Connection closes')
+            info(f'FIN-ACK packet is received seq={s_seq} ack={s_ack}')
+            info('Connection closes')
+            if s_flags & FLAG_RST: # The server's copy differs from the file, its checkpoint is gone
+                raise RuntimeError('File digest mismatch, the file must be sent again')
             return
     
     # If we fall through the loop, the server never acknowledged our FIN
     raise RuntimeError('Teardown failed: FIN not acknowledged')
 
 
+"""
+    Description
+    -----------
+    Uploads (part of) a file to a UDP server in three phases: handshake, data 
+    transfer, and teardown, over a socket of its own.
+
+    Parameters
+    ----------
+    ip : Server IP address.
+    port : Server UDP port.
+    filename : Path to the file that will be transmitted, or a list of
+        (path, name) tuples to send as one batch (see batch.py).
+    window : Receive-window size the client advertises during the handshake.
+    mode : 'gbn' or 'sr', see client().
+    cc : Name of the congestion controller, see congestion.CONTROLLERS.
+    offset : Byte offset in the file where this transfer starts.
+    length : Number of bytes to send from offset, None for the rest of the file.
+    range_option : Packed RANGE_OPTION when this is one stream of a parallel 
+        transfer, empty otherwise.
+    metrics : TransferMetrics filled in by the three phases.
+    mss : Largest payload per DATA packet to offer, see handshake_client.
+    probe : Probe the path MTU for the largest payload up to mss.
+    pace : Pace the packets with a token bucket, see congestion.Pacer.
+    pace_rate : Fixed pacing rate in bits per second, None to follow cwnd / srtt.
+    resume : Offer a resumable transfer (see resume.py): if the server holds a
+        checkpoint of this file, only the bytes after it are sent, and the 
+        FIN carries the file digest. Not for parallel streams.
+    compress : Offer compression of the data (see compression.py).
+    fec : Offer forward error correction (see fec.py).
+    fec_group : Fixed FEC group size, None to adapt it to the loss rate.
+    delta : Offer a delta transfer (see delta.py): if the server holds an
+        earlier version of the file, it sends the signature of its copy and
+        only the changed bytes are sent, the FIN carries the file digest.
+        Not for parallel streams, batches or resumed transfers.
+
+    Raises
+    ------
+    RuntimeError
+        If any phase fails, the server does not support parallel streams or
+        batches, or the server's copy of a resumed or delta transfer does 
+        not match its digest.
+"""
+def transfer(ip: str, port: int, filename: str, window: int, mode: str='gbn', cc: str='none', offset: int=0, length: int=None, range_option: bytes=b'', metrics: TransferMetrics=None, mss: int=DATA_LEN, probe: bool=False, pace: bool=False, pace_rate: float=None, resume: bool=False, compress: bool=False, fec: bool=False, fec_group: int=None, delta: bool=False):
+
+    with socket(AF_INET, SOCK_DGRAM) as sock:
+
+        server_addr = ((ip, port)) # Makes the server address
+        # Binds the socket ot the local port so the OS chooses on for us. And ip as well.
+        sock.bind(('', 0))
+        # One RTT estimate shared by all three phases, it sets the socket timeouts
+        rtt = RttEstimator()
+        m = metrics or TransferMetrics('client', server_addr)
+        start_seq = 1
+        batch = not isinstance(filename, str) # A list of files
+        offer = FLAG_EXT | FLAG_MSS | (FLAG_SR if mode == 'sr' else 0) | (FLAG_RANGE if range_option else 0) | (FLAG_RESUME if resume else 0) | (FLAG_COMPRESS if compress else 0) | (FLAG_FEC if fec else 0) | (FLAG_BATCH if batch else 0) | (FLAG_DELTA if delta else 0) # Features we ask the server for
+        resume_option = RESUME_OPTION.pack(file_id(filename), os.path.getsize(filename)) if resume else b''
+        with m.phase('handshake'):
+            agreed_window, features, agreed_mss, resume_offset = handshake_client(sock, server_addr, window, offer, rtt, range_option, mss=mss, probe=probe, resume_option=resume_option) # Three-way handshake 
+        if range_option and not features & FLAG_RANGE:
+            raise RuntimeError('Server does not support parallel streams (run it with --multi)')
+        if batch and not features & FLAG_BATCH:
+            raise RuntimeError('Server does not support batches of files')
+        digest, signature = [], None
+        if features & FLAG_DELTA:
+            with m.phase('signature'):
+                signature = receive_signature(sock, server_addr, agreed_window, features, agreed_mss)
+        elif delta:
+            info('No earlier version of the file on the server, sending all of it')
+        if features & (FLAG_RESUME | FLAG_DELTA):
+            if resume_offset:
+                info(f'Resuming at byte {resume_offset}')
+                offset = m.resumed_from = resume_offset
+            # Hash the whole file for the FIN while the data is sent, hashlib does not hold the GIL
+            hasher = Thread(target=lambda: digest.append(file_digest(filename).digest()), daemon=True)
+            hasher.start()
+        controller = make_controller(cc, agreed_window) # Congestion window, capped by the agreed window
+        pacer = Pacer(pace_rate / 8 if pace_rate else None) if pace else None
+        encoder = FecEncoder(fec_group) if features & FLAG_FEC else None
+        with m.phase('data'):
+            final_seq = send_data(sock, server_addr, start_seq, agreed_window, filename, features, rtt, controller, offset, length, m, agreed_mss, pacer, encoder, signature) # File transfer 
+        if features & (FLAG_RESUME | FLAG_DELTA):
+            hasher.join()
+        with m.phase('teardown'):
+            teardown_client(sock, server_addr, final_seq, features, rtt, digest=b''.join(digest)) # Connection teardown
+
 """
     Description
     -----------
     Uploads a file to a UDP server in three phases: handshake, data transfer, and teardown.
 
-    This function creates a UDP socket, executes the three phases using helper functions, and 
-    handles any `RuntimeError` raised during the process by printing an error message to the console.
+    This function executes the three phases using helper functions, and handles 
+    any `RuntimeError` raised during the process by printing an error message 
+    to the console.
+
+    With streams > 1 the file is split into that many equal byte ranges, 
+    and every range is sent over its own DRTP connection and
+    socket in a thread of its own. The SYN of each stream carries the range 
+    so a --multi server can write all of them into one preallocated file. 
+    This fills long fat links that a single window cannot.
+
+    Several files, or a directory, are sent as one batch over a single 
+    connection (see batch.py): one handshake and one teardown for all of
+    them, and the server writes every file under its own name.
 
     Parameters
     ----------
     ip : Server IP address.
     port : Server UDP port.
-    filename : Path to the file that will be transmitted.
+    filename : Path to the file that will be transmitted, or a list of
+        paths of files and directories to send as one batch. A batch uses a
+        single stream and is not resumable.
     window : Receive-window size the client advertises during the handshake.
+    mode : 'gbn' for Go-Back-N or 'sr' to offer Selective Repeat. Falls back to
+        Go-Back-N if the server does not support it.
+    cc : Name of the congestion controller, see congestion.CONTROLLERS.
+    streams : Number of parallel connections to split the file over.
+    metrics_path : Write the transfer metrics (one object per stream) here as
+        JSON when the transfer ends, also after a failure.
+    metrics_interval : Seconds between periodic samples in the metrics, 0 for none.
+    mss : Largest payload per DATA packet to offer, the server may lower it.
+    probe : Probe the path MTU for the largest payload up to mss.
+    pace : Pace the packets with a token bucket instead of sending bursts.
+    pace_rate : Fixed pacing rate in bits per second for the whole transfer,
+        shared evenly by the streams. None spreads the window over the RTT.
+    resume : Continue where an earlier, failed transfer of the same file 
+        stopped, see transfer(). Single stream only.
+    compress : Compress the data if the server supports it. Blocks that do
+        not get smaller, like those of a JPEG, are sent uncompressed.
+    fec : Send XOR parity packets if the server supports them, so that a 
+        single lost packet per group is rebuilt without a resend.
+    fec_group : Data packets per parity packet, None to adapt to the loss rate.
+    delta : Send only what changed against the server's copy of the file,
+        see transfer(). Single stream only, not with resume.
 
     Returns
     -------
@@ -211,22 +881,51 @@ def teardown_client(sock: socket, server_addr: tuple, seq: int, max_retry: int=5
         The function terminates when the connection is cleanly torn down.
         It does not return a value.
 """
-def client(ip: str, port: int, filename: str, window: int):
-
-    with socket(AF_INET, SOCK_DGRAM) as sock:
-
-        server_addr = ((ip, port)) # Makes the server address
-        # Binds the socket ot the local port so the OS chooses on for us. And ip as well.
-        sock.bind(('', 0))
-        # Setting timeout for the client 
-        sock.settimeout(0.4)  
+def client(ip: str, port: int, filename: str, window: int, mode: str='gbn', cc: str='none', streams: int=1, metrics_path: str=None, metrics_interval: float=0.0, mss: int=DATA_LEN, probe: bool=False, pace: bool=False, pace_rate: float=None, resume: bool=False, compress: bool=False, fec: bool=False, fec_group: int=None, delta: bool=False):
+
+    paths = [filename] if isinstance(filename, str) else list(filename)
+    if len(paths) > 1 or os.path.isdir(paths[0]): # Several files or a directory: one batch
+        filename = list_files(paths)
+        info(f'Sending {len(filename)} files as one batch')
+        streams, resume, delta = 1, False, False
+    else:
+        filename = paths[0]
+
+    if streams <= 1:
+        metrics = TransferMetrics('client', (ip, port), metrics_interval)
         try:
-            start_seq = 1
-            agreed_window = handshake_client(sock, server_addr, window) # Three-way handshake 
-            final_seq = send_data(sock, server_addr, start_seq, agreed_window, filename) # File transfer 
-            teardown_client(sock, server_addr, final_seq) # Connection teardown
+            transfer(ip, port, filename, window, mode, cc, metrics=metrics, mss=mss, probe=probe, pace=pace, pace_rate=pace_rate, resume=resume, compress=compress, fec=fec, fec_group=fec_group, delta=delta)
         except RuntimeError as e:
             # Any of the helper routines may raise RuntimeError on failure.
             print('Client', e)
-
+        if metrics_path:
+            write_json(metrics_path, metrics)
         return
+
+    size = os.path.getsize(filename)
+    # Split into byte ranges, the server may agree on a smaller payload than the mss offered
+    per_stream = -(-size // streams) or 1
+    transfer_id = int.from_bytes(os.urandom(4), 'big') # Tells the server which streams belong together
+    errors = []
+    offsets = range(0, max(size, 1), per_stream)
+    metrics = [TransferMetrics('client', (ip, port), metrics_interval) for _ in offsets]
+    stream_rate = pace_rate / len(offsets) if pace_rate else None
+
+    def run(offset, m):
+        option = RANGE_OPTION.pack(transfer_id, offset, size)
+        try:
+            transfer(ip, port, filename, window, mode, cc, offset, per_stream, option, m, mss, probe, pace, stream_rate, compress=compress, fec=fec, fec_group=fec_group)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [Thread(target=run, args=args) for args in zip(offsets, metrics)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for e in errors:
+        print('Client', e)
+    if not errors:
+        info(f'All {len(threads)} streams finished')
+    if metrics_path:
+        write_json(metrics_path, metrics)
@@ -0,0 +1,212 @@
+"""
+    Description
+    -----------
+    Compression of the data phase, used when FLAG_COMPRESS was agreed.
+
+    The sender cuts the file into blocks of COMPRESS_BLOCK bytes and sends
+    every block as one frame: a BLOCK_HEADER (kind, length) followed by the
+    block, either zlib-compressed or raw. The frames form one byte stream
+    that is split into DATA packets like an uncompressed file, so windows,
+    resends and the rest of the protocol do not change. Blocks are
+    compressed independently by a thread that stays COMPRESS_AHEAD frames
+    ahead of the sender; zlib does not hold the GIL, so compression runs
+    on another core while packets are sent.
+
+    Blocks whose first COMPRESS_SAMPLE bytes do not shrink by at least
+    COMPRESS_MIN_SAVING are sent raw without compressing the rest, as are
+    blocks that fail the same test as a whole. Already compressed data such
+    as JPEG thus costs a few percent of a compression pass, and every block
+    is judged on its own, so text in between still gets compressed.
+"""
+import zlib
+from queue import Queue, Empty
+from struct import Struct
+from threading import Thread
+
+# Frame header: kind of block and number of bytes that follow
+BLOCK_HEADER = Struct('!BI')
+BLOCK_RAW = 0
+BLOCK_ZLIB = 1
+
+# File bytes per block
+COMPRESS_BLOCK = 256 * 1024
+# zlib level, the fastest: the link, not the ratio, is what we are short of
+COMPRESS_LEVEL = 1
+# A compressed block must be at most this fraction of the raw block to be used
+COMPRESS_MIN_SAVING = 0.9
+# Bytes at the start of a block compressed first to see whether the block is worth it
+COMPRESS_SAMPLE = 8 * 1024
+# Frames compressed ahead of the sender
+COMPRESS_AHEAD = 4
+
+"""
+    Description
+    -----------
+    Turns the bytes of a file into the frame stream, read sequentially with
+    read(). The Sender reads one packet payload at a time from it. The
+    frames are made by a thread started by the first read(); close() stops
+    it early, e.g. when the transfer fails.
+
+    Parameters
+    ----------
+    view : File bytes, anything that supports len() and slicing. Shorter
+        slices than asked for are fine. Or a stream with read(n) such as
+        batch.BatchReader.
+    level : zlib compression level.
+    block : File bytes per block.
+
+    Attributes
+    ----------
+    consumed : File (or source stream) bytes framed so far, all of them once
+        read() has returned the end of the stream.
+    produced : Frame stream bytes returned by read() so far.
+"""
+class Compressor:
+
+    def __init__(self, view, level: int=COMPRESS_LEVEL, block: int=COMPRESS_BLOCK):
+        self.view = view
+        self.level = level
+        self.block = block
+        self.stream = hasattr(view, 'read') # Read block by block instead of sliced
+        self.consumed = 0
+        self.produced = 0
+        self.parts = [] # Pieces of the current frame not read yet
+        self.part_pos = 0 # Read position in parts[0]
+        self.frames = Queue(COMPRESS_AHEAD) # Frames made by the thread, None after the last
+        self.thread = None
+        self.stopped = False
+        self.ended = False # The None after the last frame was read
+
+    # True when `sample` compresses well enough to compress the block it starts
+    def worth_it(self, sample):
+        return len(zlib.compress(sample, self.level)) <= len(sample) * COMPRESS_MIN_SAVING
+
+    # Frame of the next block as a list of pieces, None at the end of the file
+    def next_frame(self):
+        if self.stream:
+            data = self.view.read(self.block)
+        elif self.consumed < len(self.view):
+            data = self.view[self.consumed:self.consumed + self.block]
+        else:
+            return None
+        if not len(data):
+            return None
+        self.consumed += len(data)
+        if self.worth_it(data[:COMPRESS_SAMPLE]):
+            packed = zlib.compress(data, self.level)
+            if len(packed) <= len(data) * COMPRESS_MIN_SAVING:
+                return [BLOCK_HEADER.pack(BLOCK_ZLIB, len(packed)), packed]
+        return [BLOCK_HEADER.pack(BLOCK_RAW, len(data)), data]
+
+    # Thread: make frames until the end of the file, waiting while COMPRESS_AHEAD are unread
+    def produce(self):
+        try:
+            while not self.stopped:
+                frame = self.next_frame()
+                self.frames.put(frame)
+                if frame is None:
+                    return
+        except Exception as e: # Reading the source failed, read() raises it in the sender's thread
+            self.frames.put(e)
+
+    # Up to n bytes of the frame stream, fewer only at its end
+    def read(self, n: int):
+        if self.thread is None:
+            self.thread = Thread(target=self.produce, daemon=True)
+            self.thread.start()
+        pieces, size = [], 0
+        while size < n:
+            if not self.parts:
+                if self.ended:
+                    break
+                self.parts = self.frames.get()
+                if isinstance(self.parts, Exception):
+                    error, self.parts = self.parts, []
+                    raise error
+                if self.parts is None:
+                    self.ended, self.parts = True, []
+                    break
+            part = self.parts[0]
+            piece = part[self.part_pos:self.part_pos + n - size]
+            pieces.append(piece)
+            size += len(piece)
+            self.part_pos += len(piece)
+            if self.part_pos == len(part):
+                self.parts.pop(0)
+                self.part_pos = 0
+        self.produced += size
+        return pieces[0] if len(pieces) == 1 else b''.join(pieces) # No copy for a piece of a single part
+
+    # Stop the thread and drop the frames, which may hold slices of the file
+    def close(self):
+        self.stopped = True
+        self.parts = []
+        if self.thread is not None:
+            self.drain() # Unblock a waiting put(), the thread then sees `stopped`
+            self.thread.join()
+            self.drain()
+
+    # Throw away the frames waiting in the queue
+    def drain(self):
+        try:
+            while True:
+                self.frames.get_nowait()
+        except Empty:
+            pass
+
+
+"""
+    Description
+    -----------
+    Turns the frame stream back into file bytes as it arrives in order, in
+    pieces of any size. Raw blocks are passed through without buffering,
+    zlib blocks are inflated incrementally.
+
+    Parameters
+    ----------
+    write : Called with every piece of file bytes, in order.
+
+    Attributes
+    ----------
+    consumed : Frame stream bytes fed so far.
+"""
+class Decompressor:
+
+    def __init__(self, write):
+        self.write = write
+        self.consumed = 0
+        self.header = bytearray() # A frame header split over two packets
+        self.kind = None # Kind of the current frame, None between frames
+        self.remaining = 0 # Bytes of the current frame still to come
+        self.inflater = None
+
+    def feed(self, data):
+        self.consumed += len(data)
+        data = memoryview(data)
+        while len(data):
+            if self.kind is None: # Between frames: read the next header
+                take = BLOCK_HEADER.size - len(self.header)
+                self.header += data[:take]
+                data = data[take:]
+                if len(self.header) < BLOCK_HEADER.size:
+                    return
+                self.kind, self.remaining = BLOCK_HEADER.unpack(self.header)
+                self.header.clear()
+                if self.kind == BLOCK_ZLIB:
+                    self.inflater = zlib.decompressobj()
+                elif self.kind != BLOCK_RAW:
+                    raise RuntimeError(f'Unknown compressed block kind {self.kind}')
+            piece = data[:self.remaining]
+            data = data[len(piece):]
+            self.remaining -= len(piece)
+            if self.kind == BLOCK_RAW:
+                self.write(piece)
+            else:
+                self.write(self.inflater.decompress(piece))
+            if not self.remaining: # End of the frame
+                if self.kind == BLOCK_ZLIB:
+                    self.write(self.inflater.flush())
+                    if not self.inflater.eof:
+                        raise RuntimeError('Truncated compressed block')
+                    self.inflater = None
+                self.kind = None
@@ -0,0 +1,213 @@
+"""
+    Description
+    -----------
+    Congestion controllers for the DRTP sender.
+
+    A controller keeps a congestion window (cwnd, in packets) that send_data
+    combines with the peer-advertised window: at most min(cwnd, peer window)
+    packets are in flight. The sender reports events to the controller:
+
+    on_ack(acked, rtt) : `acked` new packets were acknowledged, `rtt` is an RTT
+        sample in seconds or None when Karn's rule forbids one.
+    on_timeout() : the retransmission timer expired.
+    on_loss() : a loss was detected without a timeout (e.g. duplicate ACKs).
+
+    A Pacer can additionally spread the packets the window allows over time.
+"""
+
+# Packets in flight at the start of the transfer and after a timeout
+INITIAL_CWND = 1.0
+
+# Pacing rate as a multiple of cwnd per smoothed RTT, higher in slow start so the window can still double every RTT
+PACING_GAIN = 1.25
+PACING_SLOW_START_GAIN = 2.0
+# The token bucket holds at least this many packets...
+PACING_MIN_BURST = 2
+# ...or this many seconds worth of the pacing rate, so that timer wake-up latency does not lower the rate
+PACING_BURST_TIME = 0.002
+
+"""
+    Description
+    -----------
+    No congestion control: the window stays at the peer-advertised size for the
+    whole transfer, as the sender always did.
+
+    Parameters
+    ----------
+    max_window : Peer-advertised window (packets).
+"""
+class FixedWindow:
+    name = 'none'
+
+    def __init__(self, max_window: int):
+        self.cwnd = float(max_window)
+        self.max_window = max_window
+
+    # Usable window in whole packets
+    @property
+    def window(self):
+        return max(1, int(self.cwnd))
+
+    def on_ack(self, acked: int, rtt: float=None):
+        pass
+
+    def on_timeout(self):
+        pass
+
+    def on_loss(self):
+        pass
+
+    # True while the window grows exponentially
+    @property
+    def slow_start(self):
+        return False
+
+    # Short human readable form for logging
+    def __str__(self):
+        return f'cwnd = {self.cwnd:.1f}'
+
+
+"""
+    Description
+    -----------
+    Loss-based AIMD controller in the style of TCP Reno. The window grows by
+    one packet per ACK during slow start (doubling every RTT) until it reaches
+    ssthresh, then by one packet per RTT (congestion avoidance). A timeout
+    halves ssthresh and restarts slow start from one packet; a loss detected
+    without a timeout halves the window instead.
+
+    Parameters
+    ----------
+    max_window : Peer-advertised window (packets), the window never grows past it.
+"""
+class Reno(FixedWindow):
+    name = 'reno'
+
+    def __init__(self, max_window: int):
+        super().__init__(max_window)
+        self.cwnd = min(INITIAL_CWND, max_window)
+        self.ssthresh = float(max_window)
+
+    def on_ack(self, acked: int, rtt: float=None):
+        for _ in range(acked):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1 # Slow start
+            else:
+                self.cwnd += 1 / self.cwnd # Congestion avoidance
+        self.cwnd = min(self.cwnd, self.max_window)
+
+    def on_timeout(self):
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = INITIAL_CWND
+
+    def on_loss(self):
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = self.ssthresh
+
+    @property
+    def slow_start(self):
+        return self.cwnd < self.ssthresh
+
+    def __str__(self):
+        return f'cwnd = {self.cwnd:.1f}, ssthresh = {self.ssthresh:.1f}'
+
+
+"""
+    Description
+    -----------
+    Delay-based controller in the style of TCP Vegas. It compares the smallest
+    RTT seen (the path without queueing) with the current RTT to estimate how
+    many of our packets sit in router queues, and keeps that number between
+    `alpha` and `beta` by growing or shrinking the window by one packet per
+    RTT. Losses are handled like Reno.
+
+    Parameters
+    ----------
+    max_window : Peer-advertised window (packets), the window never grows past it.
+    alpha, beta : Lower and upper target for queued packets.
+"""
+class Vegas(Reno):
+    name = 'vegas'
+
+    def __init__(self, max_window: int, alpha: float=2, beta: float=4):
+        super().__init__(max_window)
+        self.alpha = alpha
+        self.beta = beta
+        self.base_rtt = None # Smallest RTT seen
+
+    def on_ack(self, acked: int, rtt: float=None):
+        if rtt is None or rtt <= 0:
+            return super().on_ack(acked) # No sample, fall back to AIMD growth
+        self.base_rtt = rtt if self.base_rtt is None else min(self.base_rtt, rtt)
+        # Packets queued along the path: expected minus actual rate, times the base RTT
+        queued = self.cwnd * (1 - self.base_rtt / rtt)
+        if self.cwnd < self.ssthresh and queued < self.alpha:
+            self.cwnd += acked # Slow start while the queues stay empty
+        elif queued < self.alpha:
+            self.cwnd += acked / self.cwnd
+        elif queued > self.beta:
+            self.cwnd = max(self.cwnd - acked / self.cwnd, INITIAL_CWND)
+            self.ssthresh = min(self.ssthresh, self.cwnd) # Leave slow start for good
+        self.cwnd = min(self.cwnd, self.max_window)
+
+
+# Controllers selectable by name on the command line
+CONTROLLERS = {cls.name: cls for cls in (FixedWindow, Reno, Vegas)}
+
+# Build the controller called `name` for a peer-advertised window of max_window packets
+def make_controller(name: str, max_window: int):
+    if name not in CONTROLLERS:
+        raise ValueError(f'Unknown congestion controller {name!r}')
+    return CONTROLLERS[name](max_window)
+
+
+"""
+    Description
+    -----------
+    Token bucket that paces the sender, so that a window opening up, or a
+    Go-Back-N resend of the whole window, leaves as an even stream of packets
+    instead of a burst that overflows a shallow router queue. Tokens are
+    bytes: they accrue at the pacing rate up to the bucket size, and every 
+    packet spends its own size. The bucket holds PACING_MIN_BURST packets 
+    or PACING_BURST_TIME seconds of sending, whichever is more.
+
+    Without a fixed rate the pacing rate follows the congestion control: the
+    window is spread over one smoothed RTT, times PACING_GAIN (or 
+    PACING_SLOW_START_GAIN during slow start). Before the first RTT sample 
+    packets are not paced.
+
+    Parameters
+    ----------
+    rate : Fixed pacing rate in bytes per second, None to follow cwnd / srtt.
+"""
+class Pacer:
+
+    def __init__(self, rate: float=None):
+        self.rate = rate
+        self.tokens = 0.0
+        self.stamp = None # When tokens was last brought up to date
+
+    # Pacing rate in bytes per second for a window of `window` packets of `size` bytes, None for no pacing
+    def current_rate(self, cc: FixedWindow, srtt: float, window: int, size: int):
+        if self.rate:
+            return self.rate
+        if not srtt:
+            return None
+        gain = PACING_SLOW_START_GAIN if cc.slow_start else PACING_GAIN
+        return gain * window * size / srtt
+
+    # Seconds until a packet of `size` bytes may be sent at `rate`; 0 when it may go now, its tokens are then spent
+    def delay(self, size: int, now: float, rate: float):
+        if rate is None:
+            return 0.0
+        burst = max(PACING_MIN_BURST * size, rate * PACING_BURST_TIME)
+        tokens = burst if self.stamp is None else min(burst, self.tokens + (now - self.stamp) * rate)
+        self.stamp = now
+        if tokens > size - 1: # Less than a byte short is enough, a shorter wait might not move the clock
+            self.tokens = tokens - size
+            return 0.0
+        self.tokens = tokens
+        return (size - tokens) / rate
+
+    def __str__(self):
+        return 'cwnd / srtt' if self.rate is None else f'{self.rate * 8 / 1e6:.1f} Mbps'
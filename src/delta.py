@@ -0,0 +1,328 @@
+"""
+    Description
+    -----------
+    Delta transfers in the manner of rsync, used when FLAG_DELTA was agreed:
+    the server already holds an older copy of the file (the basis) and the
+    client sends only what changed.
+
+    Right after the handshake the server sends the signature of its copy
+    to the client, as a data phase in the other direction: a
+    SIGNATURE_HEADER (file size, block size) followed by a BLOCK_SIGNATURE
+    for every full block, its Adler-32 checksum and a 16-byte BLAKE2b hash.
+    The client then scans its file for blocks of the basis, at any offset,
+    with the Adler-32 checksum rolled one byte at a time and confirmed by
+    the strong hash. The data phase carries a stream of instructions
+    instead of the file: copy a run of blocks from the basis, or take the
+    literal bytes that follow. Bytes on the wire thus grow with the size of
+    the change rather than the file. The FIN carries the digest of the new
+    file, and the server only replaces its copy once the rebuilt file
+    matches it.
+
+    Rolling the checksum in Python costs about a microsecond per byte, so
+    after DELTA_ROLL_BLOCKS blocks without a match the scan only tries
+    block boundaries, rolling over one block in every DELTA_RESYNC to find
+    matches again after an insertion. A file unrelated to the basis costs
+    a few percent of a full scan.
+"""
+import os
+import zlib
+from hashlib import blake2b
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+
+# Signature: size of the basis and bytes per block, followed by one BLOCK_SIGNATURE per full block
+SIGNATURE_HEADER = Struct('!QI')
+# Adler-32 checksum and strong hash of one block
+BLOCK_SIGNATURE = Struct('!I16s')
+STRONG_LEN = 16
+# Instruction: OP_LITERAL with the number of bytes that follow, or OP_COPY with the first block and number of blocks
+OP = Struct('!BII')
+OP_LITERAL = 0
+OP_COPY = 1
+
+# Bounds of the block size, which is about the square root of the basis size
+DELTA_MIN_BLOCK = 1024
+DELTA_MAX_BLOCK = 64 * 1024
+# Longest literal and copy instructions in bytes. The scan returns to the Sender at least once per 
+# literal or copy, and the server copies a run at once, so neither holds up the data phase for long
+DELTA_MAX_LITERAL = 32 * 1024
+DELTA_MAX_COPY = 256 * 1024
+# Blocks rolled over without a match before the scan only tries block boundaries
+DELTA_ROLL_BLOCKS = 64
+# While only block boundaries are tried, one block in this many is rolled over
+DELTA_RESYNC = 64
+# Bytes the server copies from the basis at a time
+DELTA_COPY_CHUNK = 256 * 1024
+# Adler-32 modulus
+ADLER_MOD = 65521
+
+# Block size for a basis of `size` bytes: a power of two near its square root
+def block_size(size: int):
+    block = 1 << max(0, round(size ** 0.5).bit_length() - 1)
+    return max(DELTA_MIN_BLOCK, min(DELTA_MAX_BLOCK, block))
+
+# Strong hash of a block
+def strong_hash(block):
+    return blake2b(block, digest_size=STRONG_LEN).digest()
+
+"""
+    Description
+    -----------
+    The server's existing copy of the file a delta transfer replaces.
+
+    Parameters
+    ----------
+    path : The existing file.
+
+    Attributes
+    ----------
+    size : Bytes in the file when the transfer started.
+    block : Bytes per block of the signature.
+    temp : Where the new file is rebuilt, it replaces path once verified.
+"""
+class Basis:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.block = block_size(self.size)
+        self.temp = path + '.delta'
+
+    # The signature of the file, see the module description
+    def signature(self):
+        block = self.block
+        parts = [SIGNATURE_HEADER.pack(self.size, block)]
+        with open(self.path, 'rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as mm, memoryview(mm) as view:
+            for pos in range(0, self.size - block + 1, block):
+                data = view[pos:pos + block]
+                parts.append(BLOCK_SIGNATURE.pack(zlib.adler32(data), strong_hash(data)))
+                data.release()
+        return b''.join(parts)
+
+
+"""
+    Description
+    -----------
+    The signature of the server's basis as the client sees it.
+
+    Parameters
+    ----------
+    data : Signature bytes received from the server.
+
+    Attributes
+    ----------
+    size : Bytes in the basis.
+    block : Bytes per block.
+    table : Adler-32 checksum -> {strong hash: block number}.
+"""
+class Signature:
+
+    def __init__(self, data):
+        if len(data) < SIGNATURE_HEADER.size or (len(data) - SIGNATURE_HEADER.size) % BLOCK_SIGNATURE.size:
+            raise RuntimeError('Malformed block signature from the server')
+        self.size, self.block = SIGNATURE_HEADER.unpack_from(data)
+        self.table = {}
+        for index, (weak, strong) in enumerate(BLOCK_SIGNATURE.iter_unpack(memoryview(data)[SIGNATURE_HEADER.size:])):
+            self.table.setdefault(weak, {}).setdefault(strong, index) # The first of identical blocks
+
+    def __len__(self):
+        return (self.size // self.block) if self.block else 0
+
+
+"""
+    Description
+    -----------
+    Turns the bytes of the new file into the instruction stream, read
+    sequentially with read() like compression.Compressor. The file is
+    scanned as the Sender asks for more, so the first packets leave before
+    the scan is over.
+
+    Parameters
+    ----------
+    view : New file bytes, anything that supports len(), indexing and slicing.
+    signature : Signature of the server's basis.
+
+    Attributes
+    ----------
+    consumed : File bytes encoded so far.
+    copied : File bytes sent as copy instructions.
+    literal : File bytes sent as they are.
+    produced : Instruction stream bytes returned by read() so far.
+"""
+class DeltaEncoder:
+
+    def __init__(self, view, signature: Signature):
+        self.view = view
+        self.signature = signature
+        self.consumed = 0
+        self.copied = 0
+        self.literal = 0
+        self.produced = 0
+        self.pieces = self.encode()
+        self.part = b'' # Piece being read
+        self.part_pos = 0
+
+    # Up to n bytes of the instruction stream, fewer once DELTA_MAX_COPY file bytes were covered, empty at its end
+    def read(self, n: int):
+        pieces, size = [], 0
+        start = self.consumed
+        while size < n and not (size and self.consumed - start >= DELTA_MAX_COPY):
+            if self.part_pos == len(self.part):
+                self.part = next(self.pieces, None)
+                self.part_pos = 0
+                if self.part is None:
+                    self.part = b''
+                    break
+            piece = self.part[self.part_pos:self.part_pos + n - size]
+            pieces.append(piece)
+            size += len(piece)
+            self.part_pos += len(piece)
+        self.produced += size
+        return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+
+    # Stop encoding and drop the pieces, which may be slices of the file
+    def close(self):
+        self.pieces.close()
+        self.part = b''
+        self.part_pos = 0
+
+    # Instruction and bytes of the literal view[start:end]
+    def literal_op(self, start: int, end: int):
+        self.literal += end - start
+        self.consumed = end
+        return OP.pack(OP_LITERAL, end - start, 0), self.view[start:end]
+
+    # Instruction to copy `count` blocks from block `first` on
+    def copy_op(self, first: int, count: int):
+        self.copied += count * self.signature.block
+        return OP.pack(OP_COPY, first, count)
+
+    # Generator of the pieces of the instruction stream
+    def encode(self):
+        view, block, table = self.view, self.signature.block, self.signature.table
+        n = len(view)
+        start = pos = 0 # start: first byte that is neither copied nor sent yet
+        run_first = run_count = 0 # Run of consecutive basis blocks waiting to be sent as one copy
+        unmatched = 0 # Bytes passed since the last match
+        roll_limit = DELTA_ROLL_BLOCKS * block
+        max_run = max(1, DELTA_MAX_COPY // block)
+        while table and pos + block <= n:
+            if pos - start >= DELTA_MAX_LITERAL:
+                if run_count:
+                    yield self.copy_op(run_first, run_count)
+                    run_count = 0
+                yield from self.literal_op(start, pos)
+                start = pos
+            # Positions up to `end` are tried by rolling, past the limit only pos itself or one resync block
+            if unmatched < roll_limit:
+                end = pos + roll_limit - unmatched
+            elif (unmatched // block) % DELTA_RESYNC == 0:
+                end = pos + block
+            else:
+                end = pos
+            end = min(end, n - block, start + DELTA_MAX_LITERAL)
+            weak = zlib.adler32(view[pos:pos + block])
+            a, b = weak & 0xFFFF, weak >> 16
+            p, index = pos, None
+            while True:
+                hits = table.get(b << 16 | a)
+                if hits is not None:
+                    index = hits.get(strong_hash(view[p:p + block]))
+                    if index is not None:
+                        break
+                if p >= end:
+                    break
+                out, new = view[p], view[p + block]
+                a = (a - out + new) % ADLER_MOD
+                b = (b - block * out + a - 1) % ADLER_MOD
+                p += 1
+            if index is None: # Nothing matches from pos to end
+                step = end + 1 - pos if end > pos else block
+                pos += step
+                unmatched += step
+                continue
+            if p > start: # Bytes before the match go as they are
+                if run_count:
+                    yield self.copy_op(run_first, run_count)
+                    run_count = 0
+                yield from self.literal_op(start, p)
+            if run_count and index == run_first + run_count and run_count < max_run:
+                run_count += 1
+            else:
+                if run_count:
+                    yield self.copy_op(run_first, run_count)
+                run_first, run_count = index, 1
+            pos = start = p + block
+            self.consumed = pos
+            unmatched = 0
+        if run_count:
+            yield self.copy_op(run_first, run_count)
+        for pos in range(start, n, DELTA_MAX_LITERAL):
+            yield from self.literal_op(pos, min(pos + DELTA_MAX_LITERAL, n))
+        self.consumed = n
+
+
+"""
+    Description
+    -----------
+    Turns the instruction stream back into the new file as it arrives in
+    order, in pieces of any size, copying blocks from the basis.
+
+    Parameters
+    ----------
+    basis : The server's existing copy.
+    write : Called with every piece of the new file, in order.
+
+    Attributes
+    ----------
+    consumed : Instruction stream bytes fed so far.
+    copied : File bytes copied from the basis.
+"""
+class DeltaDecoder:
+
+    def __init__(self, basis: Basis, write):
+        self.basis = basis
+        self.write = write
+        self.fd = os.open(basis.path, os.O_RDONLY)
+        self.blocks = basis.size // basis.block
+        self.consumed = 0
+        self.copied = 0
+        self.op = bytearray() # An instruction split over two packets
+        self.remaining = 0 # Literal bytes of the current instruction still to come
+
+    # Copy `count` blocks from block `first` on
+    def copy(self, first: int, count: int):
+        if first + count > self.blocks:
+            raise RuntimeError(f'Copy of blocks {first}..{first + count} beyond the {self.blocks} blocks of the basis')
+        block = self.basis.block
+        end = (first + count) * block
+        for pos in range(first * block, end, DELTA_COPY_CHUNK):
+            self.write(os.pread(self.fd, min(DELTA_COPY_CHUNK, end - pos), pos))
+        self.copied += count * block
+
+    def feed(self, data):
+        self.consumed += len(data)
+        data = memoryview(data)
+        while len(data):
+            if self.remaining: # Literal bytes pass straight through
+                piece = data[:self.remaining]
+                data = data[len(piece):]
+                self.remaining -= len(piece)
+                self.write(piece)
+                continue
+            take = OP.size - len(self.op)
+            self.op += data[:take]
+            data = data[take:]
+            if len(self.op) < OP.size:
+                return
+            kind, first, count = OP.unpack(self.op)
+            self.op.clear()
+            if kind == OP_LITERAL:
+                self.remaining = first
+            elif kind == OP_COPY:
+                self.copy(first, count)
+            else:
+                raise RuntimeError(f'Unknown delta instruction {kind}')
+
+    def close(self):
+        os.close(self.fd)
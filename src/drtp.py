@@ -1,16 +1,77 @@
-from struct import pack, unpack
+import atexit
+import json
+import sys
+from collections import deque
+from struct import pack, unpack, Struct
 from datetime import datetime
+from threading import Thread, Event
+from time import monotonic_ns
 
 # H = unsigned short (16 bits = 2 bytes)
 # 4 fields, each 2 bytes = total 8 bytes
 HEADER_FORMAT = '!HHHH'
 HEADER_LEN = 8
 DATA_LEN = 992
+# Precompiled header codec, reused for every packet instead of re-parsing the format
+HEADER = Struct(HEADER_FORMAT)
+
+# Extended header, used when both peers set FLAG_EXT in the handshake
+# I = unsigned int (32 bits = 4 bytes) for seq, ack and window, H for flags = 14 bytes
+EXT_HEADER_FORMAT = '!IIHI'
+EXT_HEADER_LEN = 14
+EXT_HEADER = Struct(EXT_HEADER_FORMAT)
+
 # Flags
 FLAG_SYN = 0b0100
 FLAG_ACK = 0b0010
 FLAG_FIN = 0b1000
 FLAG_RST = 0b0001  
+# Feature flags, offered in SYN and echoed in SYN-ACK when the server agrees
+FLAG_EXT = 0b10000 # 32-bit sequence space with the extended header
+FLAG_SR = 0b100000 # Selective Repeat with per-packet ACKs instead of Go-Back-N
+FLAG_RANGE = 0b1000000 # SYN carries the byte range of a file sent over parallel streams
+FLAG_MSS = 0b10000000 # SYN and SYN-ACK carry the largest payload per DATA packet
+FLAG_RESUME = 0b100000000 # Resumable transfer: SYN and SYN-ACK carry RESUME_OPTION, the FIN a digest
+FLAG_COMPRESS = 0b1000000000 # DATA payloads carry the file as compressed frames, see compression.py
+FLAG_FEC = 0b10000000000 # XOR parity packets follow groups of DATA packets, see fec.py
+FLAG_BATCH = 0b100000000000 # DATA payloads carry several files, each with its name and size, see batch.py
+FLAG_DELTA = 0b1000000000000 # Server sends block checksums of its copy, DATA payloads carry only what changed, see delta.py
+
+# SYN option sent after the header with FLAG_RANGE: transfer id shared by all
+# streams of one file, byte offset of this stream's range, total file size
+RANGE_OPTION = Struct('!IQQ')
+# Option sent with FLAG_MSS: in the SYN the largest payload the client offers,
+# in the SYN-ACK the payload size both sides use
+MSS_OPTION = Struct('!H')
+# Option sent with FLAG_RESUME: in the SYN the file id and file size, in the
+# SYN-ACK the file id and the byte offset the client continues from
+RESUME_OPTION = Struct('!QQ')
+# Option sent with FLAG_EXT: the window in full, the handshake's 8-byte header
+# only has room for 16 bits of it. In the SYN the client's window, in the 
+# SYN-ACK the window both sides use
+WINDOW_OPTION = Struct('!I')
+
+# SYN options follow the header in this order, each only when its flag is set.
+# New options go at the end, so that servers that do not know them still find the others.
+SYN_OPTIONS = ((FLAG_RANGE, RANGE_OPTION), (FLAG_MSS, MSS_OPTION), (FLAG_RESUME, RESUME_OPTION), (FLAG_EXT, WINDOW_OPTION))
+# The same for the SYN-ACK, which echoes FLAG_RANGE without an option
+SYNACK_OPTIONS = ((FLAG_MSS, MSS_OPTION), (FLAG_RESUME, RESUME_OPTION), (FLAG_EXT, WINDOW_OPTION))
+
+# Largest UDP payload over IPv4, and the largest DATA payload that fits in it
+MAX_DATAGRAM = 65507
+MAX_MSS = MAX_DATAGRAM - EXT_HEADER_LEN
+
+# Read the option belonging to `flag` from a SYN (or with SYNACK_OPTIONS a SYN-ACK) sent with `flags`, None if it is missing
+def read_option(data, flags: int, flag: int, options: tuple=SYN_OPTIONS):
+    offset = HEADER_LEN
+    for option_flag, option in options:
+        if option_flag == flag:
+            if flags & flag and len(data) >= offset + option.size:
+                return option.unpack_from(data, offset)
+            return None
+        if flags & option_flag:
+            offset += option.size
+    return None
 
 # Pack the four 16-bit header fields into network byte order
 def build_header(seq: int, ack: int, flags: int, window: int): 
@@ -40,10 +101,227 @@ def parse_header(header_bytes: bytes):
 def make_packet(seq: int, ack: int, flags: int, window: int, data=b''):
     return build_header(seq, ack, flags, window) + data
 
+"""
+    Description
+    -----------
+    Write a complete DRTP packet into a preallocated buffer without
+    creating intermediate bytes objects.
+
+    Parameters
+    ----------
+    buf : Writable buffer of at least HEADER_LEN + len(data) bytes.
+    seq, ack, flags, window : Header fields, see make_packet.
+    data : Payload (bytes or memoryview) copied in after the header.
+    header : Header codec, HEADER or EXT_HEADER.
+
+    Returns
+    -------
+    int : Number of bytes of buf that make up the packet.
+"""
+def pack_packet_into(buf, seq: int, ack: int, flags: int, window: int, data=b'', header: Struct=HEADER):
+    header.pack_into(buf, 0, seq, ack, flags, window)
+    end = header.size + len(data)
+    buf[header.size:end] = data
+    return end
+
+# Header codec for the data phase given the negotiated feature flags
+def header_for(features: int):
+    return EXT_HEADER if features & FLAG_EXT else HEADER
+
+# Size of the sequence number space given the negotiated feature flags
+def seq_space(features: int):
+    return 1 << 32 if features & FLAG_EXT else 1 << 16
+
+# Largest window that fits in the window field of the negotiated header
+def max_window(features: int):
+    return 0xFFFFFFFF if features & FLAG_EXT else 0xFFFF
+
+"""
+    Description
+    -----------
+    Turn a sequence number read off the wire back into an absolute packet
+    number. Sequence numbers wrap around at `space`, so the wire value is 
+    mapped to the absolute number closest to `reference` (usually the next 
+    expected or oldest unacknowledged packet).
+
+    Parameters
+    ----------
+    raw : Sequence or ack number as carried in the header.
+    reference : Absolute sequence number the value is expected to be near.
+    space : Size of the sequence space, see seq_space.
+
+    Returns
+    -------
+    int : Absolute sequence number.
+"""
+def unwrap_seq(raw: int, reference: int, space: int):
+    half = space // 2
+    return reference + ((raw - reference + half) % space) - half
+
+# Duplicate ACKs that make the sender retransmit without waiting for the RTO
+DUP_ACK_THRESHOLD = 3
+
+# Retransmission timeout bounds (seconds)
+INITIAL_RTO = 0.4
+MIN_RTO = 0.05
+MAX_RTO = 60.0
+
+"""
+    Description
+    -----------
+    Round-trip time estimator that derives the retransmission timeout from
+    measured RTT samples, following RFC 6298: a smoothed RTT (SRTT) and its
+    variation (RTTVAR) give RTO = SRTT + 4 * RTTVAR, clamped to 
+    [min_rto, max_rto]. Every timeout doubles the RTO until the next valid
+    sample. Callers apply Karn's rule and only sample packets that were
+    never retransmitted.
+
+    Attributes
+    ----------
+    srtt : Smoothed RTT in seconds, None until the first sample.
+    rttvar : RTT variation in seconds, None until the first sample.
+    rto : Current retransmission timeout in seconds.
+"""
+class RttEstimator:
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, initial_rto: float=INITIAL_RTO, min_rto: float=MIN_RTO, max_rto: float=MAX_RTO):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+
+    # Feed one RTT measurement (seconds) and recompute the RTO
+    def sample(self, rtt: float):
+        if self.srtt is None: # First measurement
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.min_rto), self.max_rto)
+
+    # Exponential backoff after a retransmission timeout
+    def backoff(self):
+        self.rto = min(self.rto * 2, self.max_rto)
+
+    # Short human readable form for logging
+    def __str__(self):
+        srtt = 'n/a' if self.srtt is None else f'{self.srtt * 1000:.1f} ms'
+        return f'srtt = {srtt}, rto = {self.rto * 1000:.1f} ms'
+
+# Log levels: nothing, connection-level messages, plus an event per packet
+LOG_OFF = 0
+LOG_SUMMARY = 1
+LOG_PACKET = 2
+LOG_LEVELS = {'off': LOG_OFF, 'summary': LOG_SUMMARY, 'packet': LOG_PACKET}
+
+"""
+    Description
+    -----------
+    Leveled logging for DRTP. Connection-level messages go through info() 
+    and log() and are printed at LOG_SUMMARY and above. Per-packet events are
+    recorded only at LOG_PACKET: the hot path guards every call with 
+    `if trace.enabled:`, so a disabled level costs one attribute check, and an
+    enabled one appends a tuple to an in-memory ring buffer. A background 
+    thread drains the ring every `interval` seconds and writes the events as
+    JSON lines with a monotonic timestamp in nanoseconds, e.g.
+
+        {"t": 8123456789, "ev": "send", "seq": 17, "val": 5}
+
+    If the writer falls behind by more than `capacity` events, the oldest
+    events are dropped rather than slowing down the transfer.
+
+    Parameters
+    ----------
+    capacity : Ring buffer size (events).
+    interval : Seconds between flushes.
+"""
+class EventLog:
+
+    def __init__(self, capacity: int=1 << 16, interval: float=0.2):
+        self.level = LOG_SUMMARY
+        self.enabled = False # Per-packet events are recorded
+        self.ring = deque(maxlen=capacity)
+        self.interval = interval
+        self.path = '-'
+        self.out = None
+        self.thread = None
+        self.stop = Event()
+        self.registered = False # close() is registered to run at exit
+
+    """
+        Description
+        -----------
+        Set the log level and, for LOG_PACKET, start writing events to path.
+
+        Parameters
+        ----------
+        level : LOG_OFF, LOG_SUMMARY or LOG_PACKET.
+        path : JSONL file for per-packet events, '-' for stdout.
+        mode : File mode, 'a' to add to a file another process writes too.
+    """
+    def configure(self, level: int, path: str='-', mode: str='w'):
+        self.close()
+        self.level = level
+        self.path = path
+        self.enabled = level >= LOG_PACKET
+        if self.enabled:
+            self.out = sys.stdout if path == '-' else open(path, mode, buffering=1 << 16)
+            self.stop.clear()
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+            if not self.registered: # Once, however often the log is configured
+                atexit.register(self.close)
+                self.registered = True
+
+    # Record one per-packet event, only call this when self.enabled is set
+    def event(self, kind: str, seq: int, value=None):
+        self.ring.append((monotonic_ns(), kind, seq, value))
+
+    # Background thread: flush the ring buffer every interval
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.drain()
+
+    # Write every buffered event to the output
+    def drain(self):
+        ring, out = self.ring, self.out
+        lines = []
+        while ring:
+            t, kind, seq, value = ring.popleft()
+            lines.append(json.dumps({'t': t, 'ev': kind, 'seq': seq, 'val': value}))
+        if lines and out is not None:
+            out.write('\n'.join(lines) + '\n')
+            out.flush()
+
+    # Stop the writer thread and flush what is left
+    def close(self):
+        if self.thread is not None:
+            self.stop.set()
+            self.thread.join()
+            self.thread = None
+        if self.out is not None:
+            self.drain()
+            if self.out is not sys.stdout:
+                self.out.close()
+            self.out = None
+
+# The process-wide event log, see EventLog
+trace = EventLog()
+
+# Print a connection-level message unless logging is off
+def info(message: str):
+    if trace.level >= LOG_SUMMARY:
+        print(message)
+
 # Return the current local time once
 def timestamp():   
     return datetime.now()
 
-# Print message with a wall-clock timestamp down to microseconds.
+# Print message with a wall-clock timestamp down to microseconds, unless logging is off.
 def log(message: str):
-    print(f'{timestamp().strftime("%H:%M:%S.%f")} -- {message}')
\ No newline at end of file
+    if trace.level >= LOG_SUMMARY:
+        print(f'{timestamp().strftime("%H:%M:%S.%f")} -- {message}')
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""
+    Description
+    -----------
+    Forward error correction with XOR parity, used when FLAG_FEC was agreed.
+
+    The sender groups consecutive new DATA packets and, after the last
+    packet of a group, sends one parity packet: FLAG_FEC set, the seq field
+    holding the group's first sequence number, the ack field the number of
+    packets in the group, the window field the XOR of their lengths, and as
+    payload the XOR of their payloads, so it is no longer than a DATA
+    packet. Every DATA packet
+    carries the first sequence number of its group in its ack field. A
+    receiver that misses exactly one packet of a group rebuilds it from the
+    parity and the others, without waiting for a resend. Receivers report
+    the number of rebuilt packets in the seq field of their ACKs.
+
+    The group size is fixed, or follows the loss rate: the most packets that
+    keep (group size + 1) * loss rate within FEC_LOSS_BUDGET, so that two
+    losses in one group stay rare. Either way it is at most half the window.
+    Resends are not covered by parity.
+"""
+# Bounds of the group size, parity costs 1 / group size of the bandwidth
+FEC_MIN_GROUP = 2
+FEC_MAX_GROUP = 64
+# Expected losses per group (parity included) the adaptive group size aims for
+FEC_LOSS_BUDGET = 0.1
+# Packets the loss rate is averaged over at least, so one early loss does not shrink the groups
+FEC_MIN_SAMPLE = 100
+
+# Group size for a packet loss rate of `loss_rate`
+def group_size(loss_rate: float):
+    if loss_rate <= 0:
+        return FEC_MAX_GROUP
+    return max(FEC_MIN_GROUP, min(FEC_MAX_GROUP, int(FEC_LOSS_BUDGET / loss_rate) - 1))
+
+# Payload of length `length` with the bytes of `value`, the little-endian integer the parity is computed on
+def to_payload(value: int, length: int):
+    return value.to_bytes(max(length, (value.bit_length() + 7) // 8), 'little')[:length]
+
+
+"""
+    Description
+    -----------
+    Parity of the sender's current group. The payloads are XORed as
+    little-endian integers, which pads shorter ones with zeros and is much
+    faster than XORing byte by byte in Python.
+
+    Parameters
+    ----------
+    group : Fixed group size, None to follow the loss rate.
+
+    Attributes
+    ----------
+    start : Sequence number of the group's first packet.
+    count : Packets in the group so far, 0 when no group is open.
+    repaired : Packets the receiver rebuilt, as reported in its ACKs.
+"""
+class FecEncoder:
+
+    def __init__(self, group: int=None):
+        self.group = group
+        self.size = group or FEC_MAX_GROUP # Packets in the current group
+        self.repaired = 0
+        self.start = 0
+        self.count = 0
+        self.value = 0 # XOR of the payloads
+        self.lengths = 0 # XOR of the payload lengths
+        self.longest = 0
+
+    # Start a group at `seq`, sized for `lost` of `sent` packets lost so far (without the rebuilt ones).
+    # At most half the `window` in packets, so that the group and the packets after it can go out
+    # while the receiver waits for the parity, also after the congestion window has been halved.
+    def begin(self, seq: int, sent: int, lost: int, window: int):
+        self.start = seq
+        self.count = self.value = self.lengths = self.longest = 0
+        size = self.group or group_size((lost + self.repaired) / max(sent, FEC_MIN_SAMPLE))
+        self.size = max(1, min(size, window // 2))
+
+    # Add the payload of the group's next packet, True when the group is full
+    def add(self, payload):
+        self.value ^= int.from_bytes(payload, 'little')
+        self.lengths ^= len(payload)
+        self.longest = max(self.longest, len(payload))
+        self.count += 1
+        return self.count >= self.size
+
+    # Close the group: its first seq, its number of packets, the XOR of their lengths and the parity payload
+    def close(self):
+        count, self.count = self.count, 0
+        return self.start, count, self.lengths, to_payload(self.value, self.longest)
+
+    def __str__(self):
+        return f'last group of {self.size}' + ('' if self.group else ' (adaptive)')
+
+
+"""
+    Description
+    -----------
+    The receiver's side: remembers the payloads of the packets that may
+    still be needed to rebuild a lost one, and rebuilds it when the parity
+    of its group arrives.
+
+    Attributes
+    ----------
+    done : End of the last group whose parity arrived, a resend from
+        before it cannot be rebuilt any more.
+"""
+class FecDecoder:
+
+    def __init__(self):
+        self.seen = {} # seq -> (payload as integer, length) of packets in groups whose parity is still to come
+        self.done = 0
+        self.rebuilt = None # Packet rebuilt from the last parity, in case the original was only late
+
+    """
+        Description
+        -----------
+        Remember a received DATA packet, if `needed` to rebuild another one
+        of its group.
+
+        Returns
+        -------
+        late : True when the packet was rebuilt from the last parity: it was
+            overtaken by the parity, not lost. A resend comes a round trip
+            later, after the next parity.
+    """
+    def add(self, seq: int, payload, needed: bool=True):
+        if seq == self.rebuilt:
+            self.rebuilt = None
+            return True
+        if needed and seq not in self.seen:
+            self.seen[seq] = (int.from_bytes(payload, 'little'), len(payload))
+        return False
+
+    """
+        Description
+        -----------
+        Process the parity of the `count` packets from `start` on, whose
+        lengths XOR to `lengths`, and forget the packets up to the end of
+        that group.
+
+        Returns
+        -------
+        missing : Sequence numbers of the group's packets that never arrived.
+        payload : The rebuilt payload when exactly one was missing, else None.
+    """
+    def repair(self, start: int, count: int, lengths: int, parity):
+        seen = self.seen
+        missing = [seq for seq in range(start, start + count) if seq not in seen]
+        payload = None
+        if len(missing) == 1:
+            value = int.from_bytes(parity, 'little')
+            length = lengths
+            for seq in range(start, start + count):
+                if seq in seen:
+                    value ^= seen[seq][0]
+                    length ^= seen[seq][1]
+            payload = to_payload(value, length)
+        self.rebuilt = missing[0] if payload is not None else None
+        end = start + count
+        self.done = max(self.done, end)
+        for seq in [seq for seq in seen if seq < end]: # Older groups whose parity was lost go too
+            del seen[seq]
+        return missing, payload
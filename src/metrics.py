@@ -0,0 +1,169 @@
+import json
+from contextlib import contextmanager
+from time import monotonic
+
+# Most RTT samples kept for the percentiles in the export
+MAX_RTT_SAMPLES = 10000
+
+"""
+    Description
+    -----------
+    Counters and timings for one DRTP transfer, kept by the sender
+    (send_data) or the receiver (Receiver) and exported as JSON.
+
+    The hot paths only increment plain attributes. Time series are built by
+    tick(), which takes a snapshot (bytes, packets in flight, cwnd,
+    retransmissions) at most once every `interval` seconds, so the cost does
+    not depend on the packet rate. The receiver's snapshots count the 
+    packets it holds ahead of a gap as in flight.
+
+    Parameters
+    ----------
+    role : 'client' or 'server'.
+    peer : Address of the other side, for the export.
+    interval : Seconds between periodic samples, 0 disables them.
+
+    Attributes
+    ----------
+    payload_bytes : File bytes delivered (client: ACKed, server: written).
+    wire_bytes : Bytes of DATA packets including headers and resends.
+    packets_sent, retransmissions, rto_events, fast_retransmits,
+    acks_received, dup_acks, fec_packets : Sender counters.
+    packets_received, duplicates, out_of_order, discarded, acks_sent,
+    fec_repaired : Receiver counters. fec_repaired leaves out packets whose
+        original came in right after they had been rebuilt.
+    resumed_from : Byte offset a resumed transfer continued from, 0 otherwise.
+    compressed_bytes : Compressed stream bytes that carried payload_bytes when
+        FLAG_COMPRESS was agreed, 0 otherwise.
+    delta_bytes : Delta instruction bytes that carried payload_bytes when
+        FLAG_DELTA was agreed, before any compression, 0 otherwise.
+    phases : Phase name -> duration in seconds.
+"""
+class TransferMetrics:
+
+    def __init__(self, role: str, peer: tuple=None, interval: float=0.0):
+        self.role = role
+        self.peer = peer
+        self.interval = interval
+        self.started = monotonic()
+        self.phases = {}
+        self.data_start = None # First data packet sent/received
+        self.data_end = None
+        self.payload_bytes = 0
+        self.wire_bytes = 0
+        self.resumed_from = 0
+        self.compressed_bytes = 0
+        self.delta_bytes = 0
+        self.fec_packets = 0
+        self.fec_repaired = 0
+        # Sender
+        self.packets_sent = 0
+        self.retransmissions = 0
+        self.rto_events = 0
+        self.fast_retransmits = 0
+        self.acks_received = 0
+        self.dup_acks = 0
+        # Receiver
+        self.packets_received = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.discarded = 0
+        self.acks_sent = 0
+        # Time series
+        self.rtt_samples = []
+        self.samples = []
+        self.next_sample = 0.0
+
+    # Time the block as phase `name` (handshake, data, teardown)
+    @contextmanager
+    def phase(self, name: str):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = monotonic() - start
+
+    # Mark the first data packet, goodput is measured from here
+    def data_started(self, now: float):
+        if self.data_start is None:
+            self.data_start = now
+
+    # Mark the end of the data phase
+    def data_finished(self, now: float=None):
+        self.data_end = monotonic() if now is None else now
+
+    def add_rtt(self, rtt: float):
+        if len(self.rtt_samples) < MAX_RTT_SAMPLES:
+            self.rtt_samples.append(rtt)
+
+    # Take a periodic sample if one is due, call freely from the hot loop
+    def tick(self, now: float, in_flight: int=0, cwnd: float=0.0):
+        if self.interval and now >= self.next_sample:
+            self.next_sample = now + self.interval
+            self.samples.append({
+                't': round(now - self.started, 6),
+                'payload_bytes': self.payload_bytes,
+                'in_flight': in_flight,
+                'cwnd': round(cwnd, 2),
+                'retransmissions': self.retransmissions,
+            })
+
+    # Seconds between the first and the last data packet
+    @property
+    def data_seconds(self):
+        if self.data_start is None:
+            return 0.0
+        end = self.data_end if self.data_end is not None else monotonic()
+        return max(end - self.data_start, 1e-9)
+
+    # File bytes per second over the data phase, in Mbps
+    @property
+    def goodput_mbps(self):
+        return self.payload_bytes * 8 / 1e6 / self.data_seconds if self.data_start is not None else 0.0
+
+    # All bytes put on the wire per second over the data phase, in Mbps
+    @property
+    def throughput_mbps(self):
+        return self.wire_bytes * 8 / 1e6 / self.data_seconds if self.data_start is not None else 0.0
+
+    def to_dict(self):
+        rtts = sorted(self.rtt_samples)
+        rtt = None
+        if rtts:
+            rtt = {
+                'count': len(rtts),
+                'min_ms': rtts[0] * 1000,
+                'mean_ms': sum(rtts) / len(rtts) * 1000,
+                'p50_ms': rtts[len(rtts) // 2] * 1000,
+                'p99_ms': rtts[min(len(rtts) - 1, int(len(rtts) * 0.99))] * 1000,
+                'max_ms': rtts[-1] * 1000,
+            }
+        counters = ('packets_sent', 'retransmissions', 'rto_events', 'fast_retransmits', 'acks_received', 'dup_acks', 'fec_packets') \
+            if self.role == 'client' else ('packets_received', 'duplicates', 'out_of_order', 'discarded', 'acks_sent', 'fec_repaired')
+        return {
+            'role': self.role,
+            'peer': list(self.peer) if self.peer else None,
+            'payload_bytes': self.payload_bytes,
+            'wire_bytes': self.wire_bytes,
+            'resumed_from': self.resumed_from,
+            'compressed_bytes': self.compressed_bytes,
+            'delta_bytes': self.delta_bytes,
+            'data_seconds': self.data_seconds,
+            'goodput_mbps': self.goodput_mbps,
+            'throughput_mbps': self.throughput_mbps,
+            **{name: getattr(self, name) for name in counters},
+            'rtt': rtt,
+            'phases': self.phases,
+            'samples': self.samples,
+        }
+
+# Write the metrics of one or more transfers to path as a JSON document
+def write_json(path: str, metrics):
+    data = [m.to_dict() for m in metrics] if isinstance(metrics, list) else metrics.to_dict()
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+# Append the metrics of one transfer to path as a single JSON line
+def append_jsonl(path: str, metrics: TransferMetrics):
+    with open(path, 'a') as f:
+        f.write(json.dumps(metrics.to_dict()) + '\n')
@@ -0,0 +1,190 @@
+import heapq
+import random
+from collections import deque
+from selectors import DefaultSelector, EVENT_READ
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF
+from threading import Thread, Event
+from time import monotonic
+
+# Largest datagram the proxy relays
+MAX_DATAGRAM = 65535
+# Socket receive buffer, so that bursts of large datagrams are not dropped before the proxy sees them
+RCVBUF_SIZE = 4 * 1024 * 1024
+
+"""
+    Description
+    -----------
+    Impairments of one direction of a link, in the spirit of `tc netem`.
+
+    Every datagram is dropped with probability `loss`, otherwise it waits for
+    its turn on a link of `rate` bits per second (when set), then for `delay`
+    plus a uniform random jitter in [-jitter, +jitter]. With probability
+    `reorder` a datagram is held back `reorder_delay` seconds longer so that
+    the ones behind it overtake it. Jitter larger than the gap between two
+    datagrams reorders them as well.
+
+    Parameters
+    ----------
+    delay : One-way delay in seconds.
+    jitter : Maximum deviation from the delay in seconds.
+    loss : Probability (0-1) that a datagram is dropped.
+    reorder : Probability (0-1) that a datagram is held back.
+    reorder_delay : Extra delay of held back datagrams in seconds.
+    rate : Link speed in bits per second, None for unlimited.
+    queue : Datagrams that may wait for the link before new ones are dropped
+        (tail drop), None for unlimited. Only used together with `rate`.
+"""
+class Link:
+
+    def __init__(self, delay: float=0.0, jitter: float=0.0, loss: float=0.0, reorder: float=0.0, reorder_delay: float=0.005, rate: float=None, queue: int=None):
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.rate = rate
+        self.queue = queue
+        self.busy_until = 0.0 # When the link has sent everything queued so far
+        self.backlog = deque() # Finish times of the datagrams waiting for the link
+        self.forwarded = 0
+        self.dropped = 0
+
+    # A fresh Link with the same settings, for the other direction
+    def copy(self):
+        return Link(self.delay, self.jitter, self.loss, self.reorder, self.reorder_delay, self.rate, self.queue)
+
+    # When a datagram of `size` bytes arriving at `now` leaves the link, None if it is dropped
+    def schedule(self, size: int, now: float, rng: random.Random):
+        if self.loss and rng.random() < self.loss:
+            self.dropped += 1
+            return None
+        sent = now
+        if self.rate:
+            while self.backlog and self.backlog[0] <= now:
+                self.backlog.popleft()
+            if self.queue is not None and len(self.backlog) >= self.queue:
+                self.dropped += 1 # Queue overflow
+                return None
+            self.busy_until = max(now, self.busy_until) + size * 8 / self.rate
+            self.backlog.append(self.busy_until)
+            sent = self.busy_until
+        release = sent + self.delay
+        if self.jitter:
+            release += rng.uniform(-self.jitter, self.jitter)
+        if self.reorder and rng.random() < self.reorder:
+            release += self.reorder_delay
+        self.forwarded += 1
+        return max(release, now)
+
+
+"""
+    Description
+    -----------
+    UDP relay that sits between a DRTP client and server and impairs the
+    traffic in both directions, so that lossy and slow networks can be tested
+    on loopback without mininet, root or `tc netem`.
+
+    Clients send to the proxy address instead of the server. Every client
+    address gets its own upstream socket (like a NAT), so the server sees one
+    peer per client and replies find their way back, also with parallel
+    streams. The relay runs in a background thread of the calling process.
+
+    Parameters
+    ----------
+    target : (ip, port) of the server.
+    forward : Link used for client -> server datagrams.
+    reverse : Link used for server -> client datagrams, by default a copy of
+        `forward`.
+    ip, port : Address the proxy listens on, port 0 picks a free one.
+    seed : Seed for the random drops, jitter and reordering.
+
+    Attributes
+    ----------
+    address : (ip, port) clients should send to, valid after start().
+"""
+class ImpairmentProxy:
+
+    def __init__(self, target: tuple, forward: Link=None, reverse: Link=None, ip: str='127.0.0.1', port: int=0, seed: int=None):
+        self.target = target
+        self.forward = forward or Link()
+        self.reverse = reverse or self.forward.copy()
+        self.rng = random.Random(seed)
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self.sock.setsockopt(SOL_SOCKET, SO_RCVBUF, RCVBUF_SIZE)
+        self.sock.bind((ip, port))
+        self.address = self.sock.getsockname()
+        self.upstream = {} # client address -> socket towards the server
+        self.clients = {} # upstream socket -> client address
+        self.pending = [] # heap of (release time, counter, socket, datagram, address)
+        self.counter = 0
+        self.stopped = Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        for sock in self.clients:
+            sock.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Datagrams forwarded and dropped per direction
+    def stats(self):
+        return {
+            'forwarded': self.forward.forwarded, 'dropped': self.forward.dropped,
+            'reverse_forwarded': self.reverse.forwarded, 'reverse_dropped': self.reverse.dropped,
+        }
+
+    # Queue a datagram for sending through `sock` to `addr` once `link` lets it go
+    def relay(self, link: Link, sock: socket, data: bytes, addr: tuple, now: float):
+        release = link.schedule(len(data), now, self.rng)
+        if release is not None:
+            self.counter += 1
+            heapq.heappush(self.pending, (release, self.counter, sock, data, addr))
+
+    def run(self):
+        with DefaultSelector() as sel:
+            sel.register(self.sock, EVENT_READ)
+            while not self.stopped.is_set():
+                # Sleep until a datagram arrives or the next one is due, wake up regularly to notice stop()
+                timeout = 0.1
+                if self.pending:
+                    timeout = min(timeout, max(0.0, self.pending[0][0] - monotonic()))
+                for key, _ in sel.select(timeout):
+                    sock = key.fileobj
+                    try:
+                        data, addr = sock.recvfrom(MAX_DATAGRAM)
+                    except OSError: # e.g. ICMP port unreachable from a peer that is gone
+                        continue
+                    now = monotonic()
+                    if sock is self.sock: # Client -> server
+                        up = self.upstream.get(addr)
+                        if up is None:
+                            up = socket(AF_INET, SOCK_DGRAM)
+                            up.setsockopt(SOL_SOCKET, SO_RCVBUF, RCVBUF_SIZE)
+                            up.bind((self.address[0], 0))
+                            self.upstream[addr] = up
+                            self.clients[up] = addr
+                            sel.register(up, EVENT_READ)
+                        self.relay(self.forward, up, data, self.target, now)
+                    else: # Server -> client
+                        self.relay(self.reverse, self.sock, data, self.clients[sock], now)
+                # Send everything that is due
+                now = monotonic()
+                while self.pending and self.pending[0][0] <= now:
+                    _, _, sock, data, addr = heapq.heappop(self.pending)
+                    try:
+                        sock.sendto(data, addr)
+                    except OSError:
+                        pass
@@ -0,0 +1,107 @@
+"""
+    Description
+    -----------
+    Resumable transfers. A client that sends FLAG_RESUME identifies its file
+    with an id and its size (RESUME_OPTION). The server keeps a checkpoint
+    per id: the output file and how many bytes of it are durably written.
+    When the same file is sent again after a failure, the SYN-ACK returns
+    that offset and the client sends only the rest. The FIN then carries a
+    SHA-256 digest of the whole file, which the server checks against what
+    it wrote, old and new bytes alike.
+"""
+import hashlib
+import json
+import os
+
+# A checkpoint is written every time this many more bytes have reached the disk
+CHECKPOINT_BYTES = 16 * 1024 * 1024
+# Bytes read at a time when hashing a file
+HASH_CHUNK = 1024 * 1024
+# Size of the digest carried in the FIN
+DIGEST_LEN = hashlib.sha256().digest_size
+
+# Id of the file at `path`, the same as long as its name, size and modification time are
+def file_id(path: str):
+    st = os.stat(path)
+    key = f'{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}'.encode()
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], 'big')
+
+# SHA-256 object fed with the first `length` bytes of the file at `path` (all of it for None)
+def file_digest(path: str, length: int=None):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while length is None or length > 0:
+            chunk = f.read(HASH_CHUNK if length is None else min(HASH_CHUNK, length))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if length is not None:
+                length -= len(chunk)
+    return digest
+
+
+"""
+    Description
+    -----------
+    Server-side record of how far a resumable transfer got, kept as a small
+    JSON file named after the file id in `directory`, so that it survives a
+    restart of the server. save() replaces it atomically and flushes it to
+    disk; the caller must have flushed the data up to `offset` first.
+
+    Parameters
+    ----------
+    directory : Where the checkpoint files are kept.
+    fid : File id from the client's RESUME_OPTION.
+    size : File size from the client's RESUME_OPTION.
+    outfile : Output file the transfer writes to.
+    offset : Bytes at the start of outfile that are durably written.
+"""
+class Checkpoint:
+
+    def __init__(self, directory: str, fid: int, size: int, outfile: str, offset: int=0):
+        self.directory = directory
+        self.fid = fid
+        self.size = size
+        self.outfile = outfile
+        self.offset = offset
+        self.path = os.path.join(directory, f'.drtp-{fid:016x}.ckpt')
+
+    """
+        Description
+        -----------
+        Find the checkpoint of file `fid` in `directory`.
+
+        Returns
+        -------
+        checkpoint : The Checkpoint, or None if there is none, it cannot be
+            read, it belongs to a file of another size, or its output file 
+            is shorter than the checkpoint says.
+    """
+    @classmethod
+    def load(cls, directory: str, fid: int, size: int):
+        ckpt = cls(directory, fid, size, None)
+        try:
+            with open(ckpt.path) as f:
+                state = json.load(f)
+            if state['size'] != size or os.path.getsize(state['outfile']) < state['offset']:
+                return None
+        except (OSError, ValueError, KeyError, TypeError): # Unreadable, or not the JSON object save() writes
+            return None
+        ckpt.outfile, ckpt.offset = state['outfile'], state['offset']
+        return ckpt
+
+    def save(self, offset: int):
+        self.offset = offset
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'size': self.size, 'outfile': self.outfile, 'offset': offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    # Forget the checkpoint once the file is complete (or must be sent again from the start)
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -1,5 +1,29 @@
+import os
 from drtp import *
-from socket import socket, AF_INET, SOCK_DGRAM, timeout as sock_timeout
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_REUSEPORT, SO_RCVBUF, SO_RCVTIMEO, MSG_DONTWAIT, timeout as sock_timeout
+from time import monotonic
+from select import select
+from selectors import DefaultSelector, EVENT_READ
+from multiprocessing import Process, Queue
+from metrics import TransferMetrics, append_jsonl
+from resume import Checkpoint, CHECKPOINT_BYTES, DIGEST_LEN, file_digest
+from compression import Decompressor
+from fec import FecDecoder
+from batch import BatchWriter
+from delta import Basis, DeltaDecoder
+from client import Sender
+from queue import Empty
+from struct import Struct
+
+# Receive buffer the server asks for, so that a window of large packets fits (the kernel caps it at net.core.rmem_max)
+RCVBUF_SIZE = 4 * 1024 * 1024
+# struct timeval of SO_RCVTIMEO: seconds and microseconds
+RCVTIMEO = Struct('@ll')
+
+# Largest window up to `window` whose datagrams fit in the socket's receive buffer at once. 
+# Linux reports twice the usable size, the other half covers its bookkeeping, so only half is counted.
+def fit_window(sock: socket, window: int, datagram: int):
+    return max(1, min(window, sock.getsockopt(SOL_SOCKET, SO_RCVBUF) // 2 // datagram))
 
 """
     Description
@@ -10,45 +34,92 @@ from socket import socket, AF_INET, SOCK_DGRAM, timeout as sock_timeout
     and waits for an ACK to complete the handshake. If the ACK is not received,
     the server will resend the SYN-ACK up to a maximum number of retries.
 
+    With FLAG_EXT agreed the client's window comes with the SYN and the 
+    agreed one goes back with the SYN-ACK, both in WINDOW_OPTION, so a 
+    window past the 16-bit window field of the header is agreed in full.
+    Otherwise the client's window arrives in the ACK.
+
     Parameters
     ----------
     sock : Bound UDP socket.
     rcv_window : Server-advertised receive window (packets).
+    features : Feature flags (FLAG_EXT, FLAG_SR, ...) the server is willing to use.
+    rtt : RTT estimator whose RTO times the SYN-ACK retransmissions. The 
+        SYN-ACK/ACK exchange gives an RTT sample when the SYN-ACK was not resent.
     max_retry : Maximum SYN ACK retransmissions before giving up.
+    mss : Largest payload per DATA packet the server accepts. A client that
+        sends FLAG_MSS gets the smaller of its offer and this in the SYN-ACK.
+    resume : Called with the file id and size of a client that offers 
+        FLAG_RESUME, returns the byte offset the client continues from. 
+        Without it FLAG_RESUME is not agreed.
+    delta : Called when a client offers FLAG_DELTA, returns the delta.Basis
+        of the file the client's data replaces, or None when there is no
+        copy to build on. Without it FLAG_DELTA is not agreed.
 
     Returns
     -------
     client_addr : Address of the client that successfully completed the handshake.
     agreed_wnd : Advertised window agreed on.
+    agreed_features : Features offered by the client that the server supports.
+        A legacy client offers none and gets the 8-byte header.
+    agreed_mss : Payload bytes per DATA packet, DATA_LEN without FLAG_MSS.
 """
-def handshake_server(sock: socket, rcv_window: int=15, max_retry: int=5):
+def handshake_server(sock: socket, rcv_window: int=15, features: int=FLAG_EXT | FLAG_SR | FLAG_MSS | FLAG_RESUME | FLAG_COMPRESS | FLAG_FEC | FLAG_BATCH | FLAG_DELTA, rtt: RttEstimator=None, max_retry: int=5, mss: int=MAX_MSS, resume=None, delta=None):
+    rtt = rtt or RttEstimator()
     while True:
-        # Here we receive the packet and check if its only the length of header. 
-        data, client_addr = sock.recvfrom(HEADER_LEN)
-        if len(data) != HEADER_LEN:
+        sock.settimeout(None) # Block until a client shows up
+        # The SYN may carry options, and is padded to full packet size when the client probes the path MTU
+        data, client_addr = sock.recvfrom(MAX_DATAGRAM)
+        if len(data) < HEADER_LEN:
             continue
 
-        _, _, c_flags, _ = parse_header(data) # Parses packet header
+        _, _, c_flags, _ = parse_header(data[:HEADER_LEN]) # Parses packet header
 
         # Ignore anything that is not a bare SYN
         if not (c_flags & FLAG_SYN) or (c_flags & FLAG_ACK): # Used AI for this IF-test
             continue          # stay in the loop and wait for a real SYN
         
-        print(f'SYN packet is received seq')
+        info(f'SYN packet is received seq')
+
+        agreed_features = c_flags & features # Only echo features we both support
+        agreed_mss, option = DATA_LEN, b''
+        offered = read_option(data, c_flags, FLAG_MSS)
+        if agreed_features & FLAG_MSS and offered:
+            agreed_mss = min(offered[0], mss)
+            option = MSS_OPTION.pack(agreed_mss)
+        else:
+            agreed_features &= ~FLAG_MSS
+        offered = read_option(data, c_flags, FLAG_RESUME)
+        if agreed_features & FLAG_RESUME and offered and resume and not agreed_features & FLAG_BATCH: # Batches are not resumable
+            fid, size = offered
+            option += RESUME_OPTION.pack(fid, resume(fid, size))
+        else:
+            agreed_features &= ~FLAG_RESUME
+        # A delta replaces a whole file, so it is neither resumed nor part of a batch
+        if not (agreed_features & FLAG_DELTA and delta and not agreed_features & (FLAG_RESUME | FLAG_BATCH) and delta()):
+            agreed_features &= ~FLAG_DELTA
+        window = fit_window(sock, rcv_window, EXT_HEADER_LEN + agreed_mss) # Large packets, fewer of them
+        offered = read_option(data, c_flags, FLAG_EXT)
+        client_window = offered[0] if agreed_features & FLAG_EXT and offered else None
+        if client_window is not None: # The window is agreed on here and sent in full
+            window = min(window, client_window)
+            option += WINDOW_OPTION.pack(window)
 
         # Makes a packet with a SYN ACK flag with our standard receiving window
-        synack_pkt = make_packet(0, 0 , FLAG_SYN | FLAG_ACK, rcv_window)
+        synack_pkt = make_packet(0, 0 , FLAG_SYN | FLAG_ACK | agreed_features, min(window, max_window(0)), option)
         
-        sock.settimeout(0.4) # Sets timeout for if we dont receive an ACK
         retries = 0
         while retries < max_retry:
             sock.sendto(synack_pkt, client_addr) # Send SYN-ACK packet
-            print(f'SYN-ACK packet is sent seq')
+            sent_at = monotonic()
+            info(f'SYN-ACK packet is sent seq')
+            sock.settimeout(rtt.rto) # Sets timeout for if we dont receive an ACK
             try:
                 data, addr = sock.recvfrom(HEADER_LEN) # Receive packet from client 
             except sock_timeout: # If no packet is recieved from client we resend the SYN-ACK
                 retries += 1
-                print('Timeout - resend SYN-ACK')
+                rtt.backoff()
+                info('Timeout - resend SYN-ACK')
                 continue # Resend SYN-ACK by doing continue
             
             # If the address from the received packet is not the client address from the first packet we try again.
@@ -58,25 +129,399 @@ def handshake_server(sock: socket, rcv_window: int=15, max_retry: int=5):
             _, _, c_flags2, c_wnd = parse_header(data) # Parse packet
             wanted_flags = FLAG_ACK  # The flag we want 
             if(c_flags2 & wanted_flags) == wanted_flags: # Checks if the packet as the flag (used AI for this IF-test)
-                print(f'ACK packet is received')  # Restore blocking mode
+                info(f'ACK packet is received')  # Restore blocking mode
+                if retries == 0: # Karn's rule: skip the sample if the SYN-ACK was resent
+                    rtt.sample(monotonic() - sent_at)
                 sock.settimeout(None) # Remove timer       
-                agreed_wnd = min(rcv_window, c_wnd)   
-                print('Connection established')
-                return client_addr, agreed_wnd
+                agreed_wnd = window if client_window is not None else min(window, c_wnd)
+                info('Connection established')
+                return client_addr, agreed_wnd, agreed_features, agreed_mss
         # Raises an RuntimeError if we retry more than max_retry 
         raise RuntimeError('Client did not finish handshake')
 
 
+# In-order payloads are collected and written to disk in chunks of this many bytes
+WRITE_BUFFER_SIZE = 256 * 1024
+# Go-Back-N receivers send one cumulative ACK per this many in-order packets...
+ACK_EVERY = 2
+# ...or once the oldest unacknowledged packet has waited this long (seconds), well below MIN_RTO
+ACK_DELAY = 0.005
+# Transfers that hear nothing from their client for this long are given up (seconds)
+SESSION_IDLE_TIMEOUT = 30.0
+
+"""
+    Description
+    -----------
+    Data-phase state of one connection: reassembles the packets of a single 
+    client and writes their payloads to outfile.
+
+    Implements Go-Back-N, re-acknowledging the last in-order packet at once
+    whenever a packet arrives ahead of a gap, so the sender can fast 
+    retransmit. Packets ahead of the gap are kept and written out once it is
+    filled, so only the missing one has to be resent, and copies of packets
+    already delivered only get the delayed ACK. With FLAG_SR agreed in the
+    handshake it implements Selective Repeat instead: packets inside 
+    the receive window are then buffered and acknowledged individually, and 
+    written out once the gap before them is filled. A packet carrying the FIN
+    flag ends the transfer and is answered with FIN-ACK.
+
+    The receiver does no socket reads itself, packets are fed to on_packet,
+    so the same code serves the blocking single-client receive() and the
+    multi-client serve(). Packets may be memoryviews into a receive buffer 
+    that the caller reuses: payloads are copied exactly once, either into 
+    the write buffer, which is flushed with one pwrite per WRITE_BUFFER_SIZE
+    bytes, or into a preallocated slot while they wait for a gap to fill.
+
+    Parameters
+    ----------
+    sock : Bound UDP socket, used for sending ACKs.
+    client_addr : IP/port tuple identifying the client accepted by the handshake.
+    start_pkt : Sequence number expected for the first data packet.
+    rcv_window : Size of the advertised receive window (in packets).
+    discard_seq : Optional sequence number to intentionally lose once per session.
+    outfile : File path where incoming payload bytes are written, with 
+        FLAG_BATCH the directory the files of the batch are written to.
+    features : Feature flags agreed on in the handshake. Without FLAG_EXT 
+        sequence numbers wrap around at 16 bits on the wire, with FLAG_SR 
+        Selective Repeat is used instead of Go-Back-N.
+    offset : Byte offset in outfile where the first payload is written. 
+        Parallel streams of one file each write their own range.
+    truncate : Empty outfile first. False for a stream of a parallel transfer,
+        whose file has been preallocated and is shared with the other streams.
+    metrics : TransferMetrics that counts received, duplicate, out-of-order
+        and discarded packets and the goodput of this transfer.
+    clock : Returns the current time for the metrics, the simulator passes
+        its virtual clock.
+    mss : Payload bytes per DATA packet agreed in the handshake.
+    ack_every : Go-Back-N: acknowledge every ack_every in-order packets with
+        one cumulative ACK. Capped at half the window so the sender never
+        waits for the timer with a full window.
+    ack_delay : Go-Back-N: longest time (seconds) an in-order packet waits
+        for its ACK. The caller drives this timer with next_deadline() and
+        poll(). Out-of-order packets are always acknowledged at once.
+    checkpoint : Checkpoint of a resumable transfer (see resume.py), whose
+        offset is `offset`. Every CHECKPOINT_BYTES, and when the receiver is
+        closed before the FIN, the file is synced and the checkpoint saved.
+        The written bytes, including the ones already in the file before
+        `offset`, are hashed and checked against the digest in the FIN; a 
+        mismatch is answered with FLAG_RST in the FIN-ACK.
+    sink : Called with every piece of in-order data, as bytes, instead of
+        writing it to outfile, which is then not opened (see aio.py).
+    basis : With FLAG_DELTA, the existing copy (see delta.py) whose blocks
+        the in-order data refers to. The new file is rebuilt in outfile and
+        hashed as it is written; once the digest in the FIN matches, it
+        replaces the basis, otherwise it is removed and the FIN-ACK carries
+        FLAG_RST.
+
+    With FLAG_COMPRESS the in-order payloads are compressed frames (see
+    compression.py) that are decompressed as they arrive, before they reach
+    the write buffer. Offsets, checkpoints and the digest count file bytes.
+
+    With FLAG_FEC the receiver keeps the payloads of each group until its
+    parity arrives, and rebuilds a single lost packet of the group from it
+    (see fec.py). Go-Back-N then also keeps packets that arrive behind a
+    gap, and holds back the duplicate ACK while the gap's parity may still
+    come.
+
+    With FLAG_BATCH the in-order payloads (decompressed first with
+    FLAG_COMPRESS) are the entries of a batch of files (see batch.py), each
+    written to a file of its own name below outfile. Batches are neither
+    resumable nor split over parallel streams.
+"""
+class Receiver:
+
+    def __init__(self, sock: socket, client_addr: tuple, start_pkt: int, rcv_window: int, discard_seq: int=0, outfile: str='output.jpg', features: int=0, offset: int=0, truncate: bool=True, metrics: TransferMetrics=None, clock=monotonic, mss: int=DATA_LEN, ack_every: int=ACK_EVERY, ack_delay: float=ACK_DELAY, checkpoint: Checkpoint=None, sink=None, basis: Basis=None):
+        # Asigning different variable
+        self.sock = sock
+        self.client_addr = client_addr
+        self.rcv_window = rcv_window
+        self.header = header_for(features) # 8 or 14 byte header
+        self.space = seq_space(features) # Sequence numbers wrap around at this value
+        self.adv_window = min(rcv_window, max_window(features))
+        self.selective = features & FLAG_SR # Selective Repeat instead of Go-Back-N
+        self.expected = start_pkt
+        self.buffered = {} # Selective Repeat: seq -> payload received ahead of expected
+        # One reusable payload buffer per window slot, seq % rcv_window is unique for every
+        # packet that can be buffered at the same time (Go-Back-N keeps packets behind a gap too)
+        self.slots = [bytearray(mss) for _ in range(rcv_window)]
+        self.to_discard = discard_seq 
+        self.metrics = metrics or TransferMetrics('server', client_addr)
+        self.clock = clock
+        self.fin_ack = None # FIN-ACK packet once the FIN has arrived, kept to answer resent FINs
+        self.bufsize = self.header.size + mss # Largest datagram the client sends
+
+        # Positioned writes (os.pwrite) so parallel streams can share the file, a batch opens a file per entry
+        self.sink = sink
+        self.batch = BatchWriter(outfile) if features & FLAG_BATCH and not sink else None
+        self.fd = None if self.batch or sink else os.open(outfile, os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if truncate else 0), 0o644)
+        self.outfile = outfile
+        self.pos = offset # File offset of the next in-order payload
+        self.wbuf = bytearray(WRITE_BUFFER_SIZE) # In-order payloads waiting to be written
+        self.wlen = 0
+        self.checkpoint = checkpoint
+        self.basis = basis
+        # Resumable: hash what an earlier attempt wrote, the rest is hashed as it is written (a delta starts empty)
+        self.digest = file_digest(outfile, offset) if checkpoint or basis else None
+        self.verified = False # The digest in the FIN matched
+        self.ack_buf = bytearray(self.header.size) # Every ACK is packed into this buffer
+        # Delayed ACKs (Go-Back-N only, Selective Repeat ACKs every packet)
+        self.ack_every = max(1, min(ack_every, rcv_window // 2))
+        self.ack_delay = ack_delay
+        self.unacked = 0 # In-order packets received since the last ACK
+        self.ack_deadline = None # When the pending ACK is sent at the latest
+        # In-order payloads go to the write buffer (or the batch's files, or the sink), through the decompressor first
+        write = self.emit if sink else self.batch.feed if self.batch else self.write
+        self.delta = DeltaDecoder(basis, write) if basis else None # Copy instructions are carried out first
+        if self.delta:
+            write = self.delta.feed
+        self.decompressor = Decompressor(write) if features & FLAG_COMPRESS else None
+        self.deliver = self.decompressor.feed if self.decompressor else write
+        self.fec = FecDecoder() if features & FLAG_FEC else None
+
+    # Send an ACK carrying the absolute packet number `ack`
+    def send_ack(self, ack: int):
+        # Making ACK packet, its seq field tells an FEC sender how many packets were rebuilt
+        self.header.pack_into(self.ack_buf, 0, self.metrics.fec_repaired % self.space, ack % self.space, FLAG_ACK, self.adv_window)
+        self.sock.sendto(self.ack_buf, self.client_addr)
+        self.metrics.acks_sent += 1
+        self.unacked = 0 # Every ACK is cumulative, so it covers all pending packets
+        self.ack_deadline = None
+
+    # Send the pending delayed ACK once its timer has run out
+    def poll(self, now: float):
+        if self.ack_deadline is not None and now >= self.ack_deadline:
+            self.send_ack(self.expected - 1)
+
+    # Time the pending delayed ACK is due, or None
+    def next_deadline(self):
+        return self.ack_deadline
+
+    """
+        Description
+        -----------
+        Process one datagram from the client. `data` may be a memoryview of
+        a buffer that is reused after the call returns.
+
+        Returns
+        -------
+        bool : True when the packet was the FIN that ends the transfer.
+    """
+    def on_packet(self, data: bytes):
+        header = self.header
+        if len(data) < header.size: # Must hold a full header
+            return False
+
+        raw_seq, raw_ack, flags, raw_window = header.unpack_from(data) # Parses packet header
+        if flags & (FLAG_SYN | FLAG_ACK): # Leftover handshake packet
+            return False
+        seq = unwrap_seq(raw_seq, self.expected, self.space) # Absolute packet number
+
+        payload = data[header.size:] # Gets payload
+        m = self.metrics
+        if m.data_start is None: # Goodput is timed from the first packet on
+            m.data_started(self.clock())
+
+        if flags & FLAG_FEC: # Parity: seq, ack and window fields hold the group's first packet, size and XORed lengths
+            m.wire_bytes += len(data)
+            if self.fec:
+                self.on_parity(seq, raw_ack, raw_window, payload)
+            return False
+
+        # Discard logic for discarding packet 
+        if seq == self.to_discard:
+            self.to_discard = float('inf') # set to_discard to infinite so it does not discard again
+            m.discarded += 1
+            if trace.enabled:
+                trace.event('discard', seq)
+            return False
+
+        # Connection teardown
+        if flags & FLAG_FIN: # Check if we recieved FIN flag
+            m.data_finished(self.clock())
+            info(f'\nFIN packet is received seq={seq}') 
+            self.flush() # Everything is on disk before the client hears that it arrived
+            fin_flags = FLAG_FIN | FLAG_ACK
+            if self.digest is not None and self.fin_ack is None: # Resumable or delta: the FIN carries the digest of the whole file
+                self.verified = self.digest.digest() == bytes(payload[:DIGEST_LEN])
+                if self.verified:
+                    info('File digest verified')
+                else:
+                    info('File digest mismatch, the client must send the file again')
+            if self.digest is not None and not self.verified:
+                fin_flags |= FLAG_RST
+            if self.checkpoint: # Done either way, a retry starts from the beginning
+                self.checkpoint.remove()
+                self.checkpoint = None
+            self.fin_ack = header.pack(1, raw_seq, fin_flags, self.adv_window) # Making FIN-ACK packet
+            self.sock.sendto(self.fin_ack, self.client_addr) # Sending FIN-ACK packet
+            info(f'FIN-ACK packet is sent')
+            info("Connection closed")
+            return True
+
+        m.packets_received += 1
+        m.wire_bytes += len(data)
+        group = 0
+        if self.fec:
+            if self.fec.add(seq, payload, seq >= self.expected): # Needed to rebuild another packet of its group
+                m.fec_repaired -= 1 # Rebuilt before it came in late, it was not lost
+            group = unwrap_seq(raw_ack, seq, self.space)
+        self.accept(seq, payload, group)
+        if m.interval: # Receive window occupancy: packets kept ahead of a gap
+            m.tick(self.clock(), len(self.buffered))
+        return False
+
+    # Deliver or keep the DATA packet `seq` and acknowledge it, `group` is the first seq of its FEC group
+    def accept(self, seq: int, payload, group: int=0):
+        m = self.metrics
+        expected = self.expected
+        if self.selective:
+            if expected <= seq < expected + self.rcv_window: # Inside the receive window
+                if trace.enabled:
+                    trace.event('recv', seq)
+                if seq in self.buffered:
+                    m.duplicates += 1
+                else:
+                    if seq > expected:
+                        m.out_of_order += 1
+                    self.keep(seq, payload)
+                while self.expected in self.buffered: # Deliver everything that is now in order
+                    self.deliver(self.buffered.pop(self.expected))
+                    self.expected += 1
+            elif expected - self.rcv_window <= seq < expected: # A resend of something we ACKed
+                m.duplicates += 1
+            else:
+                return
+            # ACK this packet alone, also when it is a resend whose first ACK was lost
+            self.send_ack(seq)
+            if trace.enabled:
+                trace.event('ack_sent', seq)
+        elif seq == expected: # Checks if the seq number is the same as we expected                    
+            self.deliver(payload) # Write to outfile
+            self.expected += 1 
+            self.unacked += 1
+            while self.expected in self.buffered: # Packets kept while the one before them was missing
+                self.deliver(self.buffered.pop(self.expected))
+                self.expected += 1
+                self.unacked += 1
+            if self.unacked >= self.ack_every: # One cumulative ACK for the last ack_every packets
+                self.send_ack(self.expected - 1)
+            elif self.ack_deadline is None: # First unacknowledged packet starts the delay timer
+                self.ack_deadline = self.clock() + self.ack_delay
+            if trace.enabled:
+                trace.event('recv', seq)
+        elif seq < expected: # A resend or a late copy of something already delivered, the delayed ACK covers it
+            m.duplicates += 1
+            if self.ack_deadline is None: # Immediate duplicate ACKs would set off a spurious fast retransmit
+                self.ack_deadline = self.clock() + self.ack_delay
+        else: # If seq number is not what we expected 
+            if expected < seq < expected + self.rcv_window and seq not in self.buffered:
+                self.keep(seq, payload) # Delivered once `expected` is resent (or rebuilt from the parity)
+                if self.fec and self.fec.done <= group <= expected: # Same group as the gap: hold the duplicate ACK until its parity is in
+                    m.out_of_order += 1
+                    if trace.enabled:
+                        trace.event('out_of_order', seq, expected)
+                    return
+            # Repeats the ACK for the last in-order packet at once, 
+            # the duplicate ACKs tell the sender that `expected` went missing
+            self.send_ack(expected - 1)
+            m.out_of_order += 1
+            if trace.enabled:
+                trace.event('out_of_order', seq, expected)
+
+    # Copy a payload that arrived ahead of `expected` into its slot, the receive buffer is reused
+    def keep(self, seq: int, payload):
+        slot = self.slots[seq % self.rcv_window]
+        slot[:len(payload)] = payload
+        self.buffered[seq] = memoryview(slot)[:len(payload)]
+
+    # Rebuild the one lost packet of the `count` packets from `start` on from their parity
+    def on_parity(self, start: int, count: int, lengths: int, parity):
+        missing, payload = self.fec.repair(start, count, lengths, parity)
+        if payload is not None and missing[0] >= self.expected and missing[0] not in self.buffered:
+            self.metrics.fec_repaired += 1
+            if trace.enabled:
+                trace.event('fec_repair', missing[0])
+            self.accept(missing[0], payload, start)
+        elif not self.selective and start <= self.expected < start + count:
+            self.send_ack(self.expected - 1) # Go-Back-N: the gap cannot be rebuilt, ask for a resend now
+
+    # Append an in-order payload to the write buffer, flushing it when full
+    def write(self, payload):
+        size = len(payload)
+        if self.wlen + size > len(self.wbuf):
+            self.flush()
+        self.wbuf[self.wlen:self.wlen + size] = payload
+        self.wlen += size
+        self.metrics.payload_bytes += size
+
+    # Hand in-order data to the sink, as bytes of its own since payloads may sit in a reused buffer
+    def emit(self, data):
+        self.metrics.payload_bytes += len(data)
+        self.sink(bytes(data))
+
+    # Write the buffered payloads to the file with a single positioned write
+    def flush(self):
+        if self.wlen:
+            with memoryview(self.wbuf) as view:
+                os.pwrite(self.fd, view[:self.wlen], self.pos)
+                if self.digest is not None:
+                    self.digest.update(view[:self.wlen])
+            self.pos += self.wlen
+            self.wlen = 0
+            if self.checkpoint and self.pos - self.checkpoint.offset >= CHECKPOINT_BYTES:
+                self.save_checkpoint()
+
+    # Make everything written so far durable, then record how far that is
+    def save_checkpoint(self):
+        os.fsync(self.fd)
+        self.checkpoint.save(self.pos)
+
+    # Close the output file and print the measured throughput in Mbps
+    def close(self):
+        self.flush()
+        if self.checkpoint: # Closed before the FIN, a reconnecting client continues from here
+            self.save_checkpoint()
+            info(f'Checkpoint saved at byte {self.pos}')
+        m = self.metrics
+        if self.batch:
+            self.batch.close()
+            m.payload_bytes = self.batch.file_bytes
+            info(f'{self.batch.received} files written to {self.batch.directory}')
+        elif self.fd is not None:
+            os.close(self.fd)
+        if self.delta:
+            self.delta.close()
+            m.delta_bytes = self.delta.consumed
+            if self.verified: # The rebuilt file takes the place of the old copy
+                os.replace(self.outfile, self.basis.path)
+                info(f'{self.delta.copied} of {m.payload_bytes} bytes copied from the existing {self.basis.path}')
+            else:
+                os.remove(self.outfile)
+                info(f'The new file was not verified, {self.basis.path} is left as it was')
+        if m.data_end is None: # Closed without a FIN
+            m.data_finished(self.clock())
+        # Goodput counts file bytes only, from the first to the last packet
+        if self.decompressor:
+            m.compressed_bytes = self.decompressor.consumed
+        if m.payload_bytes:
+            info(f'The throughput is {m.goodput_mbps:.2f} Mbps ({m.throughput_mbps:.2f} Mbps including headers and resends)')
+            if m.compressed_bytes:
+                info(f'Compressed to {m.compressed_bytes / m.payload_bytes:.1%} of {m.payload_bytes} bytes')
+        info('Connection Closes')
+
 """
     Description
     -----------
     Receive a contiguous sequence of packets from client and write their
-    payloads to outfile.
+    payloads to outfile, using a Receiver (see above for the Go-Back-N and
+    Selective Repeat details). The transfer stops when a packet carrying the
+    FIN flag is received, at which point the server replies with FIN-ACK
+    and closes the connection. At the end of a successful session the function
+    prints the measured throughput in Mbps.
 
-    The routine implements Go-Back-N. The transfer stops when a packet 
-    carrying the FIN flag is received, at which point the server replies with FIN-ACK
-    and closes the connection. At the end of a successful session the function prints 
-    the measured throughput in Mbps.
+    A client that stays silent for idle_timeout seconds is given up on: what
+    arrived is written out and, for a resumable transfer, checkpointed, so
+    the client can continue once it reconnects.
 
     Parameters
     ----------
@@ -86,84 +531,156 @@ def handshake_server(sock: socket, rcv_window: int=15, max_retry: int=5):
     rcv_window : Size of the advertised receive window (in packets).
     discard_seq : Optional sequence number to intentionally lose once per session.
     outfile : File path where incoming payload bytes are written.
+    features : Feature flags agreed on in the handshake.
+    metrics : TransferMetrics to fill in, see Receiver.
+    mss : Payload bytes per DATA packet agreed in the handshake.
+    ack_every, ack_delay : Delayed ACK policy, see Receiver.
+    checkpoint : Checkpoint of a resumable transfer, the data is written from
+        its offset on, see Receiver.
+    basis : Existing copy a delta transfer (FLAG_DELTA) builds on, see Receiver.
+    idle_timeout : Seconds without a packet from the client before the 
+        transfer is given up.
 
     Returns
     -------
     bool : True when the file transfer finishes successfully and the connection
-        is torn down.
+        is torn down, False when the client went silent.
 """
-def receive(sock: socket, client_addr: tuple, start_pkt: int, rcv_window: int, discard_seq: int=0, outfile: str='output.jpg'):
-    
-    # Asigning different variable
-    expected = start_pkt
-    to_discard = discard_seq 
-    total_bytes = 0
-    
-    t_start = timestamp() # Timer for throughput calculation 
-
-    # Opens outfile with 'with open' to ensure that the file descriptor closes
-    with open(outfile, 'wb') as out:
+def receive(sock: socket, client_addr: tuple, start_pkt: int, rcv_window: int, discard_seq: int=0, outfile: str='output.jpg', features: int=0, metrics: TransferMetrics=None, mss: int=DATA_LEN, ack_every: int=ACK_EVERY, ack_delay: float=ACK_DELAY, checkpoint: Checkpoint=None, basis: Basis=None, idle_timeout: float=SESSION_IDLE_TIMEOUT):
+    offset = checkpoint.offset if checkpoint else 0
+    rx = Receiver(sock, client_addr, start_pkt, rcv_window, discard_seq, outfile, features, offset, not offset, metrics, mss=mss,
+                  ack_every=ack_every, ack_delay=ack_delay, checkpoint=checkpoint, basis=basis)
+    buf = bytearray(rx.bufsize) # Every datagram is received into this buffer
+    view = memoryview(buf)
+    # A blocking read gives up once nothing arrived for this long. SO_RCVTIMEO rather than settimeout(),
+    # which would poll before every read and make the MSG_DONTWAIT reads below wait as well
+    sock.setsockopt(SOL_SOCKET, SO_RCVTIMEO, RCVTIMEO.pack(int(idle_timeout), int(idle_timeout % 1 * 1e6)))
+    heard = monotonic() # Last packet from the client
+    try:
         while True:
-            data, addr = sock.recvfrom(HEADER_LEN + DATA_LEN) # Waits for packet from client
-
+            if rx.ack_deadline is None:
+                try:
+                    n, addr = sock.recvfrom_into(buf) # Waits for packet from client
+                except BlockingIOError: # SO_RCVTIMEO expired
+                    addr = None
+            else: # An ACK is pending: read what is queued, wait no longer than its timer
+                try:
+                    n, addr = sock.recvfrom_into(buf, 0, MSG_DONTWAIT)
+                except BlockingIOError:
+                    if not select([sock], [], [], max(0, rx.ack_deadline - monotonic()))[0]:
+                        rx.poll(monotonic())
+                    continue
             if addr != client_addr: # Check if address form packet is same as clients 
+                if monotonic() - heard >= idle_timeout:
+                    info(f'Nothing from the client for {idle_timeout:g} s, giving up on the transfer')
+                    return False # The Receiver is closed below, which writes a checkpoint
                 continue
+            heard = monotonic()
+            if rx.on_packet(view[:n]):
+                break # Break out of while loop
+    finally:
+        sock.setsockopt(SOL_SOCKET, SO_RCVTIMEO, RCVTIMEO.pack(0, 0))
+        rx.close()
+    return True
 
-            seq, _, flags, _ = parse_header(data[:HEADER_LEN]) # Parses packet header
-
-            payload = data[HEADER_LEN:] # Gets payload
-            packet_bytes = len(data) # Total bytes of packet  
+"""
+    Description
+    -----------
+    Send the block signature of the basis of a delta transfer (FLAG_DELTA)
+    to the client right after the handshake, before its data phase. This is
+    a data phase in the other direction, run by the client's Sender with 
+    plain DATA packets, and closed by a FIN. The client answers with a 
+    FIN-ACK, but its first DATA packet says as much if that is lost.
 
-            # Discard logic for discarding packet 
-            if seq == to_discard:
-                to_discard = float('inf') # set to_discard to infinite so it does not discard again
-                continue 
+    Parameters
+    ----------
+    sock : Bound UDP socket.
+    client_addr : IP/port tuple of the client accepted by the handshake.
+    rcv_window : Window agreed on in the handshake.
+    features : Feature flags agreed on, only FLAG_EXT and FLAG_SR apply.
+    signature : The signature bytes, see delta.Basis.signature().
+    mss : Payload bytes per DATA packet agreed in the handshake.
+    rtt : RTT estimator whose RTO times the resends.
+    max_retry : Maximum FIN retransmissions before giving up.
 
-            # Connection teardown
-            if flags & FLAG_FIN: # Check if we recieved FIN flag
-                print(f'\nFIN packet is received seq={seq}') 
-                fin_ack = make_packet(1, seq, FLAG_FIN | FLAG_ACK, rcv_window) # Making FIN-ACK packet
-                sock.sendto(fin_ack, client_addr) # Sending FIN-ACK packet
-                print(f'FIN-ACK packet is sent')
-                print("Connection closed")
-                break # Break out of while loop
+    Raises
+    ------
+    RuntimeError
+        If the client never acknowledges the FIN.
+"""
+def send_signature(sock: socket, client_addr: tuple, rcv_window: int, features: int, signature: bytes, mss: int=DATA_LEN, rtt: RttEstimator=None, max_retry: int=5):
+    info(f'\nSending the block signature ({len(signature)} bytes)\n')
+    rtt = rtt or RttEstimator()
+    features &= FLAG_EXT | FLAG_SR
+    sender = Sender(sock, client_addr, 1, rcv_window, signature, features, rtt, metrics=TransferMetrics('server', client_addr), mss=mss)
+    sender.start(monotonic())
+    header = sender.header
+    while not sender.done:
+        timeout = sender.next_deadline() - monotonic()
+        if timeout <= 0: # A timer is already due
+            sender.poll(monotonic())
+            continue
+        sock.settimeout(timeout)
+        try:
+            data, addr = sock.recvfrom(header.size)
+        except sock_timeout:
+            sender.poll(monotonic())
+            continue
+        if addr == client_addr:
+            sender.handle(data, monotonic())
 
-            if seq == expected: # Checks if the seq number is the same as we expected                    
-                log(f"packet {seq} is received")
-                out.write(payload) # Write to outfile
-                total_bytes += packet_bytes # Counting total bytes
-                expected += 1 
-                ack = seq
-
-                ack_pkt = make_packet(0, ack, FLAG_ACK, rcv_window) # Making ACK packet
-                sock.sendto(ack_pkt, client_addr) 
-                log(f'Sending ack for the received {ack}')
-            else: # If seq number is not what we expected 
-                log(f'Out-of-order packet {seq} is received (expected {expected})')
-                continue # Drops packet and wait for the correct one
-        # Throughput calcuation
-        if t_start is not None and total_bytes:
-            t_end = timestamp()
-            # To calcuated the total time it took to recieve all the packets
-            duration_seconds = (t_end - t_start).total_seconds() 
-            throughput_mbps = (total_bytes * 8) / (1e6 * duration_seconds)
-            print(f'The throughput is {throughput_mbps:.2f} Mbps')
-        print('Connection Closes')
-        return True;   
+    seq = sender.final_seq % sender.space
+    fin_pkt = header.pack(seq, 0, FLAG_FIN, 0)
+    try:
+        for _ in range(max_retry):
+            sock.sendto(fin_pkt, client_addr)
+            sock.settimeout(rtt.rto)
+            try:
+                data, addr = sock.recvfrom(header.size)
+            except sock_timeout:
+                rtt.backoff()
+                continue
+            if addr != client_addr or len(data) < header.size:
+                continue
+            _, c_ack, c_flags, _ = header.unpack_from(data)
+            if c_flags & FLAG_FIN and c_flags & FLAG_ACK and c_ack == seq:
+                return
+            if not c_flags & (FLAG_SYN | FLAG_ACK): # DATA: the client has moved on, its FIN-ACK was lost
+                return
+    finally:
+        sock.settimeout(None) # receive() blocks on the socket
+    raise RuntimeError('Client did not acknowledge the block signature')
 
 """
     Description
     -----------
     Run a single-file UDP transfer service. The function binds a UDP socket to the 
     given ip-address and port, accepts exactly one client via a three-way handshake, 
-    receives the file using the Go-Back-N protocol, and then terminates.
+    receives the file using Go-Back-N or Selective Repeat, and then terminates.
 
     Parameters
     ----------
     ip : Local IP address to bind the listening socket to.
-    port : UDP port number to listen on.
+    port : UDP port number to listen on, 0 for any free port.
     discard : Sequence number to drop intentionally once per session for 
     retransmission testing.  
+    outfile : File path where the received file is written.
+    metrics_path : Write the transfer metrics here as a JSON line when the
+        transfer ends.
+    mss : Largest payload per DATA packet accepted, see handshake_server.
+    ack_every, ack_delay : Delayed ACK policy, see Receiver.
+    checkpoint_dir : Directory for the checkpoints of resumable transfers. A
+        client resuming a file continues from the checkpoint when it was 
+        written to the same outfile.
+    outdir : Directory the files of a batch (FLAG_BATCH) are written to,
+        each under its own name.
+    metrics_interval : Seconds between periodic samples in the metrics, 0 
+        for none. The receiver samples the packets it holds ahead of a gap.
+
+    A client that offers a delta transfer (FLAG_DELTA) while outfile holds
+    an earlier version of its file gets the block signature of outfile and
+    sends only what changed (see delta.py). The new file is rebuilt next to
+    outfile and replaces it once its digest has been verified.
 
     Exceptions:
     -----------
@@ -171,17 +688,482 @@ def receive(sock: socket, client_addr: tuple, start_pkt: int, rcv_window: int, d
     which the server waits for a new client.
     """
 
-def server(ip: str, port: int, discard: int):
+def server(ip: str, port: int, discard: int, outfile: str='output.jpg', metrics_path: str=None, mss: int=MAX_MSS, ack_every: int=ACK_EVERY, ack_delay: float=ACK_DELAY, checkpoint_dir: str='.', outdir: str='received', metrics_interval: float=0.0):
+    checkpoint = None
+    basis = None
+
+    # Offset to resume file `fid` from, 0 unless an earlier transfer into outfile was cut short
+    def resume(fid: int, size: int):
+        nonlocal checkpoint
+        checkpoint = Checkpoint.load(checkpoint_dir, fid, size)
+        if checkpoint is None or checkpoint.outfile != os.path.abspath(outfile):
+            checkpoint = Checkpoint(checkpoint_dir, fid, size, os.path.abspath(outfile))
+        return checkpoint.offset
+
+    # The existing outfile a delta transfer can build on, None if it is missing or empty
+    def delta():
+        nonlocal basis
+        basis = Basis(outfile) if os.path.isfile(outfile) and os.path.getsize(outfile) else None
+        return basis
+
     # Using 'with open' so that if any exceptions are raised the socket closes.
     with socket(AF_INET, SOCK_DGRAM) as sock: 
+        sock.setsockopt(SOL_SOCKET, SO_RCVBUF, RCVBUF_SIZE)
         sock.bind((ip, port)) # Binds socket to IP and port
+        info(f'Serving on {ip}:{sock.getsockname()[1]}') # The port the system picked when port is 0
         while True:
             try:
                 start_pkt = 1 # Starting packet
-                c_addr, agreed_window = handshake_server(sock) # Handshake with client
-                if receive(sock, c_addr, start_pkt, agreed_window, discard): # Recieves file from users 
+                metrics = TransferMetrics('server', interval=metrics_interval)
+                with metrics.phase('handshake'):
+                    c_addr, agreed_window, features, agreed_mss = handshake_server(sock, mss=mss, resume=resume, delta=delta) # Handshake with client
+                metrics.peer = c_addr
+                resumed = checkpoint if features & FLAG_RESUME else None
+                if resumed:
+                    metrics.resumed_from = resumed.offset
+                replaced = basis if features & FLAG_DELTA else None
+                if replaced:
+                    with metrics.phase('signature'):
+                        send_signature(sock, c_addr, agreed_window, features, replaced.signature(), agreed_mss)
+                with metrics.phase('data'):
+                    out = outdir if features & FLAG_BATCH else replaced.temp if replaced else outfile
+                    done = receive(sock, c_addr, start_pkt, agreed_window, discard, out, features, metrics, agreed_mss, ack_every, ack_delay, resumed, replaced) # Recieves file from users 
+                if metrics_path:
+                    append_jsonl(metrics_path, metrics)
+                if done:
                     # Exit after exactly one successful transfer  
                     break
             except RuntimeError as e: # Handles any runtime excpetions raised and prints the to terminal
                 print('Server', e)
-                continue
\ No newline at end of file
+                continue
+
+# How long a finished session stays around to answer a resent FIN (seconds)
+SESSION_LINGER = 2.0
+
+"""
+    Description
+    -----------
+    Per-client connection state for the multi-client server. A session starts
+    when a SYN arrives from a new address and moves through
+
+        SYN_RCVD -> ESTABLISHED -> CLOSED
+
+    SYN_RCVD resends the SYN-ACK on its RTO until the client's ACK (or, if that
+    ACK was lost, its first data packet) arrives. ESTABLISHED hands packets to
+    a Receiver. CLOSED only answers resent FINs until the session lingers out.
+    Sessions never block or read the socket; serve() feeds them datagrams 
+    with handle() and drives their timers with poll().
+
+    Parameters
+    ----------
+    sock : Bound UDP socket shared by all sessions, used for sending.
+    client_addr : IP/port tuple of the client.
+    syn_flags : Flags of the client's SYN, carrying the offered features.
+    rcv_window : Server-advertised receive window (packets).
+    features : Feature flags the server is willing to use.
+    discard_seq : Sequence number this session drops once, for testing.
+    outfile : File path where this client's file is written, or the
+        directory for its batch of files with FLAG_BATCH.
+    now : Current time.monotonic().
+    offset, truncate : Where in outfile the data goes, see Receiver.
+    max_retry : Maximum SYN-ACK retransmissions before the session is dropped.
+    mss : Payload bytes per DATA packet, sent in the SYN-ACK with FLAG_MSS.
+    ack_every, ack_delay : Delayed ACK policy, see Receiver.
+    checkpoint : Checkpoint of a resumable transfer, its offset is sent in the
+        SYN-ACK with FLAG_RESUME, see Receiver.
+    sink : Called with the received data instead of writing outfile, see
+        Receiver.
+    client_window : The client's window from its SYN's WINDOW_OPTION, the 
+        window is then agreed here and sent in full with the SYN-ACK.
+    metrics_interval : Seconds between periodic samples in the metrics.
+"""
+class Session:
+    SYN_RCVD = 'SYN_RCVD'
+    ESTABLISHED = 'ESTABLISHED'
+    CLOSED = 'CLOSED'
+
+    def __init__(self, sock: socket, client_addr: tuple, syn_flags: int, rcv_window: int, features: int, discard_seq: int, outfile: str, now: float, offset: int=0, truncate: bool=True, max_retry: int=5, mss: int=DATA_LEN, ack_every: int=ACK_EVERY, ack_delay: float=ACK_DELAY, checkpoint: Checkpoint=None, sink=None, client_window: int=None, metrics_interval: float=0.0):
+        self.sock = sock
+        self.client_addr = client_addr
+        self.rcv_window = rcv_window if client_window is None else min(rcv_window, client_window)
+        self.client_window = client_window
+        self.features = syn_flags & features # Only echo features we both support
+        self.discard_seq = discard_seq
+        self.outfile = outfile
+        self.offset = offset
+        self.truncate = truncate
+        self.max_retry = max_retry
+        self.mss = mss
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.checkpoint = checkpoint
+        self.sink = sink
+        self.rtt = RttEstimator()
+        self.metrics = TransferMetrics('server', client_addr, metrics_interval)
+        if checkpoint:
+            self.metrics.resumed_from = checkpoint.offset
+        self.created = now
+        self.rx = None
+        self.state = self.SYN_RCVD
+        self.last_active = now
+        self.retries = 0
+        # Makes a packet with a SYN ACK flag with our receiving window
+        option = MSS_OPTION.pack(mss) if self.features & FLAG_MSS else b''
+        if self.features & FLAG_RESUME:
+            option += RESUME_OPTION.pack(checkpoint.fid, checkpoint.offset)
+        if client_window is not None:
+            option += WINDOW_OPTION.pack(self.rcv_window)
+        self.synack_pkt = make_packet(0, 0, FLAG_SYN | FLAG_ACK | self.features, min(self.rcv_window, max_window(0)), option)
+        self.send_synack(now)
+
+    def send_synack(self, now: float):
+        self.sock.sendto(self.synack_pkt, self.client_addr)
+        self.sent_at = now
+        self.deadline = now + self.rtt.rto
+        info(f'{self.client_addr}: SYN-ACK packet is sent')
+
+    # Move to ESTABLISHED with the agreed window and start receiving the file
+    def establish(self, window: int):
+        self.state = self.ESTABLISHED
+        self.deadline = None
+        self.metrics.phases['handshake'] = monotonic() - self.created
+        self.rx = Receiver(self.sock, self.client_addr, 1, window, self.discard_seq, self.outfile, self.features, self.offset, self.truncate, self.metrics, mss=self.mss,
+                           ack_every=self.ack_every, ack_delay=self.ack_delay, checkpoint=self.checkpoint, sink=self.sink)
+        info(f'{self.client_addr}: Connection established' + (f', writing to {self.outfile}' if self.outfile else ''))
+
+    # Process one datagram from this session's client
+    def handle(self, data: bytes, now: float):
+        self.last_active = now
+        if self.state == self.SYN_RCVD:
+            _, _, c_flags, c_wnd = parse_header(data[:HEADER_LEN]) if len(data) >= HEADER_LEN else (0, 0, 0, 0)
+            if c_flags & FLAG_SYN: # Our SYN-ACK was lost, the client resent its SYN (DATA packets never carry SYN)
+                self.send_synack(now)
+                return
+            if len(data) == HEADER_LEN and c_flags & FLAG_ACK: # Handshake complete
+                if self.retries == 0: # Karn's rule: skip the sample if the SYN-ACK was resent
+                    self.rtt.sample(now - self.sent_at)
+                    self.metrics.add_rtt(now - self.sent_at)
+                self.establish(self.rcv_window if self.client_window is not None else min(self.rcv_window, c_wnd))
+                return
+            # A data packet means the client got our SYN-ACK but its ACK was lost
+            self.establish(self.rcv_window)
+        if self.state == self.ESTABLISHED:
+            if self.rx.on_packet(data):
+                self.rx.close()
+                self.metrics.phases['data'] = self.metrics.data_seconds
+                self.state = self.CLOSED
+                self.deadline = now + SESSION_LINGER
+        elif self.rx.fin_ack is not None: # CLOSED: our FIN-ACK was lost, answer the resent FIN
+            header = self.rx.header
+            if len(data) >= header.size and header.unpack_from(data)[2] & FLAG_FIN:
+                self.sock.sendto(self.rx.fin_ack, self.client_addr)
+
+    """
+        Description
+        -----------
+        Run this session's timers: SYN-ACK retransmission, delayed ACKs, 
+        idle eviction and the linger time after close.
+
+        Returns
+        -------
+        bool : True when the session is finished and can be forgotten.
+    """
+    def poll(self, now: float, idle_timeout: float=SESSION_IDLE_TIMEOUT):
+        if self.state == self.CLOSED:
+            return now >= self.deadline
+        if now - self.last_active >= idle_timeout:
+            info(f'{self.client_addr}: Session idle for {idle_timeout:.0f} s, dropping it')
+            self.abort()
+            return True
+        if self.state == self.SYN_RCVD and now >= self.deadline:
+            self.retries += 1
+            if self.retries >= self.max_retry:
+                info(f'{self.client_addr}: Client did not finish handshake')
+                return True
+            self.rtt.backoff()
+            info(f'{self.client_addr}: Timeout - resend SYN-ACK')
+            self.send_synack(now)
+        elif self.state == self.ESTABLISHED:
+            self.rx.poll(now)
+        return False
+
+    # Time of the next timer event, or None
+    def next_deadline(self, idle_timeout: float=SESSION_IDLE_TIMEOUT):
+        if self.state == self.CLOSED:
+            return self.deadline
+        idle_at = self.last_active + idle_timeout
+        if self.state == self.ESTABLISHED and self.rx.ack_deadline is not None:
+            return min(self.rx.ack_deadline, idle_at)
+        return idle_at if self.deadline is None else min(self.deadline, idle_at)
+
+    # Release the output file of a session that did not finish
+    def abort(self):
+        if self.state == self.ESTABLISHED:
+            self.rx.close()
+
+"""
+    Description
+    -----------
+    Run a long-lived UDP transfer service that accepts any number of clients
+    concurrently on one port. Datagrams are demultiplexed by client address
+    into independent Session state machines, each with its own output file,
+    window, discard setting and timers. The socket is non-blocking and
+    driven by a selector, so no client can stall the others. Sessions that 
+    stay silent for idle_timeout seconds are evicted.
+
+    Clients that split one file over parallel streams send FLAG_RANGE with a
+    RANGE_OPTION in their SYN. All streams with the same client IP and 
+    transfer id share one output file, which the first of them preallocates
+    to the full size, and each stream writes its own byte range into it.
+    The transfer is forgotten once its last stream has ended and the whole
+    file arrived, once a stream timed out, or once no further stream showed
+    up for idle_timeout seconds.
+
+    Parameters
+    ----------
+    ip : Local IP address to bind the listening socket to.
+    port : UDP port number to listen on, 0 for any free port.
+    discard : Sequence number every session drops once, for retransmission 
+        testing.
+    outfile : Output path template. {n} is replaced by a running session
+        number, {ip} and {port} by the client's address.
+    rcv_window : Server-advertised receive window (packets).
+    idle_timeout : Seconds of silence after which a session is dropped.
+    features : Feature flags the server is willing to use.
+    reuse_port : Set SO_REUSEPORT so several worker processes can bind the 
+        same port and let the kernel spread clients across them.
+    worker : Worker number, available as {worker} in the outfile template.
+    generation : How often the worker was restarted, available as {generation}.
+        A restarted worker skips names that already exist, since they may be 
+        files its earlier run finished.
+    report : Optional callback, called with the stats dict (sessions, 
+        completed, dropped, bytes) every time a session ends.
+    metrics_path : Append the metrics of every session that ends to this 
+        file, one JSON object per line.
+    mss : Largest payload per DATA packet accepted, see handshake_server.
+    ack_every, ack_delay : Delayed ACK policy of every session, see Receiver.
+    checkpoint_dir : Directory for the checkpoints of resumable transfers. A
+        client resuming a file continues writing the output file named in 
+        its checkpoint, whatever the outfile template says now.
+    outdir : Output directory template for batches of files (FLAG_BATCH),
+        with the same fields as outfile.
+    metrics_interval : Seconds between periodic samples in the metrics of
+        every session, see server().
+"""
+def serve(ip: str, port: int, discard: int, outfile: str='output-{n}.jpg', rcv_window: int=15, idle_timeout: float=SESSION_IDLE_TIMEOUT, features: int=FLAG_EXT | FLAG_SR | FLAG_RANGE | FLAG_MSS | FLAG_RESUME | FLAG_COMPRESS | FLAG_FEC | FLAG_BATCH, reuse_port: bool=False, worker: int=0, generation: int=0, report=None, metrics_path: str=None, mss: int=MAX_MSS, ack_every: int=ACK_EVERY, ack_delay: float=ACK_DELAY, checkpoint_dir: str='.', outdir: str='received-{n}', metrics_interval: float=0.0):
+    sessions = {} # client address -> Session
+    # (client ip, transfer id) -> the output file shared by the streams of one file, its size, the streams
+    # still running, the bytes the finished ones wrote, and when the last of them ended
+    ranged = {}
+    stream_of = {} # Session -> key in ranged of the parallel transfer it is a stream of
+    count = 0 # Sessions started, for naming the output files
+    stats = {'sessions': 0, 'completed': 0, 'dropped': 0, 'bytes': 0}
+
+    # Output name for the next session from `template`
+    def new_name(template: str, addr: tuple):
+        nonlocal count
+        while True:
+            count += 1
+            name = template.format(n=count, ip=addr[0], port=addr[1], worker=worker, generation=generation)
+            # Only a restarted worker can find its own names taken, unless the template does not number sessions
+            if not generation or not os.path.exists(name) or '{n' not in template:
+                return name
+
+    # Count a session that is being forgotten
+    def retire(sess):
+        key = stream_of.pop(sess, None)
+        if key:
+            entry = ranged[key]
+            entry['streams'] -= 1
+            entry['bytes'] += sess.rx.pos - sess.offset if sess.rx else 0
+            entry['ended'] = monotonic()
+            # Forget the file once its last stream finished it, or a stream timed out and the client gives up
+            if not entry['streams'] and (entry['bytes'] >= entry['size'] or sess.state != Session.CLOSED):
+                del ranged[key]
+        stats['completed' if sess.state == Session.CLOSED else 'dropped'] += 1
+        stats['bytes'] += sess.metrics.payload_bytes
+        if report:
+            report(stats)
+        if metrics_path:
+            append_jsonl(metrics_path, sess.metrics)
+
+    buf = bytearray(MAX_DATAGRAM) # Every datagram is received into this buffer, probing SYNs are the largest
+    view = memoryview(buf)
+
+    with socket(AF_INET, SOCK_DGRAM) as sock, DefaultSelector() as sel:
+        if reuse_port: # Share the port with the other workers
+            sock.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+        sock.setsockopt(SOL_SOCKET, SO_RCVBUF, RCVBUF_SIZE)
+        sock.bind((ip, port)) # Binds socket to IP and port
+        sock.setblocking(False)
+        sel.register(sock, EVENT_READ)
+        info(f'Serving on {ip}:{sock.getsockname()[1]}' + (f' (worker {worker})' if reuse_port else ''))
+        try:
+            while True:
+                # Sleep until a datagram arrives or the next session timer is due
+                deadlines = [d for d in (sess.next_deadline(idle_timeout) for sess in sessions.values()) if d is not None]
+                timeout = max(0, min(deadlines) - monotonic()) if deadlines else None
+                if sel.select(timeout):
+                    while True: # Drain everything that is queued on the socket
+                        try:
+                            n, addr = sock.recvfrom_into(buf)
+                        except BlockingIOError:
+                            break
+                        data = view[:n] # No copy, sessions copy what they keep
+                        now = monotonic()
+                        sess = sessions.get(addr)
+                        if sess is None or sess.state == Session.CLOSED:
+                            # Only a bare SYN may open a new session
+                            if len(data) < HEADER_LEN:
+                                continue
+                            _, _, c_flags, _ = parse_header(data[:HEADER_LEN])
+                            if not (c_flags & FLAG_SYN) or (c_flags & FLAG_ACK):
+                                if sess is not None:
+                                    sess.handle(data, now)
+                                continue
+                            if sess is not None: # The client starts over after a finished transfer
+                                retire(sess)
+                            stats['sessions'] += 1
+                            info(f'{addr}: SYN packet is received')
+                            offset, truncate, agreed_mss, checkpoint = 0, True, DATA_LEN, None
+                            syn_flags = c_flags # Options are located by the flags the client sent
+                            offered = read_option(data, syn_flags, FLAG_EXT)
+                            client_window = offered[0] if c_flags & features & FLAG_EXT and offered else None
+                            offered = read_option(data, syn_flags, FLAG_MSS)
+                            if c_flags & features & FLAG_MSS and offered:
+                                agreed_mss = min(offered[0], mss)
+                            else:
+                                c_flags &= ~FLAG_MSS
+                            if c_flags & features & FLAG_BATCH: # A batch is neither resumable nor split over streams
+                                c_flags &= ~(FLAG_RESUME | FLAG_RANGE)
+                            resume = read_option(data, syn_flags, FLAG_RESUME)
+                            if not resume or c_flags & FLAG_RANGE: # Parallel streams are not resumable
+                                c_flags &= ~FLAG_RESUME
+                            if c_flags & features & FLAG_RESUME:
+                                checkpoint = Checkpoint.load(checkpoint_dir, *resume)
+                            if checkpoint:
+                                # An earlier attempt was cut short, continue its output file
+                                name, offset, truncate = checkpoint.outfile, checkpoint.offset, not checkpoint.offset
+                            elif c_flags & features & FLAG_RANGE and len(data) >= HEADER_LEN + RANGE_OPTION.size:
+                                # One stream of a parallel transfer, all streams write into one file
+                                transfer_id, offset, size = RANGE_OPTION.unpack_from(data, HEADER_LEN)
+                                key = addr[0], transfer_id
+                                if key not in ranged: # First stream: name and preallocate the file
+                                    name = new_name(outfile, addr)
+                                    with open(name, 'wb') as f:
+                                        f.truncate(size)
+                                    ranged[key] = {'name': name, 'size': size, 'streams': 0, 'bytes': 0, 'ended': None}
+                                entry = ranged[key]
+                                entry['streams'] += 1
+                                name = entry['name']
+                                truncate = False
+                            else:
+                                c_flags &= ~FLAG_RANGE # Without the option there is no range to agree on
+                                template = outdir if c_flags & features & FLAG_BATCH else outfile
+                                name = new_name(template, addr)
+                                if c_flags & features & FLAG_RESUME:
+                                    checkpoint = Checkpoint(checkpoint_dir, *resume, os.path.abspath(name))
+                            window = fit_window(sock, rcv_window, EXT_HEADER_LEN + agreed_mss)
+                            sessions[addr] = Session(sock, addr, c_flags, window, features, discard, name, now, offset, truncate,
+                                                     mss=agreed_mss, ack_every=ack_every, ack_delay=ack_delay, checkpoint=checkpoint, client_window=client_window,
+                                                     metrics_interval=metrics_interval)
+                            if c_flags & features & FLAG_RANGE:
+                                stream_of[sessions[addr]] = key
+                        else:
+                            sess.handle(data, now)
+
+                now = monotonic()
+                for addr, sess in list(sessions.items()):
+                    if sess.poll(now, idle_timeout):
+                        del sessions[addr]
+                        retire(sess)
+                # Files whose remaining streams never showed up
+                for key in [key for key, entry in ranged.items() if not entry['streams'] and now - entry['ended'] >= idle_timeout]:
+                    del ranged[key]
+        finally:
+            for sess in sessions.values():
+                sess.abort()
+
+
+# A worker that dies sooner than this after starting is restarted only once this has passed (seconds)
+WORKER_RESTART_DELAY = 1.0
+
+# Entry point of one worker process: serve() on the shared port, reporting stats to the supervisor
+def _worker(queue: Queue, worker: int, generation: int, ip: str, port: int, discard: int, outfile: str, metrics_path: str, mss: int, ack_every: int, ack_delay: float, checkpoint_dir: str, outdir: str, metrics_interval: float):
+    if trace.enabled: # The parent's writer thread does not survive the fork
+        trace.configure(trace.level, trace.path, 'a')
+    try:
+        serve(ip, port, discard, outfile, reuse_port=True, worker=worker, generation=generation,
+              report=lambda stats: queue.put((worker, os.getpid(), dict(stats))), metrics_path=metrics_path, mss=mss, ack_every=ack_every, ack_delay=ack_delay, checkpoint_dir=checkpoint_dir, outdir=outdir,
+              metrics_interval=metrics_interval)
+    except KeyboardInterrupt:
+        pass
+
+"""
+    Description
+    -----------
+    Run serve() in `workers` processes that all bind the same port with 
+    SO_REUSEPORT, so the kernel shards client flows across them and the 
+    server uses as many cores as there are workers. The calling process 
+    supervises them: a worker that exits is restarted, and the stats the 
+    workers report are summed up and printed whenever they change.
+
+    Since the kernel picks the worker from a hash of the client address, all
+    packets of one client reach the same worker. When a worker is restarted
+    the hash may move some clients to another worker; those sessions fail
+    and must be retried. The restarted worker numbers its sessions past the
+    files its earlier run left, see serve().
+
+    Parameters
+    ----------
+    ip : Local IP address to bind the listening sockets to.
+    port : UDP port number shared by the workers.
+    discard : Sequence number every session drops once, for testing.
+    outfile : Output path template, see serve(). Should contain {worker} or
+        {ip}/{port}, since every worker numbers its sessions from 1.
+    workers : Number of worker processes.
+    metrics_path : File every worker appends per-session metrics to, see serve().
+    mss : Largest payload per DATA packet accepted, see handshake_server.
+    ack_every, ack_delay : Delayed ACK policy, see Receiver.
+    checkpoint_dir : Directory the workers keep checkpoints in, see serve().
+    outdir : Output directory template for batches, see serve(). Should
+        contain {worker} like outfile.
+    metrics_interval : Seconds between periodic metric samples, see serve().
+"""
+def serve_workers(ip: str, port: int, discard: int, outfile: str='output-{worker}-{n}.jpg', workers: int=os.cpu_count(), metrics_path: str=None, mss: int=MAX_MSS, ack_every: int=ACK_EVERY, ack_delay: float=ACK_DELAY, checkpoint_dir: str='.', outdir: str='received-{worker}-{n}', metrics_interval: float=0.0):
+    queue = Queue()
+    procs = {} # worker number -> (Process, start time)
+    generations = {} # worker number -> times it was restarted
+    latest = {} # (worker, pid) -> last stats reported by that worker process
+
+    def start(worker):
+        generations[worker] = generations.get(worker, -1) + 1
+        proc = Process(target=_worker, args=(queue, worker, generations[worker], ip, port, discard, outfile, metrics_path, mss, ack_every, ack_delay, checkpoint_dir, outdir, metrics_interval), daemon=True)
+        proc.start()
+        procs[worker] = (proc, monotonic())
+
+    def totals():
+        keys = ('sessions', 'completed', 'dropped', 'bytes')
+        return {k: sum(stats[k] for stats in latest.values()) for k in keys}
+
+    for worker in range(workers):
+        start(worker)
+    info(f'Supervising {workers} workers on {ip}:{port}')
+    try:
+        while True:
+            try:
+                worker, pid, stats = queue.get(timeout=WORKER_RESTART_DELAY)
+                latest[worker, pid] = stats
+                info(f'Workers total: {totals()}')
+            except Empty:
+                pass
+            for worker, (proc, started) in list(procs.items()):
+                if not proc.is_alive() and monotonic() - started >= WORKER_RESTART_DELAY:
+                    info(f'Worker {worker} (pid {proc.pid}) exited with code {proc.exitcode}, restarting it')
+                    start(worker)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc, _ in procs.values():
+            proc.terminate()
+        info(f'Workers total: {totals()}')
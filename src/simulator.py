@@ -0,0 +1,314 @@
+import argparse
+import heapq
+import itertools
+import os
+import random
+from time import perf_counter
+from client import Sender
+from server import Receiver, ACK_EVERY, ACK_DELAY
+from congestion import Pacer, make_controller
+from compression import Compressor
+from fec import FecEncoder
+from drtp import *
+from metrics import TransferMetrics
+from proxy import Link
+from benchmark import parse_list, parse_size, print_table
+
+# Period of the synthetic file contents, a prime so that no two packets
+# within 65521 packets of each other carry the same bytes
+PATTERN_LEN = 65521
+
+# Placeholder addresses, the simulated network delivers by endpoint
+CLIENT_ADDR = ('10.0.0.1', 50000)
+SERVER_ADDR = ('10.0.1.2', 8088)
+
+"""
+    Description
+    -----------
+    File contents generated on demand from a seed, so that files of any size
+    can be simulated without keeping them in memory or on disk. Supports
+    len() and slicing like the memoryview send_data hands to the Sender.
+
+    Parameters
+    ----------
+    size : File size in bytes.
+    seed : Seed for the contents.
+"""
+class SyntheticFile:
+
+    def __init__(self, size: int, seed: int=0):
+        self.size = size
+        block = random.Random(seed).getrandbits(PATTERN_LEN * 8).to_bytes(PATTERN_LEN, 'little')
+        self.pattern = block + block # Any slice up to PATTERN_LEN bytes is contiguous
+        self.view = memoryview(self.pattern)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index: slice):
+        start, stop, _ = index.indices(self.size)
+        offset = start % PATTERN_LEN
+        return self.view[offset:offset + max(stop - start, 0)]
+
+    # True when `data` equals the contents starting at byte `pos`
+    def matches(self, pos: int, data):
+        done = 0
+        while done < len(data):
+            offset = (pos + done) % PATTERN_LEN
+            n = min(len(data) - done, PATTERN_LEN)
+            if data[done:done + n] != self.view[offset:offset + n]:
+                return False
+            done += n
+        return True
+
+
+"""
+    Description
+    -----------
+    Receiver that checks the payloads against the file that was sent instead
+    of writing them out. `mismatch` is the offset of the first write buffer
+    that differed from the source, None while everything matches.
+"""
+class CheckingReceiver(Receiver):
+
+    def __init__(self, source: SyntheticFile, *args, **kwargs):
+        super().__init__(*args, outfile=os.devnull, **kwargs)
+        self.source = source
+        self.mismatch = None
+
+    def flush(self):
+        if self.wlen:
+            with memoryview(self.wbuf) as view:
+                if self.mismatch is None and not self.source.matches(self.pos, view[:self.wlen]):
+                    self.mismatch = self.pos
+            self.pos += self.wlen
+            self.wlen = 0
+
+
+"""
+    Description
+    -----------
+    Stand-in for a UDP socket: datagrams passed to sendto cross `link` on the
+    simulated network and are then handed to `deliver`. The data is copied,
+    as a real socket would, because the protocol code reuses its buffers.
+"""
+class SimSocket:
+
+    def __init__(self, network, link: Link, deliver):
+        self.network = network
+        self.link = link
+        self.deliver = deliver
+
+    def sendto(self, data, addr: tuple):
+        self.network.send(self.link, bytes(data), self.deliver)
+
+
+"""
+    Description
+    -----------
+    Discrete-event network with a virtual clock. Datagrams in transit are
+    kept in a heap ordered by arrival time; the clock jumps straight to the
+    next arrival or timer, so an RTO costs no wall-clock time.
+
+    Parameters
+    ----------
+    seed : Seed for the random drops, jitter and reordering of the links.
+
+    Attributes
+    ----------
+    now : Current virtual time in seconds.
+    events : Number of datagrams delivered so far.
+"""
+class Network:
+
+    def __init__(self, seed: int=0):
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.pending = [] # heap of (arrival time, counter, deliver, datagram)
+        self.counter = 0
+        self.events = 0
+
+    def send(self, link: Link, data: bytes, deliver):
+        arrival = link.schedule(len(data), self.now, self.rng)
+        if arrival is not None:
+            self.counter += 1
+            heapq.heappush(self.pending, (arrival, self.counter, deliver, data))
+
+    # Arrival time of the next datagram, None if nothing is in transit
+    def next_arrival(self):
+        return self.pending[0][0] if self.pending else None
+
+    # Advance the clock to the next arrival and deliver it
+    def deliver_next(self):
+        arrival, _, deliver, data = heapq.heappop(self.pending)
+        self.now = max(self.now, arrival)
+        self.events += 1
+        deliver(data)
+
+"""
+    Description
+    -----------
+    Simulate the data phase of one transfer: a Sender and a Receiver, the
+    same code send_data and the server run, exchange packets over a
+    simulated network on a virtual clock. The handshake and the teardown are
+    not simulated; the transfer starts with the agreed window and features.
+
+    Parameters
+    ----------
+    size : File size in bytes.
+    window : Agreed window in packets.
+    mode : 'gbn' or 'sr'.
+    cc : Congestion controller name, see congestion.py.
+    forward : Link for DATA packets.
+    reverse : Link for ACKs, by default a copy of `forward`.
+    seed : Seed for the file contents and the network.
+    discard : Sequence number the receiver drops once, like -d.
+    initial_rto, min_rto : Retransmission timer settings, see RttEstimator.
+    mss : Payload bytes per DATA packet.
+    ack_every, ack_delay : Delayed ACK policy of the receiver, see Receiver.
+    pace, pace_rate : Pace the sender, see client.transfer.
+    compress : Send the file as compressed frames (FLAG_COMPRESS). The
+        synthetic file does not compress, so this exercises the raw blocks.
+    fec, fec_group : Send FEC parity, see client.transfer.
+    time_limit : Virtual seconds after which the transfer counts as stuck.
+
+    Returns
+    -------
+    result : Dict with ok, sim_seconds, goodput_mbps, retransmissions,
+        rto_events, fast_retransmits, acks, repaired, dropped, events and wall_seconds.
+"""
+def simulate(size: int, window: int, mode: str='gbn', cc: str='none', forward: Link=None, reverse: Link=None, seed: int=0, discard: int=0, initial_rto: float=INITIAL_RTO, min_rto: float=MIN_RTO, mss: int=DATA_LEN, ack_every: int=ACK_EVERY, ack_delay: float=ACK_DELAY, pace: bool=False, pace_rate: float=None, compress: bool=False, fec: bool=False, fec_group: int=None, time_limit: float=3600.0):
+    started = perf_counter()
+    forward = forward or Link()
+    reverse = reverse or forward.copy()
+    features = FLAG_EXT | (FLAG_SR if mode == 'sr' else 0) | (FLAG_COMPRESS if compress else 0) | (FLAG_FEC if fec else 0)
+    net = Network(seed)
+    source = SyntheticFile(size, seed)
+    clock = lambda: net.now
+
+    sender = None
+    rx = CheckingReceiver(source, SimSocket(net, reverse, lambda data: sender.handle(data, net.now)), CLIENT_ADDR, 1, window, discard,
+                          features=features, metrics=TransferMetrics('server', CLIENT_ADDR), clock=clock, mss=mss,
+                          ack_every=ack_every, ack_delay=ack_delay)
+    sender = Sender(SimSocket(net, forward, rx.on_packet), SERVER_ADDR, 1, window, Compressor(source) if compress else source, features,
+                    RttEstimator(initial_rto, min_rto), make_controller(cc, window), TransferMetrics('client', SERVER_ADDR), mss,
+                    Pacer(pace_rate / 8 if pace_rate else None) if pace else None, FecEncoder(fec_group) if fec else None)
+
+    sender.start(net.now)
+    while not sender.done and net.now <= time_limit:
+        arrival = net.next_arrival()
+        deadline = min((d for d in (sender.next_deadline(), rx.next_deadline()) if d is not None), default=None)
+        if arrival is None and deadline is None: # Nothing in flight and nothing to resend
+            break
+        if deadline is None or (arrival is not None and arrival <= deadline):
+            net.deliver_next()
+        else:
+            net.now = deadline
+            rx.poll(net.now) # A delayed ACK is due first, it may stop the sender's timer
+            sender.poll(net.now)
+    m = sender.metrics
+    if compress: # Goodput in file bytes, like send_data
+        sender.view.close()
+        m.compressed_bytes, m.payload_bytes = m.payload_bytes, sender.view.consumed
+    m.data_finished(net.now)
+    rx.close()
+
+    return {
+        'ok': sender.done and rx.expected == sender.final_seq and rx.metrics.payload_bytes == size and rx.mismatch is None,
+        'sim_seconds': m.data_seconds,
+        'goodput_mbps': m.goodput_mbps,
+        'retransmissions': m.retransmissions,
+        'rto_events': m.rto_events,
+        'fast_retransmits': m.fast_retransmits,
+        'acks': rx.metrics.acks_sent,
+        'repaired': rx.metrics.fec_repaired,
+        'dropped': forward.dropped + reverse.dropped + rx.metrics.discarded,
+        'events': net.events,
+        'wall_seconds': perf_counter() - started,
+    }
+
+# Average of the values of `key` over runs
+def mean(runs: list, key: str):
+    return sum(r[key] for r in runs) / len(runs)
+
+# Columns of the simulator table: result key and format
+COLUMNS = [('size', '{}'), ('window', '{}'), ('loss', '{:.3f}'), ('mode', '{}'), ('cc', '{}'), ('ok', '{}'),
+           ('sim_seconds', '{:.2f}'), ('goodput_mbps', '{:.2f}'), ('retransmissions', '{:.1f}'), ('rto_events', '{:.1f}'),
+           ('acks', '{:.0f}'), ('repaired', '{:.1f}'), ('resends_per_loss', '{:.2f}'), ('wall_seconds', '{:.2f}')]
+
+"""
+    Description
+    -----------
+    Run a matrix of simulated transfers: every combination of file size,
+    window, loss rate, mode and congestion controller, `--runs` times with
+    consecutive seeds. Prints one row per combination with the number of
+    byte-exact transfers, mean virtual duration and goodput, and the
+    retransmissions per lost datagram. Exits with status 1 and the failing
+    seeds if any transfer was not byte-exact.
+
+    Example
+    -------
+    python3 simulator.py --sizes 100K,10M --windows 15,64 --loss 0,0.01,0.05 --modes gbn,sr --runs 20
+"""
+def main():
+    parser = argparse.ArgumentParser(description='Deterministic DRTP simulator on a virtual clock')
+    parser.add_argument('--sizes', type=parse_list(parse_size), help='File sizes, e.g. 100K,1G', default='100K,1M')
+    parser.add_argument('--windows', type=parse_list(int), help='Agreed window sizes', default='3,15')
+    parser.add_argument('--loss', type=parse_list(float), help='Loss rates (0-1), both directions', default='0,0.01,0.05')
+    parser.add_argument('--modes', type=parse_list(str), help='Transfer modes', default='gbn,sr')
+    parser.add_argument('--cc', type=parse_list(str), help='Congestion controllers', default='none')
+    parser.add_argument('--delay', type=float, help='One-way delay in seconds', default=0.025)
+    parser.add_argument('--jitter', type=float, help='Delay jitter in seconds', default=0.0)
+    parser.add_argument('--reorder', type=float, help='Probability that a datagram is held back', default=0.0)
+    parser.add_argument('--rate', type=float, help='Link speed in Mbit/s', default=None)
+    parser.add_argument('--queue', type=int, help='Datagrams queued at the link before tail drop', default=None)
+    parser.add_argument('--initial-rto', type=float, help='Initial retransmission timeout in seconds', default=INITIAL_RTO)
+    parser.add_argument('--min-rto', type=float, help='Lower bound of the retransmission timeout in seconds', default=MIN_RTO)
+    parser.add_argument('--mss', type=int, help='Payload bytes per DATA packet', default=DATA_LEN)
+    parser.add_argument('--ack-every', type=int, help='Go-Back-N: ACK every N in-order packets', default=ACK_EVERY)
+    parser.add_argument('--ack-delay', type=float, help='Go-Back-N: longest ACK delay in seconds', default=ACK_DELAY)
+    parser.add_argument('--pace', help="Pace the sender: 'rtt', or a rate in Mbit/s")
+    parser.add_argument('--compress', action='store_true', help='Send the data as compressed frames')
+    parser.add_argument('--fec', help="FEC: data packets per parity packet, or 'auto'")
+    parser.add_argument('--runs', type=int, help='Runs per matrix point, with consecutive seeds', default=10)
+    parser.add_argument('--seed', type=int, help='First seed', default=1)
+    parser.add_argument('--log', choices=list(LOG_LEVELS), help='Log level of the protocol code', default='off')
+    args = parser.parse_args()
+
+    trace.configure(LOG_LEVELS[args.log])
+    rate = args.rate * 1e6 if args.rate else None
+    pace_rate = None if args.pace in (None, 'rtt') else float(args.pace) * 1e6
+
+    results, failures = [], []
+    for size, window, loss, mode, cc in itertools.product(args.sizes, args.windows, args.loss, args.modes, args.cc):
+        runs = []
+        for seed in range(args.seed, args.seed + args.runs):
+            link = Link(args.delay, args.jitter, loss, args.reorder, rate=rate, queue=args.queue)
+            run = simulate(size, window, mode, cc, link, seed=seed, initial_rto=args.initial_rto, min_rto=args.min_rto, mss=args.mss,
+                           ack_every=args.ack_every, ack_delay=args.ack_delay, pace=args.pace is not None, pace_rate=pace_rate, compress=args.compress,
+                           fec=args.fec is not None, fec_group=None if args.fec in (None, 'auto') else int(args.fec))
+            if not run['ok']:
+                failures.append(f'size={size} window={window} loss={loss} mode={mode} cc={cc} seed={seed}')
+            runs.append(run)
+        dropped = sum(r['dropped'] for r in runs)
+        results.append({
+            'size': size, 'window': window, 'loss': loss, 'mode': mode, 'cc': cc,
+            'ok': f'{sum(r["ok"] for r in runs)}/{len(runs)}',
+            'sim_seconds': mean(runs, 'sim_seconds'),
+            'goodput_mbps': mean(runs, 'goodput_mbps'),
+            'retransmissions': mean(runs, 'retransmissions'),
+            'rto_events': mean(runs, 'rto_events'),
+            'acks': mean(runs, 'acks'),
+            'repaired': mean(runs, 'repaired'),
+            'resends_per_loss': sum(r['retransmissions'] for r in runs) / dropped if dropped else None,
+            'wall_seconds': sum(r['wall_seconds'] for r in runs),
+        })
+
+    print_table(results, COLUMNS)
+    for line in failures:
+        print('Failed:', line)
+    if failures:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
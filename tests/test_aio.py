@@ -0,0 +1,45 @@
+import asyncio
+import os
+
+import pytest
+
+from aio import connect, start_server
+from drtp import *
+
+# Compressible text, then random bytes, so that compression has something to skip as well
+def payload(n: int):
+    text = b'%d: the quick brown fox jumps over the lazy dog\n' % n * 2000
+    return text + os.urandom(50_000 + n * 1234)
+
+# Several clients at once against one DRTPServer, each sends its data in two parts
+async def exchange(mode: str, compress: bool, clients: int=3):
+    received = []
+    done = asyncio.Event()
+
+    async def handle(stream):
+        received.append(await stream.read())
+        if len(received) == clients:
+            done.set()
+
+    async def send(data: bytes):
+        async with await connect(*address, window=16, mode=mode, compress=compress) as conn:
+            await conn.send(data[:10_000])
+            await conn.send(data[10_000:])
+            return conn.features
+
+    async with await start_server(handle, '127.0.0.1', 0) as server:
+        address = server.address
+        sent = [payload(n) for n in range(clients)]
+        features = await asyncio.wait_for(asyncio.gather(*(send(data) for data in sent)), 30)
+        await asyncio.wait_for(done.wait(), 5)
+    return sent, received, features
+
+# Every client's bytes arrive intact and in order, in both modes, with and without compression
+@pytest.mark.parametrize('mode', ['gbn', 'sr'])
+@pytest.mark.parametrize('compress', [False, True])
+def test_concurrent_connections(mode, compress):
+    sent, received, features = asyncio.run(exchange(mode, compress))
+    assert sorted(received) == sorted(sent)
+    for agreed in features:
+        assert bool(agreed & FLAG_SR) == (mode == 'sr')
+        assert bool(agreed & FLAG_COMPRESS) == compress
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from batch import BatchReader, BatchWriter, list_files
+
+@pytest.mark.parametrize('name, parts', [
+    ('a.txt', ['a.txt']),
+    ('photos/2024/b.jpg', ['photos', '2024', 'b.jpg']),
+    ('../../etc/passwd', ['etc', 'passwd']),
+    ('/etc/passwd', ['etc', 'passwd']),
+    ('a/./b//c', ['a', 'b', 'c']),
+    ('a/../../b', ['a', 'b']),
+    ('..\\..\\windows\\x', ['windows', 'x']),
+    ('..', ['file-1']),
+    ('', ['file-1']),
+])
+def test_path_for_stays_inside(tmp_path, name, parts):
+    writer = BatchWriter(str(tmp_path))
+    path = writer.path_for(name)
+    assert path == os.path.join(str(tmp_path), *parts)
+    assert os.path.commonpath([str(tmp_path), os.path.realpath(path)]) == str(tmp_path)
+
+def make_tree(root):
+    (root / 'photos' / 'sub').mkdir(parents=True)
+    (root / 'photos' / 'a.jpg').write_bytes(os.urandom(5000))
+    (root / 'photos' / 'sub' / 'b.jpg').write_bytes(os.urandom(1))
+    (root / 'photos' / 'empty').write_bytes(b'')
+    (root / 'notes.txt').write_bytes(b'hello\n' * 300)
+
+def test_list_files(tmp_path):
+    make_tree(tmp_path)
+    names = [name for _, name in list_files([str(tmp_path / 'photos'), str(tmp_path / 'notes.txt')])]
+    assert names == ['photos/a.jpg', 'photos/empty', 'photos/sub/b.jpg', 'notes.txt']
+
+# The entry stream rebuilds every file, fed in pieces of any size
+@pytest.mark.parametrize('piece', [1, 7, 992, 1 << 20])
+def test_round_trip(tmp_path, piece):
+    make_tree(tmp_path / 'src')
+    files = list_files([str(tmp_path / 'src' / 'photos'), str(tmp_path / 'src' / 'notes.txt')])
+    reader = BatchReader(files)
+    stream = b''.join(iter(lambda: bytes(reader.read(992)), b''))
+    reader.close()
+    assert reader.sent == len(files)
+    writer = BatchWriter(str(tmp_path / 'dst'))
+    for pos in range(0, len(stream), piece):
+        writer.feed(stream[pos:pos + piece])
+    writer.close()
+    assert writer.received == len(files)
+    assert writer.file_bytes == reader.file_bytes
+    for path, name in files:
+        with open(path, 'rb') as a, open(tmp_path / 'dst' / name, 'rb') as b:
+            assert a.read() == b.read()
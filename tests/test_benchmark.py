@@ -0,0 +1,14 @@
+import pytest
+
+from benchmark import make_input, run_transfer
+from proxy import Link
+
+# A short transfer through the loss proxy arrives intact, the losses are repaired by retransmission
+@pytest.mark.parametrize('mode', ['gbn', 'sr'])
+def test_lossy_round_trip(tmp_path, mode):
+    infile = str(tmp_path / 'input.bin')
+    make_input(infile, 200_000, seed=1)
+    result = run_transfer(str(tmp_path), infile, 15, mode, 'reno', Link(delay=0.002, loss=0.05), seed=1, timeout=60)
+    assert result['ok']
+    assert result['dropped'] > 0
+    assert result['retransmissions'] > 0
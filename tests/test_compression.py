@@ -0,0 +1,89 @@
+import io
+import os
+import zlib
+
+import pytest
+
+from compression import *
+
+BLOCK = 16 * 1024
+
+def sample_file():
+    text = b'the quick brown fox jumps over the lazy dog\n' * (BLOCK // 44 + 1)
+    return text[:BLOCK] + os.urandom(BLOCK) + text[:BLOCK // 3] # Compressible, random, a short tail
+
+def read_all(stream, n: int):
+    parts = []
+    while True:
+        data = stream.read(n)
+        if not data:
+            return b''.join(bytes(p) for p in parts)
+        assert len(data) == n or not stream.read(n) # Short only at the end
+        parts.append(data)
+
+# Split the frame stream into (kind, length, body)
+def frames(stream: bytes):
+    pos, out = 0, []
+    while pos < len(stream):
+        kind, length = BLOCK_HEADER.unpack_from(stream, pos)
+        pos += BLOCK_HEADER.size
+        out.append((kind, length, stream[pos:pos + length]))
+        pos += length
+    assert pos == len(stream)
+    return out
+
+def test_frames():
+    data = sample_file()
+    comp = Compressor(data, block=BLOCK)
+    stream = read_all(comp, 1000)
+    comp.close()
+    parsed = frames(stream)
+    assert [kind for kind, _, _ in parsed] == [BLOCK_ZLIB, BLOCK_RAW, BLOCK_ZLIB]
+    assert zlib.decompress(parsed[0][2]) == data[:BLOCK]
+    assert parsed[1][2] == data[BLOCK:2 * BLOCK]
+    assert (comp.consumed, comp.produced) == (len(data), len(stream))
+
+# Fed in pieces of any size, headers split over packets included
+@pytest.mark.parametrize('piece', [1, 5, 992, 100_000])
+def test_round_trip(piece):
+    data = sample_file()
+    comp = Compressor(data, block=BLOCK)
+    stream = read_all(comp, 992)
+    comp.close()
+    out = []
+    dec = Decompressor(lambda b: out.append(bytes(b)))
+    for pos in range(0, len(stream), piece):
+        dec.feed(stream[pos:pos + piece])
+    assert b''.join(out) == data
+    assert dec.consumed == len(stream)
+
+# A stream source such as batch.BatchReader is read block by block
+def test_stream_source():
+    data = sample_file()
+    comp = Compressor(io.BytesIO(data), block=BLOCK)
+    stream = read_all(comp, 992)
+    comp.close()
+    out = []
+    Decompressor(lambda b: out.append(bytes(b))).feed(stream)
+    assert b''.join(out) == data
+
+def test_empty_file():
+    comp = Compressor(b'')
+    assert comp.read(992) == b''
+    comp.close()
+
+def test_unknown_block_kind():
+    with pytest.raises(RuntimeError):
+        Decompressor(lambda b: None).feed(BLOCK_HEADER.pack(7, 3) + b'abc')
+
+def test_truncated_zlib_block():
+    packed = zlib.compress(b'x' * 1000)[:-4]
+    with pytest.raises(RuntimeError):
+        Decompressor(lambda b: None).feed(BLOCK_HEADER.pack(BLOCK_ZLIB, len(packed)) + packed)
+
+# The thread can be stopped before the end of the file
+def test_close_early():
+    comp = Compressor(os.urandom(BLOCK * 10), block=BLOCK)
+    comp.read(10)
+    comp.close()
+    assert not comp.thread.is_alive()
@@ -0,0 +1,80 @@
+import os
+import random
+
+import pytest
+
+from delta import *
+
+def make_basis(tmp_path, data: bytes):
+    path = tmp_path / 'basis'
+    path.write_bytes(data)
+    return Basis(str(path))
+
+# Encode `new` against the basis, decode it again, return the stream size and the encoder
+def round_trip(basis: Basis, new: bytes, piece: int=992):
+    enc = DeltaEncoder(memoryview(new), Signature(basis.signature()))
+    stream = b''.join(iter(lambda: bytes(enc.read(piece)), b''))
+    out = bytearray()
+    dec = DeltaDecoder(basis, out.extend)
+    for pos in range(0, len(stream), piece):
+        dec.feed(stream[pos:pos + piece])
+    dec.close()
+    assert bytes(out) == new
+    assert enc.copied + enc.literal == len(new)
+    return len(stream), enc
+
+@pytest.fixture(scope='module')
+def old():
+    return random.Random(1).randbytes(1_000_000)
+
+def test_unchanged(tmp_path, old):
+    basis = make_basis(tmp_path, old)
+    size, enc = round_trip(basis, old)
+    assert enc.literal == len(old) % basis.block # Only the tail after the last full block
+    assert size < 1000
+
+def test_edits(tmp_path, old):
+    new = bytearray(old)
+    new[1000:1000] = b'INSERTED' * 100 # Shifts everything after it
+    new[500_000:504_000] = os.urandom(4000)
+    del new[700_000:700_100]
+    size, enc = round_trip(make_basis(tmp_path, old), bytes(new))
+    assert size < 30_000
+    assert enc.copied > 900_000
+
+def test_unrelated(tmp_path, old):
+    new = os.urandom(200_000)
+    size, enc = round_trip(make_basis(tmp_path, old), new)
+    assert enc.copied == 0
+    assert size >= len(new)
+
+@pytest.mark.parametrize('new', [b'', b'short', bytes(5000)])
+def test_small_files(tmp_path, old, new):
+    round_trip(make_basis(tmp_path, old), new)
+
+# A basis smaller than a block has an empty signature, everything is sent as it is
+def test_tiny_basis(tmp_path, old):
+    basis = make_basis(tmp_path, b'x' * 100)
+    assert len(Signature(basis.signature())) == 0
+    size, enc = round_trip(basis, old[:50_000], piece=1)
+    assert enc.literal == 50_000
+
+def test_block_size():
+    assert block_size(0) == DELTA_MIN_BLOCK
+    assert block_size(1 << 20) == 1024
+    assert block_size(1 << 30) == 32768
+    assert block_size(1 << 40) == DELTA_MAX_BLOCK
+
+def test_malformed_signature():
+    with pytest.raises(RuntimeError):
+        Signature(b'\0' * 5)
+    with pytest.raises(RuntimeError):
+        Signature(SIGNATURE_HEADER.pack(4096, 1024) + b'\0' * 7)
+
+# A copy beyond the end of the basis is refused instead of writing short data
+def test_copy_beyond_basis(tmp_path):
+    basis = make_basis(tmp_path, bytes(4096))
+    dec = DeltaDecoder(basis, lambda data: None)
+    with pytest.raises(RuntimeError):
+        dec.feed(OP.pack(OP_COPY, 3, 2))
+    dec.close()
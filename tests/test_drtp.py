@@ -0,0 +1,109 @@
+import pytest
+
+from drtp import *
+
+# (raw, reference, space) -> absolute sequence number
+@pytest.mark.parametrize('raw, reference, space, expected', [
+    (5, 5, 1 << 16, 5),
+    (10, 5, 1 << 16, 10), # Ahead
+    (0, 5, 1 << 16, 0), # Behind
+    (2, 65534, 1 << 16, 65538), # Wrapped: 65536 + 2
+    (65535, 65537, 1 << 16, 65535), # Behind across the wrap
+    (65535, 1 << 16 | 1, 1 << 16, 65535),
+    (3, 3 * 65536 + 65530, 1 << 16, 4 * 65536 + 3), # Several wraps in
+    (0, (1 << 32) - 1, 1 << 32, 1 << 32),
+])
+def test_unwrap_seq(raw, reference, space, expected):
+    assert unwrap_seq(raw, reference, space) == expected
+
+# Every number within half the space around the reference survives the trip over the wire
+@pytest.mark.parametrize('reference', [0, 1, 32767, 65535, 65536, 1_000_000])
+def test_unwrap_seq_round_trip(reference):
+    space = seq_space(0)
+    for seq in range(max(0, reference - 32768), reference + 32767, 97):
+        assert unwrap_seq(seq % space, reference, space) == seq
+
+def syn(flags: int, *options):
+    return make_packet(0, 0, FLAG_SYN | flags, 0, b''.join(options))
+
+# Options follow the header in the order of SYN_OPTIONS, whichever of them are present
+def test_read_option_order():
+    data = syn(FLAG_RANGE | FLAG_MSS | FLAG_RESUME, RANGE_OPTION.pack(7, 100, 1000), MSS_OPTION.pack(1400), RESUME_OPTION.pack(42, 1000))
+    flags = FLAG_SYN | FLAG_RANGE | FLAG_MSS | FLAG_RESUME
+    assert read_option(data, flags, FLAG_RANGE) == (7, 100, 1000)
+    assert read_option(data, flags, FLAG_MSS) == (1400,)
+    assert read_option(data, flags, FLAG_RESUME) == (42, 1000)
+
+def test_read_option_skips_absent_options():
+    data = syn(FLAG_RESUME, RESUME_OPTION.pack(42, 1000))
+    flags = FLAG_SYN | FLAG_RESUME
+    assert read_option(data, flags, FLAG_RESUME) == (42, 1000)
+    assert read_option(data, flags, FLAG_MSS) is None
+    assert read_option(data, flags, FLAG_RANGE) is None
+
+def test_read_option_truncated():
+    data = syn(FLAG_MSS | FLAG_RESUME, MSS_OPTION.pack(1400), RESUME_OPTION.pack(42, 1000)[:10])
+    flags = FLAG_SYN | FLAG_MSS | FLAG_RESUME
+    assert read_option(data, flags, FLAG_MSS) == (1400,)
+    assert read_option(data, flags, FLAG_RESUME) is None
+
+# The SYN-ACK has no RANGE_OPTION even when it echoes FLAG_RANGE
+def test_read_option_synack():
+    data = make_packet(0, 0, FLAG_SYN | FLAG_ACK | FLAG_RANGE | FLAG_MSS | FLAG_RESUME, 15, MSS_OPTION.pack(1200) + RESUME_OPTION.pack(42, 512))
+    flags = FLAG_SYN | FLAG_ACK | FLAG_RANGE | FLAG_MSS | FLAG_RESUME
+    assert read_option(data, flags, FLAG_MSS, SYNACK_OPTIONS) == (1200,)
+    assert read_option(data, flags, FLAG_RESUME, SYNACK_OPTIONS) == (42, 512)
+
+# WINDOW_OPTION comes last, after the options of the older features
+def test_read_option_window():
+    data = syn(FLAG_EXT | FLAG_MSS, MSS_OPTION.pack(1400), WINDOW_OPTION.pack(100_000))
+    flags = FLAG_SYN | FLAG_EXT | FLAG_MSS
+    assert read_option(data, flags, FLAG_EXT) == (100_000,)
+    assert read_option(data, flags, FLAG_MSS) == (1400,)
+    data = make_packet(0, 0, FLAG_SYN | FLAG_ACK | FLAG_EXT | FLAG_MSS, 0xFFFF, MSS_OPTION.pack(1200) + WINDOW_OPTION.pack(70_000))
+    assert read_option(data, FLAG_SYN | FLAG_ACK | FLAG_EXT | FLAG_MSS, FLAG_EXT, SYNACK_OPTIONS) == (70_000,)
+
+def test_pack_packet_into():
+    buf = bytearray(EXT_HEADER_LEN + 4)
+    end = pack_packet_into(buf, 1 << 20, 5, FLAG_ACK, 99, b'data', EXT_HEADER)
+    assert end == len(buf)
+    assert EXT_HEADER.unpack_from(buf) == (1 << 20, 5, FLAG_ACK, 99)
+    assert bytes(buf[EXT_HEADER_LEN:]) == b'data'
+
+def test_rtt_first_sample():
+    rtt = RttEstimator()
+    assert rtt.srtt is None and rtt.rto == INITIAL_RTO
+    rtt.sample(0.1)
+    assert rtt.srtt == 0.1
+    assert rtt.rttvar == 0.05
+    assert rtt.rto == pytest.approx(0.1 + 4 * 0.05)
+
+def test_rtt_smoothing():
+    rtt = RttEstimator()
+    rtt.sample(0.1)
+    rtt.sample(0.2)
+    assert rtt.rttvar == pytest.approx(0.75 * 0.05 + 0.25 * 0.1)
+    assert rtt.srtt == pytest.approx(0.875 * 0.1 + 0.125 * 0.2)
+    assert rtt.rto == pytest.approx(rtt.srtt + 4 * rtt.rttvar)
+
+def test_rtt_bounds_and_backoff():
+    rtt = RttEstimator(min_rto=0.05, max_rto=1.0)
+    for _ in range(50):
+        rtt.sample(0.001)
+    assert rtt.rto == 0.05 # Clamped from below
+    for _ in range(10):
+        rtt.backoff()
+    assert rtt.rto == 1.0 # Doubled up to the bound
+    rtt.sample(0.001) # A valid sample ends the backoff
+    assert rtt.rto == 0.05
+
+# Configuring the log again does not register another exit hook
+def test_event_log_registers_close_once(tmp_path, monkeypatch):
+    import atexit
+    hooks = []
+    monkeypatch.setattr(atexit, 'register', hooks.append)
+    log = EventLog(interval=0.01)
+    for _ in range(3):
+        log.configure(LOG_PACKET, str(tmp_path / 'events.jsonl'))
+    log.configure(LOG_OFF)
+    assert hooks == [log.close]
@@ -0,0 +1,70 @@
+import os
+import random
+
+import pytest
+
+from fec import FecEncoder, FecDecoder, group_size, FEC_MIN_GROUP, FEC_MAX_GROUP
+
+def encode(payloads, start: int=10):
+    enc = FecEncoder(len(payloads))
+    enc.begin(start, 0, 0, 2 * len(payloads))
+    for payload in payloads:
+        full = enc.add(payload)
+    assert full
+    return enc.close()
+
+# Any one packet of a group, of any length, is rebuilt from the parity and the others
+@pytest.mark.parametrize('lost', range(5))
+def test_repair_one_lost(lost):
+    rng = random.Random(lost)
+    payloads = [os.urandom(rng.randint(1, 992)) for _ in range(5)]
+    payloads[lost] = payloads[lost][:-1] + b'\0' # Trailing zeros survive as well
+    start, count, lengths, parity = encode(payloads)
+    assert (start, count) == (10, 5)
+    assert len(parity) == max(map(len, payloads))
+    dec = FecDecoder()
+    for i, payload in enumerate(payloads):
+        if i != lost:
+            dec.add(start + i, payload)
+    missing, payload = dec.repair(start, count, lengths, parity)
+    assert missing == [start + lost]
+    assert payload == payloads[lost]
+    assert dec.done == start + count
+
+def test_repair_two_lost():
+    payloads = [os.urandom(100) for _ in range(4)]
+    start, count, lengths, parity = encode(payloads)
+    dec = FecDecoder()
+    dec.add(start, payloads[0])
+    dec.add(start + 1, payloads[1])
+    missing, payload = dec.repair(start, count, lengths, parity)
+    assert missing == [start + 2, start + 3]
+    assert payload is None
+
+# A packet rebuilt before it came in was only late, not lost
+def test_late_original():
+    payloads = [os.urandom(100) for _ in range(3)]
+    start, count, lengths, parity = encode(payloads)
+    dec = FecDecoder()
+    dec.add(start, payloads[0])
+    dec.add(start + 2, payloads[2])
+    assert dec.repair(start, count, lengths, parity)[1] == payloads[1]
+    assert dec.add(start + 1, payloads[1])
+    assert not dec.add(start + 3, b'next group')
+
+# Packets of groups whose parity was lost are forgotten with the next parity
+def test_repair_forgets_older_groups():
+    dec = FecDecoder()
+    dec.add(1, b'old')
+    start, count, lengths, parity = encode([b'a', b'b'], start=5)
+    dec.add(5, b'a')
+    dec.repair(start, count, lengths, parity)
+    assert not dec.seen
+
+def test_group_size():
+    assert group_size(0) == FEC_MAX_GROUP
+    assert group_size(0.01) == 9
+    assert group_size(0.5) == FEC_MIN_GROUP
+    enc = FecEncoder()
+    enc.begin(1, 1000, 0, 16)
+    assert enc.size == 8 # At most half the window
@@ -0,0 +1,112 @@
+import os
+from socket import socket, AF_INET, SOCK_DGRAM
+from threading import Thread
+
+import pytest
+
+from client import handshake_client, send_data, teardown_client, transfer
+from drtp import *
+import server
+from server import handshake_server, receive
+
+"""
+    Description
+    -----------
+    Runs one transfer on the server side in a thread, over a loopback
+    socket: handshake_server with `features`, then receive(). `agreed`
+    holds what the handshake returned, `error` what it raised.
+"""
+class OneShotServer(Thread):
+
+    def __init__(self, outfile: str, features: int, mss: int=MAX_MSS, window: int=15):
+        super().__init__(daemon=True)
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+        self.outfile = outfile
+        self.features = features
+        self.mss = mss
+        self.window = window
+        self.agreed = None
+        self.error = None
+
+    def run(self):
+        try:
+            client_addr, window, features, mss = handshake_server(self.sock, self.window, self.features, mss=self.mss)
+            self.agreed = (window, features, mss)
+            receive(self.sock, client_addr, 1, window, outfile=self.outfile, features=features, mss=mss)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.sock.close()
+
+    def finish(self):
+        self.join(10)
+        assert not self.is_alive()
+        if self.error:
+            raise self.error
+
+@pytest.fixture
+def infile(tmp_path):
+    path = tmp_path / 'in.bin'
+    path.write_bytes(os.urandom(300_000))
+    return str(path)
+
+def same_file(a: str, b: str):
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        return fa.read() == fb.read()
+
+# A current client offers everything, a legacy server echoes no feature flags back
+def test_new_client_legacy_server(tmp_path, infile):
+    out = str(tmp_path / 'out.bin')
+    srv = OneShotServer(out, features=0)
+    srv.start()
+    transfer(*srv.address, infile, 15, mode='sr', mss=1400, compress=True, fec=True)
+    srv.finish()
+    window, features, mss = srv.agreed
+    assert features == 0 and mss == DATA_LEN # 8-byte header, Go-Back-N, plain data
+    assert same_file(infile, out)
+
+# A legacy client offers nothing, the current server falls back to the original protocol
+def test_legacy_client_new_server(tmp_path, infile):
+    out = str(tmp_path / 'out.bin')
+    srv = OneShotServer(out, features=FLAG_EXT | FLAG_SR | FLAG_MSS | FLAG_COMPRESS | FLAG_FEC)
+    srv.start()
+    with socket(AF_INET, SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        window, features, mss, _ = handshake_client(sock, srv.address, 15, 0)
+        assert (features, mss) == (0, DATA_LEN)
+        final_seq = send_data(sock, srv.address, 1, window, infile, features)
+        teardown_client(sock, srv.address, final_seq, features)
+    srv.finish()
+    assert srv.agreed[1:] == (0, DATA_LEN)
+    assert same_file(infile, out)
+
+# Both current: the features both offer are agreed, the payload size is the smaller offer
+def test_new_client_new_server(tmp_path, infile):
+    out = str(tmp_path / 'out.bin')
+    srv = OneShotServer(out, features=FLAG_EXT | FLAG_SR | FLAG_MSS, mss=1200)
+    srv.start()
+    transfer(*srv.address, infile, 15, mode='sr', mss=1400, compress=True)
+    srv.finish()
+    window, features, mss = srv.agreed
+    assert features == FLAG_EXT | FLAG_SR | FLAG_MSS # FLAG_COMPRESS is not one the server offers
+    assert mss == 1200
+    assert same_file(infile, out)
+
+# With FLAG_EXT a window past the 16-bit header field is agreed in full, without it the header's largest
+@pytest.mark.parametrize('features, expected', [(FLAG_EXT, 100_000), (0, 0xFFFF)])
+def test_large_window(tmp_path, infile, monkeypatch, features, expected):
+    monkeypatch.setattr(server, 'fit_window', lambda sock, window, datagram: window) # No socket buffer holds such a window
+    out = str(tmp_path / 'out.bin')
+    srv = OneShotServer(out, features=features, window=200_000)
+    srv.start()
+    with socket(AF_INET, SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        window, agreed, _, _ = handshake_client(sock, srv.address, 100_000, FLAG_EXT)
+        assert (window, agreed) == (expected, features)
+        final_seq = send_data(sock, srv.address, 1, window, infile, agreed)
+        teardown_client(sock, srv.address, final_seq, agreed)
+    srv.finish()
+    assert srv.agreed[:2] == (expected, features)
+    assert same_file(infile, out)
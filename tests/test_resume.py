@@ -0,0 +1,50 @@
+import pytest
+
+from resume import Checkpoint, file_digest
+
+FID = 0x1234
+SIZE = 1000
+
+@pytest.fixture
+def outfile(tmp_path):
+    path = tmp_path / 'out.bin'
+    path.write_bytes(bytes(600))
+    return str(path)
+
+def test_save_and_load(tmp_path, outfile):
+    Checkpoint(str(tmp_path), FID, SIZE, outfile).save(500)
+    ckpt = Checkpoint.load(str(tmp_path), FID, SIZE)
+    assert (ckpt.outfile, ckpt.offset) == (outfile, 500)
+    assert Checkpoint.load(str(tmp_path), FID, SIZE + 1) is None # Another file of the same id
+    ckpt.remove()
+    assert Checkpoint.load(str(tmp_path), FID, SIZE) is None
+
+# The output file lost bytes the checkpoint counts as written
+def test_load_output_shorter_than_offset(tmp_path, outfile):
+    Checkpoint(str(tmp_path), FID, SIZE, outfile).save(700)
+    assert Checkpoint.load(str(tmp_path), FID, SIZE) is None
+
+@pytest.mark.parametrize('content', [
+    '',
+    '{"size": 1000, "outf',
+    '\xff\xfe',
+    'null',
+    '[]',
+    '"checkpoint"',
+    '{"size": 1000}',
+    '{"size": 1000, "outfile": null, "offset": 0}',
+    '{"size": 1000, "outfile": "OUTFILE", "offset": "500"}',
+])
+def test_load_corrupt_file(tmp_path, outfile, content):
+    ckpt = Checkpoint(str(tmp_path), FID, SIZE, outfile)
+    with open(ckpt.path, 'w', encoding='latin-1') as f:
+        f.write(content.replace('OUTFILE', outfile))
+    assert Checkpoint.load(str(tmp_path), FID, SIZE) is None
+
+# The digest of the first bytes continues into the digest of the whole file
+def test_file_digest_prefix(tmp_path):
+    path = tmp_path / 'data'
+    path.write_bytes(b'abcdef' * 1000)
+    digest = file_digest(str(path), 3000)
+    digest.update(b'abcdef' * 500)
+    assert digest.digest() == file_digest(str(path)).digest()
@@ -0,0 +1,94 @@
+import pytest
+
+from client import Sender
+from drtp import *
+from metrics import TransferMetrics
+from proxy import Link
+from simulator import CheckingReceiver, Network, SimSocket, SyntheticFile, CLIENT_ADDR, SERVER_ADDR
+
+# Socket stand-in that records what the Sender sends
+class Wire:
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append(bytes(data))
+
+def ack(sender: Sender, seq: int):
+    return sender.header.pack(0, seq % sender.space, FLAG_ACK, 0)
+
+def gbn_sender(packets: int=10, window: int=5):
+    wire = Wire()
+    sender = Sender(wire, SERVER_ADDR, 1, window, bytes(packets * DATA_LEN))
+    sender.start(0.0)
+    return sender, wire
+
+# The timer only restarts when an ACK moves base, duplicate and stale ACKs leave it running
+def test_gbn_timer_restarts_only_when_base_moves():
+    sender, _ = gbn_sender()
+    first = sender.timer
+    sender.handle(ack(sender, 0), 0.1) # Duplicate: nothing ACKed yet
+    assert sender.timer == first
+    sender.handle(ack(sender, 2), 0.2)
+    assert sender.base == 3
+    assert sender.timer == 0.2 + sender.rtt.rto
+    moved = sender.timer
+    sender.handle(ack(sender, 1), 0.3) # Stale
+    sender.handle(ack(sender, 2), 0.3) # Duplicate
+    assert sender.timer == moved
+
+# Three duplicate ACKs resend base alone, further duplicates resend nothing
+def test_gbn_fast_retransmit_resends_base_once():
+    sender, wire = gbn_sender()
+    sender.handle(ack(sender, 1), 0.1)
+    sent = len(wire.sent)
+    for _ in range(10):
+        sender.handle(ack(sender, 1), 0.11)
+    resent = wire.sent[sent:]
+    assert len(resent) == 1
+    assert sender.header.unpack_from(resent[0])[0] == 2
+    assert sender.metrics.fast_retransmits == 1
+
+# Drive a Sender and a Receiver over simulated links until the transfer ends, like simulator.simulate
+def run(size: int, window: int, features: int, forward: Link, start_seq: int=1, mss: int=DATA_LEN, seed: int=1, time_limit: float=600):
+    net = Network(seed)
+    source = SyntheticFile(size, seed)
+    sender = None
+    rx = CheckingReceiver(source, SimSocket(net, forward.copy(), lambda data: sender.handle(data, net.now)), CLIENT_ADDR, start_seq, window,
+                          features=features, metrics=TransferMetrics('server', CLIENT_ADDR), clock=lambda: net.now, mss=mss)
+    sender = Sender(SimSocket(net, forward, rx.on_packet), SERVER_ADDR, start_seq, window, source, features, mss=mss)
+    sender.start(net.now)
+    while not sender.done and net.now <= time_limit:
+        arrival = net.next_arrival()
+        deadline = min((d for d in (sender.next_deadline(), rx.next_deadline()) if d is not None), default=None)
+        if deadline is None or (arrival is not None and arrival <= deadline):
+            net.deliver_next()
+        else:
+            net.now = deadline
+            rx.poll(net.now)
+            sender.poll(net.now)
+    rx.close()
+    assert sender.done
+    assert rx.expected == sender.final_seq
+    assert rx.metrics.payload_bytes == size
+    assert rx.mismatch is None # Byte-exact
+    return sender, rx
+
+LOSSY = dict(delay=0.01, jitter=0.001, loss=0.05, reorder=0.05)
+
+@pytest.mark.parametrize('features', [0, FLAG_EXT, FLAG_SR, FLAG_EXT | FLAG_SR, FLAG_EXT | FLAG_FEC])
+@pytest.mark.parametrize('seed', [1, 2])
+def test_lossy_reordering_link(features, seed):
+    sender, _ = run(300_000, 16, features, Link(**LOSSY), seed=seed)
+    assert sender.metrics.retransmissions > 0
+
+# Sequence numbers wrap around in the middle of the transfer, in both header sizes
+@pytest.mark.parametrize('features, space', [(0, 1 << 16), (FLAG_SR, 1 << 16), (FLAG_EXT, 1 << 32), (FLAG_EXT | FLAG_SR, 1 << 32)])
+def test_sequence_wraparound(features, space):
+    run(200 * DATA_LEN + 123, 16, features, Link(**LOSSY), start_seq=space - 100)
+
+# The last packet is short, and an empty file is only a FIN away
+@pytest.mark.parametrize('size', [0, 1, DATA_LEN, DATA_LEN + 1])
+def test_file_sizes(size):
+    run(size, 4, FLAG_EXT, Link(0.01, loss=0.1))
@@ -0,0 +1,208 @@
+import json
+import os
+from socket import socket, AF_INET, SOCK_DGRAM, timeout as sock_timeout
+from threading import Thread
+from time import monotonic, sleep
+
+import pytest
+
+import server
+import client
+from client import handshake_client, send_data, teardown_client
+from drtp import *
+
+class StopServing(Exception):
+    pass
+
+# The socket serve() opens, its next read stops serve() once `stopping` is set
+class ServerSocket(socket):
+    stopping = False
+
+    def recvfrom(self, *args):
+        if self.stopping:
+            raise StopServing()
+        return super().recvfrom(*args)
+
+    def recvfrom_into(self, *args):
+        if self.stopping:
+            raise StopServing()
+        return super().recvfrom_into(*args)
+
+"""
+    Description
+    -----------
+    Runs serve() in a thread on a loopback port the system picks. Calling
+    the fixture with serve()'s keyword arguments starts it and returns its
+    address, it is stopped when the test ends.
+"""
+@pytest.fixture
+def serving(monkeypatch):
+    socks, threads = [], []
+    def make_socket(*args):
+        sock = ServerSocket(*args)
+        socks.append(sock)
+        return sock
+    monkeypatch.setattr(server, 'socket', make_socket)
+
+    def run(**kwargs):
+        try:
+            server.serve('127.0.0.1', 0, 0, **kwargs)
+        except StopServing:
+            pass
+
+    def start(**kwargs):
+        thread = Thread(target=run, kwargs=kwargs, daemon=True)
+        thread.start()
+        threads.append(thread)
+        deadline = monotonic() + 5
+        while not (socks and socks[-1].getsockname()[1]):
+            assert monotonic() < deadline, 'serve() did not bind'
+            sleep(0.01)
+        return socks[-1].getsockname()
+
+    yield start
+    for sock, thread in zip(socks, threads):
+        sock.stopping = True
+        with socket(AF_INET, SOCK_DGRAM) as wake:
+            wake.sendto(b'', sock.getsockname())
+        thread.join(5)
+
+def write_input(path, size: int):
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+def same_file(a: str, b: str):
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        return fa.read() == fb.read()
+
+# One client transfer over its own socket, returns the socket, the agreed features and the FIN's seq
+def send(address: tuple, infile: str, features: int=FLAG_EXT):
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(0.4) # As client() does
+    window, agreed, _, _ = handshake_client(sock, address, 15, features)
+    final_seq = send_data(sock, address, 1, window, infile, agreed)
+    teardown_client(sock, address, final_seq, agreed)
+    return sock, agreed, final_seq
+
+# Resend the FIN of a finished transfer, True if a FIN-ACK comes back
+def fin_answered(sock, address: tuple, features: int, seq: int):
+    header = header_for(features)
+    sock.sendto(header.pack(seq % seq_space(features), 0, FLAG_FIN, 0), address)
+    sock.settimeout(0.3)
+    try:
+        data, _ = sock.recvfrom(header.size)
+    except sock_timeout:
+        return False
+    return bool(header.unpack(data)[2] & FLAG_FIN)
+
+# Two clients at once on one socket, each gets its own session and output file
+def test_concurrent_clients(serving, tmp_path):
+    address = serving(outfile=str(tmp_path / 'out-{n}.bin'))
+    inputs = [write_input(tmp_path / 'a.bin', 400_000), write_input(tmp_path / 'b.bin', 250_000)]
+    socks, errors = [], []
+    def run(infile: str, features: int):
+        try:
+            socks.append(send(address, infile, features)[0])
+        except Exception as e:
+            errors.append(e)
+    clients = [Thread(target=run, args=(inputs[0], FLAG_EXT)), Thread(target=run, args=(inputs[1], FLAG_EXT | FLAG_SR))]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join(30)
+    for sock in socks:
+        sock.close()
+    assert not errors
+    outputs = sorted(str(path) for path in tmp_path.glob('out-*.bin'))
+    assert len(outputs) == 2
+    assert sorted(os.path.getsize(path) for path in outputs) == [250_000, 400_000]
+    for out in outputs:
+        assert any(same_file(infile, out) for infile in inputs)
+
+# A closed session lingers to answer a resent FIN, then it is forgotten
+def test_closed_session_lingers_then_retires(serving, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'SESSION_LINGER', 0.5)
+    address = serving(outfile=str(tmp_path / 'out-{n}.bin'))
+    infile = write_input(tmp_path / 'in.bin', 50_000)
+    sock, features, final_seq = send(address, infile)
+    with sock:
+        assert fin_answered(sock, address, features, final_seq) # Our FIN-ACK was lost: answered again
+        sleep(0.6)
+        assert not fin_answered(sock, address, features, final_seq) # Retired, nothing answers
+    assert same_file(infile, str(tmp_path / 'out-1.bin'))
+
+# One file over several streams is reassembled into one output file
+def test_parallel_streams_reassemble(serving, tmp_path):
+    address = serving(outfile=str(tmp_path / 'out-{n}.bin'))
+    infile = write_input(tmp_path / 'in.bin', 300_001) # Not a multiple of the streams or the payload size
+    client.client(*address, infile, 15, 'sr', streams=3)
+    assert [path.name for path in tmp_path.glob('out-*.bin')] == ['out-1.bin']
+    assert same_file(infile, str(tmp_path / 'out-1.bin'))
+
+# With an interval every session's metrics line carries the receiver's samples
+def test_receiver_samples_exported(serving, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'SESSION_LINGER', 0.1)
+    metrics_path = tmp_path / 'metrics.jsonl'
+    address = serving(outfile=str(tmp_path / 'out-{n}.bin'), metrics_path=str(metrics_path), metrics_interval=0.001)
+    send(address, write_input(tmp_path / 'in.bin', 300_000))[0].close()
+    deadline = monotonic() + 5
+    while not (metrics_path.exists() and metrics_path.read_text().endswith('\n')): # Written once the session has lingered out
+        assert monotonic() < deadline, 'no metrics exported'
+        sleep(0.02)
+    metrics = json.loads(metrics_path.read_text())
+    assert metrics['role'] == 'server' and metrics['payload_bytes'] == 300_000
+    assert metrics['samples']
+    assert all(sample['in_flight'] <= 15 for sample in metrics['samples']) # Packets kept ahead of a gap
+    assert metrics['samples'][-1]['payload_bytes'] <= 300_000
+
+# A restarted worker numbers its sessions past the files its earlier run finished
+def test_restarted_worker_keeps_earlier_files(serving, tmp_path):
+    earlier = tmp_path / 'w-0-1.bin'
+    earlier.write_bytes(b'finished before the crash')
+    address = serving(outfile=str(tmp_path / 'w-{worker}-{n}.bin'), generation=1)
+    infile = write_input(tmp_path / 'in.bin', 50_000)
+    send(address, infile)[0].close()
+    assert earlier.read_bytes() == b'finished before the crash'
+    assert same_file(infile, str(tmp_path / 'w-0-2.bin'))
+
+# A session agrees a window past the 16-bit header field in full with FLAG_EXT
+def test_session_large_window(serving, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'fit_window', lambda sock, window, datagram: window)
+    address = serving(outfile=str(tmp_path / 'out-{n}.bin'), rcv_window=200_000)
+    infile = write_input(tmp_path / 'in.bin', 100_000)
+    with socket(AF_INET, SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(0.4)
+        window, agreed, _, _ = handshake_client(sock, address, 100_000, FLAG_EXT)
+        assert window == 100_000
+        teardown_client(sock, address, send_data(sock, address, 1, window, infile, agreed), agreed)
+    assert same_file(infile, str(tmp_path / 'out-1.bin'))
+
+# Process stand-in for serve_workers: every worker exits at once, the third start ends the test
+class ExitingProcess:
+    started = []
+
+    def __init__(self, target, args, daemon):
+        self.args = args
+        self.pid = len(self.started)
+        self.exitcode = -9
+
+    def start(self):
+        self.started.append(self.args)
+        if len(self.started) == 3:
+            raise KeyboardInterrupt
+
+    def is_alive(self):
+        return False
+
+    def terminate(self):
+        pass
+
+# Every restart of a worker runs with the next generation
+def test_worker_restart_generation(monkeypatch):
+    monkeypatch.setattr(server, 'Process', ExitingProcess)
+    monkeypatch.setattr(server, 'WORKER_RESTART_DELAY', 0.01)
+    monkeypatch.setattr(ExitingProcess, 'started', [])
+    server.serve_workers('127.0.0.1', 0, 0, 'w-{worker}-{n}.bin', workers=1)
+    assert [args[1:3] for args in ExitingProcess.started] == [(0, 0), (0, 1), (0, 2)]
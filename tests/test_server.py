@@ -0,0 +1,46 @@
+import os
+from socket import socket, AF_INET, SOCK_DGRAM
+from time import monotonic
+
+from drtp import *
+from metrics import TransferMetrics
+from resume import Checkpoint
+from server import Receiver, receive
+
+# Socket stand-in that only counts what the Receiver sends
+class Wire:
+
+    def __init__(self):
+        self.sent = 0
+
+    def sendto(self, data, addr):
+        self.sent += 1
+
+# A client that goes silent mid-transfer is given up on, with what arrived written out and checkpointed
+def test_receive_gives_up_on_silent_client(tmp_path):
+    out = str(tmp_path / 'out.bin')
+    payloads = [os.urandom(DATA_LEN) for _ in range(3)]
+    with socket(AF_INET, SOCK_DGRAM) as srv, socket(AF_INET, SOCK_DGRAM) as cli:
+        srv.bind(('127.0.0.1', 0))
+        cli.bind(('127.0.0.1', 0))
+        for seq, payload in enumerate(payloads, 1):
+            cli.sendto(make_packet(seq, 0, 0, 0, payload), srv.getsockname())
+        checkpoint = Checkpoint(str(tmp_path), 1, 10 * DATA_LEN, out)
+        started = monotonic()
+        assert receive(srv, cli.getsockname(), 1, 15, outfile=out, checkpoint=checkpoint, idle_timeout=0.3) is False
+        assert 0.3 <= monotonic() - started < 5
+        assert srv.gettimeout() is None
+    with open(out, 'rb') as f:
+        assert f.read() == b''.join(payloads)
+    assert Checkpoint.load(str(tmp_path), 1, 10 * DATA_LEN).offset == 3 * DATA_LEN
+
+# With an interval the receiver samples its metrics, the packets kept ahead of a gap as in flight
+def test_receiver_samples_metrics():
+    now = [0.0]
+    metrics = TransferMetrics('server', interval=0.1)
+    rx = Receiver(Wire(), ('10.0.0.1', 5000), 1, 8, outfile=os.devnull, features=FLAG_EXT, metrics=metrics, clock=lambda: now[0])
+    for t, seq in ((0.0, 1), (0.05, 3), (0.1, 4), (0.2, 2), (0.3, 5)):
+        now[0] = t
+        rx.on_packet(EXT_HEADER.pack(seq, 0, 0, 0) + bytes(100))
+    rx.close()
+    assert [(s['in_flight'], s['payload_bytes']) for s in metrics.samples] == [(0, 100), (2, 100), (0, 400)]
@@ -0,0 +1,61 @@
+import pytest
+
+from proxy import Link
+from simulator import simulate
+
+SIZE = 1_000_000 # About a thousand packets
+WINDOW = 32
+
+# Go-Back-N over a link that reorders but never loses: a late packet costs a resend, not a window
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_gbn_reordering_without_loss(seed):
+    r = simulate(SIZE, WINDOW, 'gbn', forward=Link(0.025, reorder=0.02), seed=seed)
+    assert r['ok']
+    assert r['rto_events'] == 0
+    assert r['retransmissions'] <= 50
+
+# With jitter nearly every packet arrives out of order, the receiver keeps them
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_gbn_jitter_without_loss(seed):
+    r = simulate(SIZE, WINDOW, 'gbn', forward=Link(0.025, jitter=0.001), seed=seed)
+    assert r['ok']
+    assert r['rto_events'] == 0
+    assert r['retransmissions'] <= 100
+    assert r['sim_seconds'] < 3
+
+# Heavy loss on top of jitter still finishes
+@pytest.mark.parametrize('mode', ['gbn', 'sr'])
+def test_loss_with_jitter_finishes(mode):
+    r = simulate(SIZE, WINDOW, mode, forward=Link(0.025, jitter=0.001, loss=0.1), seed=1, time_limit=120)
+    assert r['ok']
+
+# Every mode and option delivers the file byte for byte over a lossy, reordering link
+@pytest.mark.parametrize('mode', ['gbn', 'sr'])
+@pytest.mark.parametrize('options', [
+    {},
+    {'cc': 'reno'},
+    {'cc': 'vegas'},
+    {'compress': True},
+    {'fec': True},
+    {'fec': True, 'fec_group': 4},
+    {'pace': True},
+    {'discard': 5},
+])
+def test_lossy_reordering_link(mode, options):
+    link = Link(0.01, jitter=0.0005, loss=0.03, reorder=0.03)
+    r = simulate(300_000, 16, mode, forward=link, seed=7, time_limit=300, **options)
+    assert r['ok']
+
+# A slow link with a short queue drops bursts at its tail
+@pytest.mark.parametrize('mode', ['gbn', 'sr'])
+def test_tail_drop(mode):
+    r = simulate(SIZE, WINDOW, mode, 'reno', forward=Link(0.01, rate=20e6, queue=8), seed=1, time_limit=300)
+    assert r['ok']
+    assert r['dropped'] > 0
+
+def test_deterministic():
+    link = dict(delay=0.01, jitter=0.001, loss=0.05, reorder=0.05)
+    first = simulate(200_000, 16, 'gbn', forward=Link(**link), seed=3)
+    second = simulate(200_000, 16, 'gbn', forward=Link(**link), seed=3)
+    first.pop('wall_seconds'), second.pop('wall_seconds')
+    assert first == second